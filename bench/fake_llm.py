@@ -0,0 +1,119 @@
+# ===================================================================
+# Build-A-Buddy Benchmarks: Fake LLM backend
+# Deterministic stand-in for phi-3 with the same tokenizer/model surface
+# BuddyEngine and the batcher use (__call__, encode, pad, decode,
+# batch_decode, generate). No network, GPU, torch or transformers required.
+# Latency is simulated per prefill token and per decode step, and a
+# decode step costs the same for a whole batch, like a real model on
+# matrix hardware, so batching effects show up in load tests.
+# ===================================================================
+
+import time
+import zlib
+
+import numpy as np
+
+CANNED_REPLIES = [
+    "That sounds great, tell me more about it!",
+    "I hear you. How are you feeling about that?",
+    "Ha, that's a fun one. What happened next?",
+    "I'm here for you, always happy to chat.",
+    "Interesting! I had not thought of it that way.",
+]
+
+
+class FakeTokenizer:
+    """Byte-level tokenizer: token id = byte value + 1, 0 is pad/eos."""
+
+    eos_token = "<eos>"
+    eos_token_id = 0
+
+    def __init__(self):
+        self.pad_token = None
+        self.pad_token_id = 0
+        self.padding_side = "right"
+
+    def encode(self, text: str, add_special_tokens=True):
+        return [b + 1 for b in text.encode("utf-8")]
+
+    def __call__(self, text, return_tensors=None, padding=False, add_special_tokens=True):
+        texts = [text] if isinstance(text, str) else list(text)
+        return self.pad({"input_ids": [self.encode(t) for t in texts]})
+
+    def pad(self, encoded, return_tensors=None):
+        rows = [list(r) for r in encoded["input_ids"]]
+        width = max(len(r) for r in rows)
+        ids = np.zeros((len(rows), width), dtype=np.int64)
+        mask = np.zeros_like(ids)
+        for i, row in enumerate(rows):
+            start = width - len(row) if self.padding_side == "left" else 0
+            ids[i, start:start + len(row)] = row
+            mask[i, start:start + len(row)] = 1
+        return {"input_ids": ids, "attention_mask": mask}
+
+    def decode(self, ids, skip_special_tokens=True):
+        return bytes(int(i) - 1 for i in ids if int(i) > 0).decode("utf-8", errors="ignore")
+
+    def batch_decode(self, rows, skip_special_tokens=True):
+        return [self.decode(r) for r in rows]
+
+
+class FakeCausalLM:
+    """
+    generate() appends a canned reply chosen by a hash of the prompt, so
+    identical prompts always get identical replies.
+    """
+
+    def __init__(self, prefill_ms_per_token: float = 0.02, decode_ms_per_token: float = 1.0):
+        self.prefill_ms = prefill_ms_per_token
+        self.decode_ms = decode_ms_per_token
+        self.calls = 0
+        self.rows = 0
+        self.tokens_generated = 0
+
+    def generate(self, input_ids=None, attention_mask=None, max_new_tokens=100,
+                 pad_token_id=0, stopping_criteria=None, **kwargs):
+        input_ids = np.asarray(input_ids)
+        replies = []
+        for row in input_ids:
+            prompt = bytes(int(i) - 1 for i in row if i > 0)
+            reply = CANNED_REPLIES[zlib.crc32(prompt) % len(CANNED_REPLIES)]
+            replies.append([b + 1 for b in (" " + reply).encode("utf-8")][:max_new_tokens])
+
+        time.sleep(input_ids.size * self.prefill_ms / 1000.0)
+        steps = max(len(r) for r in replies)
+        # Decode in chunks, checking stopping criteria between them
+        done = 0
+        while done < steps:
+            chunk = min(8, steps - done)
+            time.sleep(chunk * self.decode_ms / 1000.0)
+            done += chunk
+            if stopping_criteria and any(c(None, None) for c in stopping_criteria):
+                break
+        steps = done
+        replies = [r[:steps] for r in replies]
+
+        out = np.zeros((len(replies), input_ids.shape[1] + steps), dtype=np.int64)
+        out[:, :input_ids.shape[1]] = input_ids
+        for i, reply in enumerate(replies):
+            out[i, input_ids.shape[1]:input_ids.shape[1] + len(reply)] = reply
+        self.calls += 1
+        self.rows += len(replies)
+        self.tokens_generated += sum(len(r) for r in replies)
+        return out
+
+
+def install(model_name: str = None, **model_kwargs) -> FakeCausalLM:
+    """
+    Register the fake pair under the engine's model name so every
+    BuddyEngine created afterwards uses it. The fake model has no
+    past_key_values, so the prefix KV cache is switched off.
+    """
+    from ml.llm import MODEL_NAME
+    from ml.model_registry import registry
+    from ml.kv_cache import prefix_cache
+
+    model = FakeCausalLM(**model_kwargs)
+    registry.register(model_name or MODEL_NAME, FakeTokenizer(), model)
+    prefix_cache.max_bytes = 0
+    return model
@@ -0,0 +1,108 @@
+# ===================================================================
+# Build-A-Buddy Benchmarks: Load generator
+# Drives /chat, /init and /chat-history through the ASGI app in-process
+# (httpx + ASGITransport, no sockets), with a fixed number of concurrent
+# clients, a configurable number of distinct buddies, and a weighted
+# route mix. Request choices come from a seeded RNG so runs are repeatable.
+# ===================================================================
+
+import asyncio
+import random
+import time
+
+import httpx
+
+from .micro import MESSAGES, summarize
+
+DEFAULT_MIX = {"chat": 0.8, "init": 0.05, "history": 0.15}
+PERSONALITIES = ["friendly", "sarcastic", "calm", "energetic"]
+
+
+def parse_mix(spec: str) -> dict:
+    """"chat=8,init=1,history=1" -> normalized weights."""
+    mix = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        route, _, weight = part.partition("=")
+        if route not in DEFAULT_MIX:
+            raise ValueError(f"unknown route in mix: {route}")
+        mix[route] = float(weight or 1)
+    total = sum(mix.values())
+    if total <= 0:
+        raise ValueError("mix weights must sum to a positive number")
+    return {route: w / total for route, w in mix.items()}
+
+
+def _request(rng: random.Random, route: str, buddies: int):
+    n = rng.randrange(buddies)
+    username, buddy_id = f"load-user-{n}", f"load-buddy-{n}"
+    personality = PERSONALITIES[n % len(PERSONALITIES)]
+    if route == "chat":
+        return "POST", "/chat", {"json": {
+            "username": username, "buddy_id": buddy_id,
+            "personality": personality, "message": rng.choice(MESSAGES),
+        }}
+    if route == "init":
+        return "POST", "/init", {"json": {
+            "username": username, "buddy_id": buddy_id, "personality": personality,
+        }}
+    return "GET", "/chat-history", {"params": {"buddy_id": buddy_id, "limit": 20}}
+
+
+async def _drive(app, requests, concurrency: int):
+    samples = {route: [] for route in DEFAULT_MIX}
+    errors = {route: 0 for route in DEFAULT_MIX}
+    pending = iter(requests)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            for route, method, url, kwargs in pending:
+                t0 = time.perf_counter_ns()
+                try:
+                    resp = await client.request(method, url, **kwargs)
+                    failed = resp.status_code >= 400
+                except Exception as e:
+                    print(f"  {route} request failed: {e}")
+                    failed = True
+                samples[route].append(time.perf_counter_ns() - t0)
+                errors[route] += failed
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return samples, errors, elapsed
+
+
+async def _run(app, requests, concurrency: int):
+    # ASGITransport does not send lifespan events, so run startup and
+    # shutdown (migrations, write-behind flush) around the load ourselves.
+    async with app.router.lifespan_context(app):
+        return await _drive(app, requests, concurrency)
+
+
+def run_load(app, total: int = 2000, concurrency: int = 32, buddies: int = 100,
+             mix: dict = None, seed: int = 0) -> dict:
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    routes = rng.choices(list(mix), weights=list(mix.values()), k=total)
+    requests = [(route,) + _request(rng, route, buddies) for route in routes]
+
+    samples, errors, elapsed = asyncio.run(_run(app, requests, concurrency))
+    all_samples = [s for route in samples.values() for s in route]
+    results = {
+        "config": {"requests": total, "concurrency": concurrency, "buddies": buddies,
+                   "mix": mix, "seed": seed},
+        "overall": dict(summarize(all_samples, elapsed), errors=sum(errors.values()),
+                        elapsed_s=round(elapsed, 3)),
+        "routes": {
+            route: dict(summarize(samples[route], elapsed), errors=errors[route])
+            for route in samples if samples[route]
+        },
+    }
+    o = results["overall"]
+    print(f"  overall {o['throughput_per_s']}/s p50={o['p50_ms']:.2f}ms "
+          f"p95={o['p95_ms']:.2f}ms p99={o['p99_ms']:.2f}ms errors={o['errors']}")
+    for route, r in results["routes"].items():
+        print(f"  {route:8s} n={r['count']} p50={r['p50_ms']:.2f}ms "
+              f"p95={r['p95_ms']:.2f}ms p99={r['p99_ms']:.2f}ms errors={r['errors']}")
+    return results
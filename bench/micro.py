@@ -0,0 +1,102 @@
+# ===================================================================
+# Build-A-Buddy Benchmarks: Microbenchmarks
+# Times the hot per-request helpers in isolation: mood classification,
+# the Responder fallback, personality vector lookup and the DB helpers
+# in main.py. Each case is a zero-argument callable run `iterations`
+# times after a short warm-up.
+# ===================================================================
+
+import itertools
+import time
+
+import numpy as np
+
+MESSAGES = [
+    "hello there, how are you doing today?",
+    "I love this, thanks so much, it's awesome",
+    "I'm so tired and lonely, feeling down",
+    "ugh, I hate when the bus is late, so frustrated",
+    "can you tell me a joke about cats and keyboards?",
+    "what should I cook for dinner tonight with some rice",
+]
+
+
+def summarize(samples_ns, elapsed_s: float = None) -> dict:
+    """Latency percentiles (ms) and throughput for a list of nanosecond samples."""
+    if not samples_ns:
+        return {"count": 0}
+    ms = np.asarray(samples_ns, dtype=np.float64) / 1e6
+    if elapsed_s is None:
+        elapsed_s = ms.sum() / 1000.0
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "count": len(ms),
+        "throughput_per_s": round(len(ms) / elapsed_s, 2) if elapsed_s > 0 else None,
+        "mean_ms": round(float(ms.mean()), 4),
+        "p50_ms": round(float(p50), 4),
+        "p95_ms": round(float(p95), 4),
+        "p99_ms": round(float(p99), 4),
+        "max_ms": round(float(ms.max()), 4),
+    }
+
+
+def time_case(fn, iterations: int, warmup: int = 10) -> dict:
+    for _ in range(min(warmup, iterations)):
+        fn()
+    samples = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter_ns()
+        fn()
+        samples.append(time.perf_counter_ns() - t0)
+    return summarize(samples, time.perf_counter() - start)
+
+
+def build_cases(main) -> dict:
+    """
+    Benchmark cases keyed by name. `main` is the imported app module, so
+    the DB helpers run against whatever database BUDDY_DB_PATH points to.
+    """
+    from ml.mood_engine import MoodEngine
+    from ml.responder import Responder
+    from ml.vectorizer import PersonalityVectorizer, DEFAULT_VECTORS
+
+    messages = itertools.cycle(MESSAGES)
+    counter = itertools.count()
+    mood_engine = MoodEngine()
+    responder = Responder(DEFAULT_VECTORS["friendly"], "happy")
+    vectorizer = PersonalityVectorizer()
+
+    main.ensure_buddy_in_db("micro-buddy", "friendly")
+    user_id = main.ensure_user_in_db("micro-user")
+    vector = vectorizer.get_vector("micro-buddy", "friendly")
+    for i in range(50):
+        main.save_conversation(user_id, "micro-buddy", f"seed message {i}", f"seed reply {i}")
+
+    return {
+        "mood_engine.update_mood": lambda: mood_engine.update_mood(next(messages)),
+        "responder.generate_response": lambda: responder.generate_response(next(messages)),
+        "vectorizer.get_vector": lambda: vectorizer.get_vector("micro-buddy", "friendly"),
+        "db.ensure_user_in_db": lambda: main.ensure_user_in_db("micro-user"),
+        "db.ensure_buddy_in_db": lambda: main.ensure_buddy_in_db("micro-buddy", "friendly"),
+        "db.update_mood_in_db": lambda: main.update_mood_in_db("micro-buddy", "happy"),
+        "db.save_buddy_state": lambda: main.save_buddy_state("micro-buddy", "friendly", vector, "happy"),
+        "db.save_conversation": lambda: main.save_conversation(
+            user_id, "micro-buddy", f"bench message {next(counter)}", "bench reply"),
+        "db.get_history": lambda: main.get_history("micro-buddy", limit=5),
+        "db.get_history_page": lambda: main.get_history_page("micro-buddy", limit=20),
+        "db.recall_memories": lambda: main.recall_memories(user_id, next(messages)),
+    }
+
+
+def run_micro(main, iterations: int = 1000, only=None) -> dict:
+    results = {}
+    for name, fn in build_cases(main).items():
+        if only and not any(name.startswith(o) for o in only):
+            continue
+        results[name] = time_case(fn, iterations)
+        r = results[name]
+        print(f"  {name:32s} p50={r['p50_ms']:.4f}ms p99={r['p99_ms']:.4f}ms ({r['throughput_per_s']}/s)")
+    if main.write_behind:
+        main.write_behind.flush()
+    return results
@@ -0,0 +1,115 @@
+# ===================================================================
+# Build-A-Buddy Benchmarks: CLI
+# Usage (from the backend folder):
+#   python -m bench.run --suite all --fake-llm --out results.json
+#   python -m bench.run --suite load --concurrency 64 --buddies 500 \
+#       --mix chat=8,init=1,history=1 --fake-llm
+#   python -m bench.run --compare before.json after.json
+# Every run uses a fresh throwaway database unless --db is given.
+# ===================================================================
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+
+def _flatten(results: dict, prefix: str = ""):
+    """Yield (name, metrics) for every leaf dict that has latency percentiles."""
+    for key, value in results.items():
+        if isinstance(value, dict):
+            if "p50_ms" in value:
+                yield prefix + key, value
+            else:
+                yield from _flatten(value, f"{prefix}{key}.")
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as f:
+        old = dict(_flatten(json.load(f).get("results", {})))
+    with open(new_path) as f:
+        new = dict(_flatten(json.load(f).get("results", {})))
+    print(f"{'case':44s} {'p50 old':>10s} {'p50 new':>10s} {'p99 old':>10s} {'p99 new':>10s} {'change':>8s}")
+    for name in sorted(set(old) & set(new)):
+        a, b = old[name], new[name]
+        change = (b["p50_ms"] - a["p50_ms"]) / a["p50_ms"] * 100 if a["p50_ms"] else 0.0
+        print(f"{name:44s} {a['p50_ms']:10.4f} {b['p50_ms']:10.4f} "
+              f"{a['p99_ms']:10.4f} {b['p99_ms']:10.4f} {change:+7.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build-A-Buddy benchmarks")
+    parser.add_argument("--suite", choices=["micro", "load", "all"], default="all")
+    parser.add_argument("--out", help="write results JSON to this path")
+    parser.add_argument("--db", help="database path (default: fresh temp file)")
+    parser.add_argument("--fake-llm", action="store_true",
+                        help="use the deterministic fake LLM instead of phi-3")
+    parser.add_argument("--decode-ms", type=float, default=1.0,
+                        help="fake LLM latency per generated token")
+    parser.add_argument("--iterations", type=int, default=1000, help="microbenchmark iterations")
+    parser.add_argument("--only", nargs="*", help="microbenchmark name prefixes to run")
+    parser.add_argument("--requests", type=int, default=2000, help="load test request count")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--buddies", type=int, default=100, help="distinct buddies in the load test")
+    parser.add_argument("--mix", default="chat=0.8,init=0.05,history=0.15")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    # The database path is read at import time, so set it before
+    # anything under database/ (or main) is imported.
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="buddy-bench-"), "bench.db")
+    os.environ["BUDDY_DB_PATH"] = db_path
+    from database.db_init import initialize_database
+    if not args.db:
+        initialize_database()
+
+    fake_model = None
+    if args.fake_llm:
+        from bench.fake_llm import install
+        fake_model = install(decode_ms_per_token=args.decode_ms)
+
+    import main as app_main
+    from bench.load import parse_mix, run_load
+    from bench.micro import run_micro
+
+    report = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "fake_llm": args.fake_llm,
+        "db_path": db_path,
+        "results": {},
+    }
+    if args.suite in ("micro", "all"):
+        print("🏁 Microbenchmarks")
+        report["results"]["micro"] = run_micro(app_main, args.iterations, args.only)
+    if args.suite in ("load", "all"):
+        print("🏁 Load test")
+        report["results"]["load"] = run_load(
+            app_main.app, args.requests, args.concurrency, args.buddies,
+            parse_mix(args.mix), args.seed,
+        )
+
+    if fake_model is not None:
+        report["fake_llm_calls"] = {"generate_calls": fake_model.calls, "rows": fake_model.rows,
+                                    "tokens": fake_model.tokens_generated}
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📄 Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+# backend/database/db.py
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from database.db_init import DB_PATH
+
+# -------------------------------------------------------------
+# Shared SQLite access layer for Build-A-Buddy
+# -------------------------------------------------------------
+# Every helper in main.py and ml/ goes through this module instead of
+# opening its own sqlite3 connection. Each thread keeps one long-lived
+# connection (so the sqlite3 statement cache actually gets reused),
+# configured for WAL so readers never block the single writer.
+# -------------------------------------------------------------
+
+SYNCHRONOUS = os.environ.get("BUDDY_DB_SYNCHRONOUS", "NORMAL")
+CACHE_SIZE_KB = int(os.environ.get("BUDDY_DB_CACHE_KB", "20000"))
+MMAP_SIZE = int(os.environ.get("BUDDY_DB_MMAP_BYTES", str(256 * 1024 * 1024)))
+BUSY_TIMEOUT_MS = int(os.environ.get("BUDDY_DB_BUSY_TIMEOUT_MS", "5000"))
+STATEMENT_CACHE_SIZE = int(os.environ.get("BUDDY_DB_STATEMENT_CACHE", "256"))
+LOCK_RETRIES = int(os.environ.get("BUDDY_DB_LOCK_RETRIES", "3"))
+
+
+def _configure(conn: sqlite3.Connection):
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+
+
+def connect(path: str = DB_PATH) -> sqlite3.Connection:
+    """
+    Open a standalone connection configured like the pooled ones
+    (autocommit, Row factory, WAL). For long-lived jobs such as exports
+    that must not tie up a request thread's pooled connection.
+    """
+    conn = sqlite3.connect(
+        path,
+        check_same_thread=False,
+        isolation_level=None,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    conn.row_factory = sqlite3.Row
+    _configure(conn)
+    return conn
+
+
+def _is_locked(error: Exception) -> bool:
+    msg = str(error).lower()
+    return "locked" in msg or "busy" in msg
+
+
+class ConnectionPool:
+    """
+    One SQLite connection per thread, created on first use.
+
+    Connections run in autocommit mode; writes are grouped explicitly with
+    transaction(), which starts with BEGIN IMMEDIATE so lock contention is
+    resolved up front (and retried) rather than failing half-way through.
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self.retries = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns = {}   # thread ident -> (thread, connection)
+        self._pid = os.getpid()
+
+    def _connect(self) -> sqlite3.Connection:
+        return connect(self.path)
+
+    def _prune_dead(self):
+        for ident, (thread, conn) in list(self._conns.items()):
+            if not thread.is_alive():
+                del self._conns[ident]
+                conn.close()
+
+    def get_connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it if needed."""
+        if os.getpid() != self._pid:
+            # Forked worker: inherited connections must not be reused.
+            self._local = threading.local()
+            self._conns = {}
+            self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._prune_dead()
+                thread = threading.current_thread()
+                self._conns[thread.ident] = (thread, conn)
+        return conn
+
+    def _begin(self, conn: sqlite3.Connection, immediate: bool):
+        attempt = 0
+        while True:
+            try:
+                conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+                return
+            except sqlite3.OperationalError as e:
+                if not _is_locked(e) or attempt >= LOCK_RETRIES:
+                    raise
+                attempt += 1
+                self.retries += 1
+                time.sleep(0.01 * (2 ** attempt))
+
+    @contextmanager
+    def transaction(self, immediate: bool = True):
+        """
+        Run a block in one transaction on this thread's connection.
+        Nested calls join the outer transaction.
+        """
+        conn = self.get_connection()
+        if conn.in_transaction:
+            yield conn
+            return
+        self._begin(conn, immediate)
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+
+    def close_all(self):
+        with self._lock:
+            for thread, conn in self._conns.values():
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._conns.clear()
+        self._local = threading.local()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"connections": len(self._conns), "lock_retries": self.retries}
+
+
+# Shared process-wide pool
+pool = ConnectionPool()
+
+
+def get_connection() -> sqlite3.Connection:
+    return pool.get_connection()
+
+
+def transaction(immediate: bool = True):
+    return pool.transaction(immediate)
@@ -1,7 +1,9 @@
 # backend/database/db_init.py
 
+import argparse
 import sqlite3
 import os
+import sys
 
 # -------------------------------------------------------------
 # Database Initialization Script for Build-A-Buddy
@@ -12,9 +14,221 @@ import os
 
 # Paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "buildabuddy.db")
+DB_PATH = os.environ.get("BUDDY_DB_PATH", os.path.join(BASE_DIR, "buildabuddy.db"))
 SCHEMA_PATH = os.path.join(BASE_DIR, "schema.sql")
 
+# -------------------------------------------------------------
+# Schema migrations
+# -------------------------------------------------------------
+# Existing databases are upgraded in place. The applied version is
+# stored in PRAGMA user_version; each entry runs once, in order.
+# Entries are either SQL scripts or callables taking a connection.
+# schema.sql always describes the latest shape, so a fresh database
+# is stamped with the latest version instead of running them.
+# -------------------------------------------------------------
+def _enable_incremental_vacuum(connection):
+    if connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return
+    connection.commit()
+    connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    connection.execute("VACUUM")
+
+# -------------------------------------------------------------
+# Migration 4: consolidated turns
+# -------------------------------------------------------------
+# Each chat turn used to be written twice: once to conversations
+# (buddy_id, both texts) and as two rows in messages (user_id, one text
+# each). The conversion walks conversations in id order, a batch per
+# transaction, and finds each one's message pair among the messages
+# written in the same second. Converted rows are deleted from the old
+# tables in the same transaction, so an interrupted run resumes where
+# it stopped. Messages that never pair up are kept in legacy_messages.
+# Turns keep their conversation ids, so history cursors stay valid.
+# -------------------------------------------------------------
+TURN_MIGRATION_BATCH = 5000
+
+TURNS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    buddy_id TEXT NOT NULL,
+    user_message TEXT NOT NULL,
+    buddy_reply TEXT NOT NULL,
+    mood TEXT,
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    FOREIGN KEY (buddy_id) REFERENCES buddies(buddy_id) ON DELETE CASCADE
+);
+"""
+
+TURNS_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_turns_buddy_time ON turns(buddy_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_turns_user_time ON turns(user_id, timestamp);
+"""
+
+CONVERSATIONS_VIEW_SQL = """
+CREATE VIEW IF NOT EXISTS conversations AS
+    SELECT id, buddy_id, user_message, buddy_reply, timestamp FROM turns;
+"""
+
+MESSAGES_VIEW_SQL = """
+CREATE VIEW IF NOT EXISTS messages AS
+    SELECT id * 2 - 1 AS id, user_id, 'user' AS sender, user_message AS message,
+           NULL AS mood, timestamp
+    FROM turns
+    UNION ALL
+    SELECT id * 2 AS id, user_id, 'buddy' AS sender, buddy_reply AS message,
+           mood, timestamp
+    FROM turns{legacy};
+"""
+
+# Unpaired messages keep their text; negative ids keep them apart from turn ids
+LEGACY_MESSAGES_UNION = """
+    UNION ALL
+    SELECT -id AS id, user_id, sender, message, mood, timestamp
+    FROM legacy_messages"""
+
+def _object_type(connection, name: str):
+    row = connection.execute("SELECT type FROM sqlite_master WHERE name=?", (name,)).fetchone()
+    return row[0] if row else None
+
+def _find_pair(connection, user_message: str, buddy_reply: str, timestamp, taken: set):
+    """(user_id, mood, [message ids]) of a turn's message pair, or None."""
+    candidates = connection.execute(
+        """
+        SELECT id, user_id, sender, message, mood FROM messages
+        WHERE timestamp BETWEEN ? AND datetime(?, '+1 second')
+        ORDER BY id
+        """,
+        (timestamp, timestamp),
+    ).fetchall()
+    candidates = [c for c in candidates if c[0] not in taken]
+    for first, second in zip(candidates, candidates[1:]):
+        if (first[2], first[3], second[2], second[3]) == ("user", user_message, "buddy", buddy_reply):
+            return first[1], second[4], [first[0], second[0]]
+    return None
+
+def _consolidate_turns(connection, batch_size: int = TURN_MIGRATION_BATCH):
+    connection.executescript(TURNS_TABLE_SQL)
+    if _object_type(connection, "conversations") == "table":
+        # Temporary: pairs are looked up by time; dropped with the table
+        connection.execute("CREATE INDEX IF NOT EXISTS idx_migrate_messages_time ON messages(timestamp)")
+        connection.commit()
+        converted = 0
+        while True:
+            rows = connection.execute(
+                """
+                SELECT id, buddy_id, user_message, buddy_reply, timestamp FROM conversations
+                ORDER BY id LIMIT ?
+                """,
+                (batch_size,),
+            ).fetchall()
+            if not rows:
+                break
+            turns, taken = [], set()
+            for row_id, buddy_id, user_message, buddy_reply, timestamp in rows:
+                pair = _find_pair(connection, user_message, buddy_reply, timestamp, taken)
+                user_id, mood = None, None
+                if pair is not None:
+                    user_id, mood, ids = pair
+                    taken.update(ids)
+                turns.append((row_id, user_id, buddy_id, user_message, buddy_reply, mood, timestamp))
+            connection.executemany(
+                """
+                INSERT INTO turns (id, user_id, buddy_id, user_message, buddy_reply, mood, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                turns,
+            )
+            connection.execute("DELETE FROM conversations WHERE id <= ?", (rows[-1][0],))
+            connection.executemany("DELETE FROM messages WHERE id=?", [(i,) for i in taken])
+            connection.commit()
+            converted += len(turns)
+            print(f"   ...{converted} turns converted")
+
+    if _object_type(connection, "messages") == "table":
+        connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS legacy_messages AS SELECT * FROM messages WHERE 0;
+            INSERT INTO legacy_messages SELECT * FROM messages;
+            DROP TABLE messages;
+            """
+        )
+    if _object_type(connection, "conversations") == "table":
+        connection.executescript("DROP TABLE conversations;")
+
+    legacy = _object_type(connection, "legacy_messages") == "table"
+    if legacy and connection.execute("SELECT 1 FROM legacy_messages LIMIT 1").fetchone() is None:
+        connection.executescript("DROP TABLE legacy_messages;")
+        legacy = False
+    connection.executescript(
+        TURNS_INDEX_SQL
+        + CONVERSATIONS_VIEW_SQL
+        + MESSAGES_VIEW_SQL.format(legacy=LEGACY_MESSAGES_UNION if legacy else "")
+    )
+    # Hand back the pages of the dropped tables
+    connection.execute("PRAGMA incremental_vacuum").fetchall()
+
+MIGRATIONS = [
+    # 1: composite index for per-buddy history (ORDER BY timestamp DESC)
+    """
+    CREATE INDEX IF NOT EXISTS idx_conversations_buddy_time
+        ON conversations(buddy_id, timestamp);
+    """,
+    # 2: retention policy overrides, and per-user message time index
+    #    (both used by database/retention.py)
+    """
+    CREATE TABLE IF NOT EXISTS retention_policies (
+        scope TEXT NOT NULL CHECK (scope IN ('buddy', 'user')),
+        owner TEXT NOT NULL,
+        keep_turns INTEGER DEFAULT 0,
+        keep_days REAL DEFAULT 0,
+        PRIMARY KEY (scope, owner)
+    );
+    CREATE INDEX IF NOT EXISTS idx_messages_user_time
+        ON messages(user_id, timestamp);
+    """,
+    # 3: let archival hand freed pages back with PRAGMA incremental_vacuum
+    #    (auto_vacuum only changes on a VACUUM, so this rewrites the file once)
+    _enable_incremental_vacuum,
+    # 4: merge conversations + messages into one turns table (batched, resumable)
+    _consolidate_turns,
+]
+
+def migrate_database(db_path: str = DB_PATH) -> int:
+    """Apply pending migrations. Returns the resulting schema version."""
+    connection = sqlite3.connect(db_path)
+    try:
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version == 0 and connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' LIMIT 1"
+        ).fetchone() is None:
+            # Missing or empty file: nothing to migrate, create the latest schema
+            print(f"🔧 No database at {db_path}; creating it from schema.sql...")
+            apply_schema(connection)
+            return len(MIGRATIONS)
+        for number, migration in enumerate(MIGRATIONS, start=1):
+            if number <= version:
+                continue
+            print(f"🔧 Applying migration {number}...")
+            if callable(migration):
+                migration(connection)
+            else:
+                connection.executescript(migration)
+            connection.execute(f"PRAGMA user_version={number}")
+            connection.commit()
+            version = number
+        return version
+    finally:
+        connection.close()
+
+def apply_schema(connection):
+    """Create every table from schema.sql, already the latest shape, and stamp that version."""
+    with open(SCHEMA_PATH, "r", encoding="utf-8") as schema_file:
+        connection.executescript(schema_file.read())
+    connection.execute(f"PRAGMA user_version={len(MIGRATIONS)}")
+    connection.commit()
+
 def initialize_database():
     """Creates or reinitializes the Build-A-Buddy SQLite database."""
     print("🚀 Initializing Build-A-Buddy database...")
@@ -26,31 +240,74 @@ def initialize_database():
 
     # Connect to the database
     connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
     print("✅ Connected to database.")
 
-    # Read schema
-    if not os.path.exists(SCHEMA_PATH):
-        print("❌ ERROR: schema.sql not found at:", SCHEMA_PATH)
-        connection.close()
-        return
-
-    with open(SCHEMA_PATH, "r", encoding="utf-8") as schema_file:
-        schema_sql = schema_file.read()
-
-    # Execute schema
     try:
-        cursor.executescript(schema_sql)
+        apply_schema(connection)
         print("📜 Schema applied successfully.")
-    except sqlite3.Error as e:
+    except (OSError, sqlite3.Error) as e:
         print("❌ Error applying schema:", e)
         connection.close()
         return
-
-    # Commit and close
-    connection.commit()
     connection.close()
     print(f"🎉 Database initialized at: {DB_PATH}")
 
+# -------------------------------------------------------------
+# Command line
+# -------------------------------------------------------------
+#   python database/db_init.py                    (re)create the database
+#   python database/db_init.py migrate            apply pending migrations
+#   python database/db_init.py export [--buddy ID | --user NAME] [--out FILE]
+#   python database/db_init.py import FILE [--keep-indexes]
+# Export writes NDJSON to stdout unless --out is given; import reads
+# stdin when FILE is "-". Both stream, so dumps of any size work.
+# -------------------------------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build-A-Buddy database tools")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("init", help="create (or reset) the database")
+    commands.add_parser("migrate", help="apply pending schema migrations")
+    export = commands.add_parser("export", help="stream chat data as NDJSON")
+    scope = export.add_mutually_exclusive_group()
+    scope.add_argument("--buddy", help="only this buddy and its turns")
+    scope.add_argument("--user", help="only this user and their turns")
+    export.add_argument("--out", help="output file (default: stdout)")
+    export.add_argument("--no-archive", action="store_true", help="skip turns moved out by retention")
+    load = commands.add_parser("import", help="bulk-load an NDJSON export")
+    load.add_argument("file", help="NDJSON file, or - for stdin")
+    load.add_argument("--keep-indexes", action="store_true",
+                      help="maintain indexes during the load (slower; use on a live database)")
+    args = parser.parse_args(argv)
+
+    if args.command in (None, "init"):
+        initialize_database()
+        return
+    if args.command != "export":
+        # Export only reads; keep stdout clean for the NDJSON stream
+        migrate_database()
+    if args.command == "migrate":
+        return
+
+    # Imported here: the transfer module itself depends on this one
+    sys.path.append(os.path.dirname(BASE_DIR))
+    from database import transfer
+
+    if args.command == "export":
+        out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+        try:
+            for chunk in transfer.export_ndjson(args.buddy, args.user, not args.no_archive):
+                out.write(chunk)
+        finally:
+            if args.out:
+                out.close()
+    else:
+        source = sys.stdin if args.file == "-" else open(args.file, "r", encoding="utf-8")
+        try:
+            result = transfer.import_ndjson(source, defer_indexes=not args.keep_indexes)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        print(f"📥 Imported {result}", file=sys.stderr)
+
 if __name__ == "__main__":
-    initialize_database()
+    main()
@@ -0,0 +1,101 @@
+# backend/database/history_cache.py
+
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# -------------------------------------------------------------
+# Recent-turns cache for Build-A-Buddy
+# -------------------------------------------------------------
+# Keeps the last N (user_message, buddy_reply) turns per buddy in a
+# ring buffer, so the history returned by /chat never touches disk.
+# Buffers are filled from the database on first use and appended to
+# on every write; the number of buddies held is bounded (LRU).
+# -------------------------------------------------------------
+
+
+class RecentTurnsCache:
+    def __init__(self, capacity: int = 20, max_buddies: int = 10000):
+        self.capacity = capacity
+        self.max_buddies = max_buddies
+        self._buffers = OrderedDict()
+        self._versions = {}   # buddy_id -> writes seen (guards against stale loads)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, buddy_id: str, limit: int, loader):
+        """
+        Return up to `limit` most recent turns, oldest first.
+        loader(n) must return the newest n turns from storage, oldest first;
+        it is called at most once per miss.
+        """
+        if self.capacity <= 0 or limit > self.capacity or limit < 0:
+            return loader(limit)
+
+        with self._lock:
+            buffer = self._buffers.get(buddy_id)
+            if buffer is not None:
+                self._buffers.move_to_end(buddy_id)
+                self.hits += 1
+                turns = list(buffer)
+                return turns[max(0, len(turns) - limit):]
+            self.misses += 1
+            version = self._versions.get(buddy_id, 0)
+
+        turns = list(loader(self.capacity))
+        with self._lock:
+            # Only install if no write landed while we were reading
+            if self._versions.get(buddy_id, 0) == version:
+                self._buffers[buddy_id] = deque(turns, maxlen=self.capacity)
+                self._buffers.move_to_end(buddy_id)
+                while len(self._buffers) > self.max_buddies:
+                    old_id, _ = self._buffers.popitem(last=False)
+                    self._versions.pop(old_id, None)
+        return turns[max(0, len(turns) - limit):]
+
+    def _bump(self, buddy_id: str):
+        self._versions[buddy_id] = self._versions.get(buddy_id, 0) + 1
+
+    @contextmanager
+    def writing(self, buddy_id: str, turn: tuple):
+        """
+        Wrap the storage write of a new turn. Any load overlapping the
+        write is discarded, and the turn is appended once the write is done
+        (only buddies already buffered are updated).
+        """
+        if self.capacity <= 0:
+            yield
+            return
+        with self._lock:
+            self._bump(buddy_id)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._bump(buddy_id)
+                buffer = self._buffers.get(buddy_id)
+                if buffer is not None:
+                    buffer.append(turn)
+                elif len(self._versions) > self.max_buddies * 2:
+                    # Versions only matter for loads in flight; drop stale ones
+                    for old_id in [b for b in self._versions if b not in self._buffers]:
+                        self._versions.pop(old_id, None)
+
+    def invalidate(self, buddy_id: str = None):
+        with self._lock:
+            if buddy_id is None:
+                self._buffers.clear()
+                self._versions.clear()
+            else:
+                self._buffers.pop(buddy_id, None)
+                self._bump(buddy_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "buddies": len(self._buffers),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,137 @@
+# backend/database/identity.py
+
+import os
+import threading
+from collections import OrderedDict
+
+from database import db
+
+# -------------------------------------------------------------
+# User / buddy identity resolution for Build-A-Buddy
+# -------------------------------------------------------------
+# Every chat request needs the user's id and needs its buddy to exist.
+# Both facts never change once established (rows are not deleted or
+# renamed), so they are cached in memory: a returning user or a known
+# buddy costs no database round trip. Misses are resolved with a single
+# INSERT ... ON CONFLICT ... RETURNING, which is race-free under
+# concurrent first requests for the same name.
+#
+# Only committed results are cached: a lookup made inside an open
+# transaction could be rolled back, and its ids handed out again.
+# -------------------------------------------------------------
+
+MAX_USERS = int(os.environ.get("BUDDY_IDENTITY_CACHE_USERS", "100000"))
+MAX_BUDDIES = int(os.environ.get("BUDDY_IDENTITY_CACHE_BUDDIES", "100000"))
+
+UPSERT_USER = """
+    INSERT INTO users (username) VALUES (?)
+    ON CONFLICT(username) DO UPDATE SET username=excluded.username
+    RETURNING id
+"""
+UPSERT_BUDDY = """
+    INSERT INTO buddies (buddy_id, personality_type, kindness, excitement, humor, current_mood)
+    VALUES (?, ?, 0.5, 0.5, 0.5, 'neutral')
+    ON CONFLICT(buddy_id) DO UPDATE SET current_mood=current_mood
+    RETURNING current_mood
+"""
+
+
+class IdentityCache:
+    """Bounded LRU maps of username -> user id and of known buddy ids."""
+
+    def __init__(self, max_users: int = MAX_USERS, max_buddies: int = MAX_BUDDIES):
+        self.max_users = max_users
+        self.max_buddies = max_buddies
+        self._users = OrderedDict()
+        self._buddies = OrderedDict()     # buddy_id -> None (ordered set)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # ---------------------------
+    # Cache primitives
+    # ---------------------------
+    def _get(self, table: OrderedDict, key):
+        with self._lock:
+            if key in table:
+                table.move_to_end(key)
+                self.hits += 1
+                return True, table[key]
+            self.misses += 1
+            return False, None
+
+    def _put(self, table: OrderedDict, limit: int, items):
+        if limit <= 0:
+            return
+        with self._lock:
+            for key, value in items:
+                table[key] = value
+                table.move_to_end(key)
+            while len(table) > limit:
+                table.popitem(last=False)
+
+    def cached_user_id(self, username: str):
+        return self._get(self._users, username)[1]
+
+    def knows_buddy(self, buddy_id: str) -> bool:
+        return self._get(self._buddies, buddy_id)[0]
+
+    def remember_users(self, ids: dict):
+        """Cache committed {username: user_id} pairs."""
+        self._put(self._users, self.max_users, ids.items())
+
+    def remember_buddies(self, buddy_ids):
+        """Cache buddy ids known to exist in committed data."""
+        self._put(self._buddies, self.max_buddies, ((b, None) for b in buddy_ids))
+
+    def invalidate(self):
+        with self._lock:
+            self._users.clear()
+            self._buddies.clear()
+
+    # ---------------------------
+    # Resolution
+    # ---------------------------
+    def resolve_user(self, username: str) -> int:
+        """User id for username, creating the user on first sight."""
+        user_id = self.cached_user_id(username)
+        if user_id is not None:
+            return user_id
+        conn = db.get_connection()
+        # fetchall() so the statement finishes (and releases its write lock) right away
+        user_id = conn.execute(UPSERT_USER, (username,)).fetchall()[0]["id"]
+        if not conn.in_transaction:
+            self.remember_users({username: user_id})
+        return user_id
+
+    def resolve_buddy(self, buddy_id: str, personality: str, with_mood: bool = False):
+        """
+        Make sure the buddy exists (created with `personality` on first
+        sight). Returns its stored mood when with_mood is set, else None.
+        """
+        conn = db.get_connection()
+        if self.knows_buddy(buddy_id):
+            if not with_mood:
+                return None
+            row = conn.execute("SELECT current_mood FROM buddies WHERE buddy_id=?", (buddy_id,)).fetchone()
+            if row is not None:
+                return row["current_mood"] or "neutral"
+        mood = conn.execute(UPSERT_BUDDY, (buddy_id, personality)).fetchall()[0]["current_mood"]
+        if not conn.in_transaction:
+            self.remember_buddies((buddy_id,))
+        return (mood or "neutral") if with_mood else None
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "users": len(self._users),
+                "buddies": len(self._buddies),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Shared process-wide instance
+identities = IdentityCache()
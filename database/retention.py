@@ -0,0 +1,495 @@
+# backend/database/retention.py
+
+import json
+import os
+import threading
+import time
+import traceback
+import zlib
+from datetime import datetime, timedelta, timezone
+
+from database import db
+from database.db_init import DB_PATH
+from metrics import REGISTRY, record_error
+
+# -------------------------------------------------------------
+# Retention and archival for Build-A-Buddy
+# -------------------------------------------------------------
+# Chat history is appended forever, so the hot tables (and the history
+# index, and the database file) only ever grow. A background job moves
+# turns that fall outside the retention policy into compressed archive
+# segments in a separate SQLite file, a batch at a time. The segment
+# rows act as a small index, so history past the hot window can still
+# be fetched on demand (see archived_rows()).
+#
+# Policies: keep the last N turns and/or the last D days (0 = no limit);
+# a turn is archived as soon as it falls outside either limit. The
+# defaults come from the environment and can be overridden in the
+# retention_policies table per buddy, or per user (covering every buddy
+# the user talks to); a buddy's own override wins.
+#
+# Each batch is written as a 'pending' segment, then deleted from the
+# hot table, then marked 'done'. Pending segments are finished again
+# under the archive's write lock before anything else is archived for
+# that owner, so a crash or a second worker never loses or duplicates
+# rows.
+#
+# The same job keeps the hot database healthy: freed pages are returned
+# with incremental_vacuum, ANALYZE and VACUUM run on an interval.
+# -------------------------------------------------------------
+
+RETENTION_ENABLED = os.environ.get("BUDDY_RETENTION", "0") == "1"
+KEEP_TURNS = int(os.environ.get("BUDDY_RETENTION_KEEP_TURNS", "1000"))
+KEEP_DAYS = float(os.environ.get("BUDDY_RETENTION_KEEP_DAYS", "0"))
+INTERVAL_S = float(os.environ.get("BUDDY_RETENTION_INTERVAL_S", "600"))
+BATCH_SIZE = int(os.environ.get("BUDDY_RETENTION_BATCH", "500"))
+MAX_BATCHES_PER_RUN = int(os.environ.get("BUDDY_RETENTION_MAX_BATCHES", "200"))
+BATCH_PAUSE_S = 0.02      # yield the write lock to request handlers between batches
+ANALYZE_INTERVAL_S = float(os.environ.get("BUDDY_ANALYZE_INTERVAL_S", str(6 * 3600)))
+VACUUM_INTERVAL_S = float(os.environ.get("BUDDY_VACUUM_INTERVAL_S", str(7 * 86400)))   # 0 = never
+FREE_PAGE_RATIO = 0.1     # incremental_vacuum once this share of the file is free pages
+INCREMENTAL_PAGES = 1000  # pages returned per incremental_vacuum step
+ARCHIVE_PATH = os.environ.get(
+    "BUDDY_ARCHIVE_PATH", os.path.splitext(DB_PATH)[0] + "-archive.db")
+
+PENDING = "pending"
+DONE = "done"
+
+# Segments hold turns, owned by buddy_id
+TURN = "turn"
+SEGMENT_COLUMNS = {
+    TURN: ("id", "timestamp", "user_id", "user_message", "buddy_reply", "mood"),
+}
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archive_segments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,           -- key of SEGMENT_COLUMNS
+    owner TEXT NOT NULL,          -- buddy_id
+    user_id INTEGER,              -- set when every row has the same user
+    state TEXT NOT NULL,          -- 'pending' until the hot rows are deleted
+    first_ts TIMESTAMP NOT NULL,
+    first_id INTEGER NOT NULL,
+    last_ts TIMESTAMP NOT NULL,
+    last_id INTEGER NOT NULL,
+    row_count INTEGER NOT NULL,
+    raw_bytes INTEGER NOT NULL,
+    payload BLOB NOT NULL,        -- zlib-compressed JSON list of rows
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_archive_owner_time
+    ON archive_segments(kind, owner, last_ts, last_id);
+CREATE INDEX IF NOT EXISTS idx_archive_pending
+    ON archive_segments(state) WHERE state = 'pending';
+CREATE TABLE IF NOT EXISTS maintenance_runs (
+    op TEXT PRIMARY KEY,
+    last_run REAL NOT NULL
+);
+"""
+
+ARCHIVED_ROWS = REGISTRY.counter(
+    "buddy_retention_archived_rows_total", "Rows moved from the hot tables into archive segments.", ("kind",))
+MAINTENANCE = REGISTRY.counter(
+    "buddy_db_maintenance_total", "Database maintenance operations run.", ("op",))
+
+# Separate file, so the hot database (and its backups) stays small
+archive_pool = db.ConnectionPool(ARCHIVE_PATH)
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def ensure_archive():
+    """Create the archive file and its tables if needed."""
+    global _schema_ready
+    with _schema_lock:
+        if not _schema_ready:
+            conn = archive_pool.get_connection()
+            conn.executescript(ARCHIVE_SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(archive_segments)")}
+            if "user_id" not in columns:
+                conn.execute("ALTER TABLE archive_segments ADD COLUMN user_id INTEGER")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_archive_user ON archive_segments(kind, user_id)")
+            _schema_ready = True
+
+
+def archive_exists() -> bool:
+    return _schema_ready or os.path.exists(ARCHIVE_PATH)
+
+
+def encode_payload(rows) -> tuple:
+    raw = json.dumps([list(r) for r in rows], separators=(",", ":")).encode("utf-8")
+    return zlib.compress(raw, 6), len(raw)
+
+
+def decode_payload(payload) -> list:
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
+
+
+def _cutoff(days: float) -> str:
+    """CURRENT_TIMESTAMP-formatted (UTC) time `days` ago."""
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# -------------------------------------------------------------
+# Policies
+# -------------------------------------------------------------
+class Policy:
+    __slots__ = ("keep_turns", "keep_days")
+
+    def __init__(self, keep_turns: int = KEEP_TURNS, keep_days: float = KEEP_DAYS):
+        self.keep_turns = max(0, int(keep_turns or 0))
+        self.keep_days = max(0.0, float(keep_days or 0))
+
+    @property
+    def unlimited(self) -> bool:
+        return not self.keep_turns and not self.keep_days
+
+
+DEFAULT_POLICY = Policy()
+
+
+def load_policies(conn, scope: str) -> dict:
+    """{owner: Policy} overrides for one scope ('buddy' or 'user')."""
+    rows = conn.execute(
+        "SELECT owner, keep_turns, keep_days FROM retention_policies WHERE scope=?", (scope,)
+    ).fetchall()
+    return {r["owner"]: Policy(r["keep_turns"], r["keep_days"]) for r in rows}
+
+
+def buddy_policies(conn) -> dict:
+    """{buddy_id: Policy} for every buddy with an override, its own or its user's."""
+    policies = {}
+    for user_id, policy in load_policies(conn, "user").items():
+        if not user_id.isdigit():
+            continue
+        for row in conn.execute("SELECT DISTINCT buddy_id FROM turns WHERE user_id=?", (int(user_id),)):
+            policies[row["buddy_id"]] = policy
+    policies.update(load_policies(conn, "buddy"))
+    return policies
+
+
+def set_policy(scope: str, owner: str, keep_turns: int = 0, keep_days: float = 0):
+    """Override the default policy for one buddy or user id (0/0 keeps everything hot)."""
+    if scope not in ("buddy", "user"):
+        raise ValueError(f"Unknown retention scope {scope!r}")
+    if scope == "user" and not str(owner).isdigit():
+        raise ValueError("User policies are keyed by numeric user id")
+    with db.transaction() as conn:
+        conn.execute(
+            """
+            INSERT INTO retention_policies (scope, owner, keep_turns, keep_days)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(scope, owner) DO UPDATE SET
+                keep_turns=excluded.keep_turns, keep_days=excluded.keep_days
+            """,
+            (scope, str(owner), int(keep_turns), float(keep_days)),
+        )
+
+
+def clear_policy(scope: str, owner: str):
+    with db.transaction() as conn:
+        conn.execute("DELETE FROM retention_policies WHERE scope=? AND owner=?", (scope, str(owner)))
+
+
+# -------------------------------------------------------------
+# Archiving
+# -------------------------------------------------------------
+def _finish_pending(archive, owner: str = None) -> int:
+    """Delete the hot rows of pending segments and mark them done. Caller holds the archive lock."""
+    sql = "SELECT id, kind, payload FROM archive_segments WHERE state=?"
+    params = [PENDING]
+    if owner is not None:
+        sql += " AND owner=? AND kind=?"
+        params += [owner, TURN]
+    segments = archive.execute(sql, params).fetchall()
+    for segment in segments:
+        if segment["kind"] == TURN:
+            ids = [(row[0],) for row in decode_payload(segment["payload"])]
+            with db.transaction() as conn:
+                conn.executemany("DELETE FROM turns WHERE id=?", ids)
+        archive.execute("UPDATE archive_segments SET state=? WHERE id=?", (DONE, segment["id"]))
+    return len(segments)
+
+
+def _select_batch(conn, buddy_id: str, policy: Policy, limit: int):
+    """Oldest hot turns of a buddy that fall outside `policy`, up to `limit`."""
+    conditions, params = [], []
+    if policy.keep_turns:
+        boundary = conn.execute(
+            """
+            SELECT timestamp, id FROM turns
+            WHERE buddy_id=?
+            ORDER BY timestamp DESC, id DESC
+            LIMIT 1 OFFSET ?
+            """,
+            (buddy_id, policy.keep_turns),
+        ).fetchone()
+        if boundary is not None:
+            conditions.append("(timestamp, id) <= (?, ?)")
+            params += [boundary["timestamp"], boundary["id"]]
+    if policy.keep_days:
+        conditions.append("timestamp < ?")
+        params.append(_cutoff(policy.keep_days))
+    if not conditions:
+        return []
+    return conn.execute(
+        f"""
+        SELECT {', '.join(SEGMENT_COLUMNS[TURN])} FROM turns
+        WHERE buddy_id=? AND ({' OR '.join(conditions)})
+        ORDER BY timestamp, id
+        LIMIT ?
+        """,
+        [buddy_id] + params + [limit],
+    ).fetchall()
+
+
+def archive_batch(buddy_id: str, policy: Policy, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Move one batch of a buddy's out-of-policy turns into a segment.
+    Returns the number of turns archived (0 when the buddy is within policy).
+    """
+    ensure_archive()
+    with archive_pool.transaction() as archive:
+        # Finish whatever a crashed or concurrent run left half-way first
+        _finish_pending(archive, buddy_id)
+        rows = _select_batch(db.get_connection(), buddy_id, policy, batch_size)
+        if not rows:
+            return 0
+        payload, raw_bytes = encode_payload(rows)
+        users = {r["user_id"] for r in rows}
+        segment_id = archive.execute(
+            """
+            INSERT INTO archive_segments
+                (kind, owner, user_id, state, first_ts, first_id, last_ts, last_id,
+                 row_count, raw_bytes, payload)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (TURN, buddy_id, users.pop() if len(users) == 1 else None, PENDING,
+             rows[0]["timestamp"], rows[0]["id"], rows[-1]["timestamp"], rows[-1]["id"],
+             len(rows), raw_bytes, payload),
+        ).lastrowid
+
+    # The segment is durable; now drop the turns from the hot table
+    with db.transaction() as conn:
+        conn.executemany("DELETE FROM turns WHERE id=?", [(r["id"],) for r in rows])
+    with archive_pool.transaction() as archive:
+        archive.execute("UPDATE archive_segments SET state=? WHERE id=?", (DONE, segment_id))
+    ARCHIVED_ROWS.inc(len(rows), TURN)
+    return len(rows)
+
+
+def _buddies_over_policy(policies: dict):
+    """(buddy_id, policy) pairs whose hot turns exceed their policy, most turns first."""
+    # Covered by idx_turns_buddy_time
+    rows = db.get_connection().execute(
+        """
+        SELECT buddy_id, COUNT(*) AS n, MIN(timestamp) AS oldest
+        FROM turns
+        GROUP BY buddy_id
+        """
+    ).fetchall()
+    over = []
+    for row in rows:
+        policy = policies.get(row["buddy_id"], DEFAULT_POLICY)
+        if policy.unlimited:
+            continue
+        too_many = policy.keep_turns and row["n"] > policy.keep_turns
+        too_old = policy.keep_days and row["oldest"] < _cutoff(policy.keep_days)
+        if too_many or too_old:
+            over.append((row["n"], row["buddy_id"], policy))
+    over.sort(key=lambda item: item[0], reverse=True)
+    return [(buddy_id, policy) for _, buddy_id, policy in over]
+
+
+def apply_retention(max_batches: int = MAX_BATCHES_PER_RUN, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Archive out-of-policy turns, at most max_batches transactions per call
+    (the rest is picked up next time). Returns the number of turns archived.
+    """
+    archived = 0
+    budget = max_batches
+    for buddy_id, policy in _buddies_over_policy(buddy_policies(db.get_connection())):
+        while budget > 0:
+            moved = archive_batch(buddy_id, policy, batch_size)
+            if not moved:
+                break
+            archived += moved
+            budget -= 1
+            time.sleep(BATCH_PAUSE_S)
+        if budget <= 0:
+            break
+    return archived
+
+
+def recover_pending() -> int:
+    """Finish every pending segment (e.g. after a crash). Returns segments finished."""
+    if not archive_exists():
+        return 0
+    ensure_archive()
+    with archive_pool.transaction() as archive:
+        return _finish_pending(archive)
+
+
+# -------------------------------------------------------------
+# Reading archived history
+# -------------------------------------------------------------
+def segment_rows(kind: str, payload) -> list:
+    """Decode a segment into dicts keyed by its kind's column names."""
+    columns = SEGMENT_COLUMNS[kind]
+    return [dict(zip(columns, values)) for values in decode_payload(payload)]
+
+
+def archived_turns(buddy_id: str, limit: int, before=None) -> list:
+    """
+    Newest-first archived turns of one buddy (dicts with id, timestamp,
+    user_message, buddy_reply, ...), strictly older than the
+    (timestamp, id) cursor `before` when given.
+    """
+    if limit <= 0 or not archive_exists():
+        return []
+    ensure_archive()
+    sql = "SELECT kind, payload FROM archive_segments WHERE kind=? AND owner=? AND state=?"
+    params = [TURN, buddy_id, DONE]
+    if before is not None:
+        sql += " AND (first_ts, first_id) < (?, ?)"
+        params += [before[0], before[1]]
+    sql += " ORDER BY last_ts DESC, last_id DESC"
+
+    found = []
+    for segment in archive_pool.get_connection().execute(sql, params):
+        for row in reversed(segment_rows(segment["kind"], segment["payload"])):
+            if before is None or (row["timestamp"], row["id"]) < tuple(before):
+                found.append(row)
+        if len(found) >= limit:
+            break
+    found.sort(key=lambda r: (r["timestamp"], r["id"]), reverse=True)
+    return found[:limit]
+
+
+def archive_stats() -> dict:
+    if not archive_exists():
+        return {"segments": 0, "rows": 0, "raw_bytes": 0, "stored_bytes": 0, "pending": 0}
+    ensure_archive()
+    row = archive_pool.get_connection().execute(
+        """
+        SELECT COUNT(*) AS segments, COALESCE(SUM(row_count), 0) AS rows,
+               COALESCE(SUM(raw_bytes), 0) AS raw_bytes,
+               COALESCE(SUM(LENGTH(payload)), 0) AS stored_bytes,
+               COALESCE(SUM(state = 'pending'), 0) AS pending
+        FROM archive_segments
+        """
+    ).fetchone()
+    return dict(row)
+
+
+# -------------------------------------------------------------
+# VACUUM / ANALYZE
+# -------------------------------------------------------------
+def _due(op: str, interval: float) -> bool:
+    """Claim an interval-based maintenance op; shared by every worker through the archive file."""
+    if interval <= 0:
+        return False
+    ensure_archive()
+    now = time.time()
+    with archive_pool.transaction() as archive:
+        row = archive.execute("SELECT last_run FROM maintenance_runs WHERE op=?", (op,)).fetchone()
+        if row is not None and now - row["last_run"] < interval:
+            return False
+        archive.execute(
+            "INSERT INTO maintenance_runs (op, last_run) VALUES (?, ?) "
+            "ON CONFLICT(op) DO UPDATE SET last_run=excluded.last_run",
+            (op, now),
+        )
+    return True
+
+
+def free_page_ratio(conn) -> float:
+    pages = conn.execute("PRAGMA page_count").fetchone()[0]
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return free / pages if pages else 0.0
+
+
+def maintain(force_vacuum: bool = False) -> list:
+    """Run whatever maintenance is due on the hot database. Returns the ops run."""
+    conn = db.get_connection()
+    ran = []
+    # Return pages freed by archiving a step at a time (needs auto_vacuum=INCREMENTAL)
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        while free_page_ratio(conn) > FREE_PAGE_RATIO:
+            conn.execute(f"PRAGMA incremental_vacuum({INCREMENTAL_PAGES})").fetchall()
+            time.sleep(BATCH_PAUSE_S)
+            if "incremental_vacuum" not in ran:
+                ran.append("incremental_vacuum")
+    if _due("analyze", ANALYZE_INTERVAL_S):
+        conn.execute("PRAGMA analysis_limit=1000")
+        conn.execute("ANALYZE")
+        ran.append("analyze")
+    if force_vacuum or _due("vacuum", VACUUM_INTERVAL_S):
+        conn.execute("VACUUM")
+        ran.append("vacuum")
+    for op in ran:
+        MAINTENANCE.inc(1, op)
+    return ran
+
+
+# -------------------------------------------------------------
+# Background scheduler
+# -------------------------------------------------------------
+class RetentionScheduler:
+    """Runs apply_retention() and maintain() every `interval` seconds on a daemon thread."""
+
+    def __init__(self, interval: float = INTERVAL_S):
+        self.interval = interval
+        self.runs = 0
+        self.last_result = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+            self._thread.start()
+
+    def close(self, timeout: float = 10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def run_once(self) -> dict:
+        started = time.monotonic()
+        recovered = recover_pending()
+        archived = apply_retention()
+        maintenance = maintain()
+        self.runs += 1
+        self.last_result = {
+            "archived": archived,
+            "recovered_segments": recovered,
+            "maintenance": maintenance,
+            "seconds": round(time.monotonic() - started, 3),
+        }
+        return self.last_result
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print("Retention run failed:", e)
+                traceback.print_exc()
+                record_error("retention")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self._thread is not None and self._thread.is_alive(),
+            "interval_s": self.interval,
+            "runs": self.runs,
+            "last_run": self.last_result,
+            "default_policy": {"keep_turns": DEFAULT_POLICY.keep_turns, "keep_days": DEFAULT_POLICY.keep_days},
+            "archive": archive_stats(),
+        }
+
+
+# Shared process-wide instance
+scheduler = RetentionScheduler()
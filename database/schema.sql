@@ -2,10 +2,12 @@
 -- Build-A-Buddy Database Schema
 -- ==========================================================
 -- This schema is optimized for mobile (SQLite) deployments.
--- Stores users, chat messages, moods, and memory data.
+-- Stores users, chat turns, moods, and memory data.
 -- ==========================================================
 
 PRAGMA foreign_keys = ON;
+-- Lets retention hand freed pages back to the OS (PRAGMA incremental_vacuum)
+PRAGMA auto_vacuum = INCREMENTAL;
 
 -- ==========================================================
 -- USERS TABLE
@@ -19,19 +21,6 @@ CREATE TABLE IF NOT EXISTS users (
     last_login TIMESTAMP
 );
 
--- ==========================================================
--- CHAT MESSAGES
--- ==========================================================
-CREATE TABLE IF NOT EXISTS messages (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER,
-    sender TEXT NOT NULL,  -- 'user' or 'buddy'
-    message TEXT NOT NULL,
-    mood TEXT,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-);
-
 -- ==========================================================
 -- MOOD TRACKING
 -- ==========================================================
@@ -71,7 +60,6 @@ CREATE TABLE IF NOT EXISTS preferences (
 -- ==========================================================
 -- INDEXES FOR PERFORMANCE
 -- ==========================================================
-CREATE INDEX IF NOT EXISTS idx_messages_user ON messages(user_id);
 CREATE INDEX IF NOT EXISTS idx_moods_user ON moods(user_id);
 CREATE INDEX IF NOT EXISTS idx_memory_user ON memory(user_id);
 
@@ -91,15 +79,53 @@ CREATE TABLE IF NOT EXISTS buddies (
 );
 
 -- ==========================================================
--- CONVERSATIONS TABLE
+-- CHAT TURNS
 -- ==========================================================
-CREATE TABLE IF NOT EXISTS conversations (
+-- One row per exchange: the user's message, the buddy's reply and the
+-- buddy's mood after replying.
+CREATE TABLE IF NOT EXISTS turns (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
     buddy_id TEXT NOT NULL,
     user_message TEXT NOT NULL,
     buddy_reply TEXT NOT NULL,
+    mood TEXT,
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
     FOREIGN KEY (buddy_id) REFERENCES buddies(buddy_id) ON DELETE CASCADE
 );
 
+-- History: WHERE buddy_id=? ORDER BY timestamp DESC, id DESC (id is the rowid,
+-- so the index covers the ordering and the retention scans)
+CREATE INDEX IF NOT EXISTS idx_turns_buddy_time ON turns(buddy_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_turns_user_time ON turns(user_id, timestamp);
+
+-- Read-only views with the shape of the former conversations / messages
+-- tables. Each turn appears as two messages, with ids 2*id-1 (user) and
+-- 2*id (buddy).
+CREATE VIEW IF NOT EXISTS conversations AS
+    SELECT id, buddy_id, user_message, buddy_reply, timestamp FROM turns;
+
+CREATE VIEW IF NOT EXISTS messages AS
+    SELECT id * 2 - 1 AS id, user_id, 'user' AS sender, user_message AS message,
+           NULL AS mood, timestamp
+    FROM turns
+    UNION ALL
+    SELECT id * 2 AS id, user_id, 'buddy' AS sender, buddy_reply AS message,
+           mood, timestamp
+    FROM turns;
+
+-- ==========================================================
+-- RETENTION POLICY OVERRIDES (see database/retention.py)
+-- ==========================================================
+-- 0 means no limit. A buddy's turns follow its 'buddy' row, else the
+-- 'user' row of the user it talks to, else the defaults.
+CREATE TABLE IF NOT EXISTS retention_policies (
+    scope TEXT NOT NULL CHECK (scope IN ('buddy', 'user')),
+    owner TEXT NOT NULL,
+    keep_turns INTEGER DEFAULT 0,
+    keep_days REAL DEFAULT 0,
+    PRIMARY KEY (scope, owner)
+);
+
 -- ==========================================================
\ No newline at end of file
@@ -0,0 +1,345 @@
+# backend/database/transfer.py
+
+import json
+import time
+
+from database import db, retention
+from database.db_init import DB_PATH
+
+# -------------------------------------------------------------
+# Streaming export / bulk import for Build-A-Buddy
+# -------------------------------------------------------------
+# Chat data moves as NDJSON: one JSON object per line, each tagged with
+# a "type" (user, buddy, turn). Exports walk SQLite
+# cursors row by row on a dedicated connection, so memory stays flat
+# however large the dump; turns moved out by retention are read back
+# from the archive one segment at a time. Users and buddies are always
+# written before the rows that reference them, which is the order the
+# importer expects; a scoped export also carries the users (buddy scope)
+# or buddies (user scope) its turns point at.
+#
+# Imports buffer rows per type and insert them with executemany in
+# large transactions. Secondary indexes on turns are dropped for the
+# duration and rebuilt once at the end, which is much cheaper than
+# maintaining them row by row. Records of unknown types are skipped.
+# -------------------------------------------------------------
+
+IMPORT_BATCH = 5000          # rows per executemany
+IMPORT_TXN_ROWS = 200000     # rows per committed transaction
+EXPORT_CHUNK_BYTES = 64 * 1024
+SQL_CHUNK = 500              # ids per IN (...) list
+
+USER_COLUMNS = ("id", "username", "email", "created_at", "last_login")
+BUDDY_COLUMNS = ("buddy_id", "personality_type", "kindness", "excitement", "humor", "current_mood")
+TURN_COLUMNS = ("id", "user_id", "buddy_id", "user_message", "buddy_reply", "mood", "timestamp")
+
+# Tables whose secondary indexes are deferred during import
+DEFERRED_INDEX_TABLES = ("turns",)
+
+
+# -------------------------------------------------------------
+# Export
+# -------------------------------------------------------------
+def _record(kind: str, row, columns) -> dict:
+    record = {"type": kind}
+    record.update((c, row[c]) for c in columns)
+    return record
+
+
+def _archive_snapshot(conn):
+    """
+    Start the export's read snapshot while no archiving step can commit,
+    and note which segments it must read. Returns (max segment id, ids of
+    turns in still-pending segments): those may also still be in the hot
+    snapshot, so they are skipped there.
+    """
+    if not retention.archive_exists():
+        conn.execute("BEGIN")
+        conn.execute("SELECT 1 FROM buddies LIMIT 1").fetchall()
+        return 0, set()
+
+    retention.ensure_archive()
+    with retention.archive_pool.transaction() as archive:
+        conn.execute("BEGIN")
+        conn.execute("SELECT 1 FROM buddies LIMIT 1").fetchall()
+        max_segment = archive.execute("SELECT COALESCE(MAX(id), 0) FROM archive_segments").fetchone()[0]
+        pending = set()
+        for segment in archive.execute(
+            "SELECT payload FROM archive_segments WHERE state=? AND kind=?",
+            (retention.PENDING, retention.TURN),
+        ):
+            pending.update(row[0] for row in retention.decode_payload(segment["payload"]))
+    return max_segment, pending
+
+
+def _archived_turns(max_segment: int, buddy_id: str = None, user_id: int = None):
+    """Archived turns as export records (all, one buddy's, or one user's), oldest first per buddy."""
+    if not max_segment:
+        return
+    sql = "SELECT kind, owner, payload FROM archive_segments WHERE id<=? AND kind=?"
+    params = [max_segment, retention.TURN]
+    if user_id is not None:
+        # Mixed-user segments have no user_id and are filtered row by row
+        sql += " AND (user_id=? OR user_id IS NULL)"
+        params.append(user_id)
+    if buddy_id is not None:
+        sql += " AND owner=?"
+        params.append(buddy_id)
+    sql += " ORDER BY owner, last_ts, last_id"
+    # Own connection: the generator may resume on a different thread
+    archive = db.connect(retention.ARCHIVE_PATH)
+    try:
+        for segment in archive.execute(sql, params):
+            for row in retention.segment_rows(segment["kind"], segment["payload"]):
+                if user_id is not None and row["user_id"] != user_id:
+                    continue
+                row["buddy_id"] = segment["owner"]
+                record = {"type": "turn"}
+                record.update((c, row.get(c)) for c in TURN_COLUMNS)
+                yield record
+    finally:
+        archive.close()
+
+
+def _rows_by_key(conn, table: str, key: str, columns, values):
+    """Rows of table whose key is in values, ordered by key, in IN (...) chunks."""
+    values = sorted(v for v in values if v is not None)
+    for start in range(0, len(values), SQL_CHUNK):
+        chunk = values[start:start + SQL_CHUNK]
+        yield from conn.execute(
+            f"SELECT {', '.join(columns)} FROM {table} "
+            f"WHERE {key} IN ({','.join('?' * len(chunk))}) ORDER BY {key}",
+            chunk,
+        )
+
+
+def export_records(buddy_id: str = None, username: str = None, include_archive: bool = True,
+                   db_path: str = DB_PATH):
+    """
+    Yield export records. With buddy_id, that buddy, its turns and the
+    users they name; with username, that user, their turns and the
+    buddies they talk to; with neither, everything.
+    Reads one consistent snapshot of the hot tables.
+    """
+    conn = db.connect(db_path)
+    try:
+        max_segment, pending = _archive_snapshot(conn)
+        if not include_archive:
+            max_segment = 0
+
+        user_id = None
+        if buddy_id is not None:
+            # The users this buddy's turns (hot and archived) point at
+            user_ids = {row[0] for row in conn.execute(
+                "SELECT DISTINCT user_id FROM turns WHERE buddy_id=?", (buddy_id,))}
+            user_ids.update(r["user_id"] for r in _archived_turns(max_segment, buddy_id=buddy_id))
+            for row in _rows_by_key(conn, "users", "id", USER_COLUMNS, user_ids):
+                yield _record("user", row, USER_COLUMNS)
+        else:
+            sql = f"SELECT {', '.join(USER_COLUMNS)} FROM users"
+            params = ()
+            if username is not None:
+                sql += " WHERE username=?"
+                params = (username,)
+            for row in conn.execute(sql + " ORDER BY id", params):
+                user_id = row["id"]
+                yield _record("user", row, USER_COLUMNS)
+            if username is not None and user_id is None:
+                return
+
+        if username is not None:
+            # The buddies this user talks to (hot and archived turns)
+            buddy_ids = {row[0] for row in conn.execute(
+                "SELECT DISTINCT buddy_id FROM turns WHERE user_id=?", (user_id,))}
+            buddy_ids.update(r["buddy_id"] for r in _archived_turns(max_segment, user_id=user_id))
+            for row in _rows_by_key(conn, "buddies", "buddy_id", BUDDY_COLUMNS, buddy_ids):
+                yield _record("buddy", row, BUDDY_COLUMNS)
+        else:
+            sql = f"SELECT {', '.join(BUDDY_COLUMNS)} FROM buddies"
+            params = ()
+            if buddy_id is not None:
+                sql += " WHERE buddy_id=?"
+                params = (buddy_id,)
+            for row in conn.execute(sql + " ORDER BY id", params):
+                yield _record("buddy", row, BUDDY_COLUMNS)
+
+        sql = f"SELECT {', '.join(TURN_COLUMNS)} FROM turns"
+        if buddy_id is not None:
+            yield from _archived_turns(max_segment, buddy_id=buddy_id)
+            rows = conn.execute(sql + " WHERE buddy_id=? ORDER BY timestamp, id", (buddy_id,))
+        elif username is not None:
+            yield from _archived_turns(max_segment, user_id=user_id)
+            rows = conn.execute(sql + " WHERE user_id=? ORDER BY timestamp, id", (user_id,))
+        else:
+            yield from _archived_turns(max_segment)
+            rows = conn.execute(sql + " ORDER BY id")
+        for row in rows:
+            if row["id"] not in pending:
+                yield _record("turn", row, TURN_COLUMNS)
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.close()
+
+
+def export_ndjson(buddy_id: str = None, username: str = None, include_archive: bool = True,
+                  chunk_bytes: int = EXPORT_CHUNK_BYTES, db_path: str = DB_PATH):
+    """export_records() as NDJSON text, yielded in chunks of roughly chunk_bytes."""
+    parts, size = [], 0
+    for record in export_records(buddy_id, username, include_archive, db_path):
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        parts.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield "".join(parts)
+            parts, size = [], 0
+    if parts:
+        yield "".join(parts)
+
+
+# -------------------------------------------------------------
+# Import
+# -------------------------------------------------------------
+INSERT_SQL = {
+    "user": (
+        "INSERT OR IGNORE INTO users (username, email, created_at, last_login) "
+        "VALUES (?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?)"
+    ),
+    "buddy": (
+        "INSERT INTO buddies (buddy_id, personality_type, kindness, excitement, humor, current_mood) "
+        "VALUES (?, ?, ?, ?, ?, COALESCE(?, 'neutral')) ON CONFLICT(buddy_id) DO NOTHING"
+    ),
+    # Exported user ids are remapped to this database's ids
+    "turn": (
+        "INSERT INTO turns (user_id, buddy_id, user_message, buddy_reply, mood, timestamp) "
+        "VALUES ((SELECT new_id FROM temp.import_user_map WHERE old_id=?), ?, ?, ?, ?, "
+        "COALESCE(?, CURRENT_TIMESTAMP))"
+    ),
+}
+
+# Flush order: referenced rows before the rows that reference them
+FLUSH_ORDER = ("user", "buddy", "turn")
+
+
+def _params(kind: str, r: dict) -> tuple:
+    if kind == "user":
+        return (r["username"], r.get("email"), r.get("created_at"), r.get("last_login"))
+    if kind == "buddy":
+        return (r["buddy_id"], r.get("personality_type"), r.get("kindness"), r.get("excitement"),
+                r.get("humor"), r.get("current_mood"))
+    return (r.get("user_id"), r["buddy_id"], r["user_message"], r["buddy_reply"], r.get("mood"),
+            r.get("timestamp"))
+
+
+def _drop_indexes(conn) -> list:
+    """Drop non-unique secondary indexes on the turns table; returns their CREATE statements."""
+    rows = conn.execute(
+        f"""
+        SELECT name, sql FROM sqlite_master
+        WHERE type='index' AND sql IS NOT NULL AND sql NOT LIKE 'CREATE UNIQUE%'
+          AND tbl_name IN ({','.join('?' * len(DEFERRED_INDEX_TABLES))})
+        """,
+        DEFERRED_INDEX_TABLES,
+    ).fetchall()
+    for row in rows:
+        conn.execute(f'DROP INDEX IF EXISTS "{row["name"]}"')
+    return [row["sql"] for row in rows]
+
+
+class Importer:
+    """Buffered NDJSON loader; use import_ndjson() unless you need to feed records yourself."""
+
+    def __init__(self, conn, batch_size: int = IMPORT_BATCH, txn_rows: int = IMPORT_TXN_ROWS):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.txn_rows = txn_rows
+        self.counts = {kind: 0 for kind in FLUSH_ORDER}
+        self.skipped = 0
+        self._buffers = {kind: [] for kind in FLUSH_ORDER}
+        self._user_map = []
+        self._txn_rows = 0
+        conn.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS import_user_map (old_id INTEGER PRIMARY KEY, new_id INTEGER)"
+        )
+
+    def add(self, record: dict):
+        kind = record.get("type")
+        if kind not in self._buffers:
+            self.skipped += 1
+            return
+        self._buffers[kind].append(_params(kind, record))
+        if kind == "user" and record.get("id") is not None:
+            self._user_map.append((record["id"], record["username"]))
+        if len(self._buffers[kind]) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        conn = self.conn
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        for kind in FLUSH_ORDER:
+            rows = self._buffers[kind]
+            if not rows:
+                continue
+            conn.executemany(INSERT_SQL[kind], rows)
+            if kind == "user" and self._user_map:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO temp.import_user_map (old_id, new_id) "
+                    "SELECT ?, id FROM users WHERE username=?",
+                    self._user_map,
+                )
+                self._user_map = []
+            self.counts[kind] += len(rows)
+            self._txn_rows += len(rows)
+            self._buffers[kind] = []
+        if self._txn_rows >= self.txn_rows:
+            self.commit()
+
+    def commit(self):
+        if self.conn.in_transaction:
+            self.conn.commit()
+        self._txn_rows = 0
+
+
+def import_ndjson(lines, defer_indexes: bool = True, batch_size: int = IMPORT_BATCH,
+                  txn_rows: int = IMPORT_TXN_ROWS, db_path: str = DB_PATH) -> dict:
+    """
+    Load NDJSON lines (any iterable, e.g. an open file) into the database.
+    Turns are appended; users and buddies that
+    already exist are kept. Returns rows inserted per type. Transactions
+    commit every txn_rows rows, so a failure keeps what was committed.
+    """
+    started = time.monotonic()
+    conn = db.connect(db_path)
+    conn.execute("PRAGMA cache_size=-200000")
+    indexes = []
+    try:
+        if defer_indexes:
+            indexes = _drop_indexes(conn)
+        importer = Importer(conn, batch_size, txn_rows)
+        for number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Invalid NDJSON on line {number}: {e}") from e
+            importer.add(record)
+        importer.flush()
+        importer.commit()
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        # Rebuild deferred indexes even if the import failed part-way
+        for sql in indexes:
+            conn.execute(sql.replace("CREATE INDEX", "CREATE INDEX IF NOT EXISTS", 1))
+        if indexes:
+            conn.execute("PRAGMA optimize")
+        conn.execute("DROP TABLE IF EXISTS temp.import_user_map")
+        conn.close()
+    result = dict(importer.counts, skipped=importer.skipped)
+    result["seconds"] = round(time.monotonic() - started, 3)
+    return result
@@ -0,0 +1,230 @@
+# backend/database/write_behind.py
+
+import queue
+import threading
+import time
+import traceback
+from collections import defaultdict
+
+from database import db
+
+# -------------------------------------------------------------
+# Write-behind persistence for Build-A-Buddy
+# -------------------------------------------------------------
+# Request handlers enqueue writes (chat turns, mood updates) and return
+# immediately. A single background writer drains the queue and applies
+# many writes in one transaction, so the fsync cost is paid once per
+# batch instead of once per message.
+#
+# Writes that should be visible to readers before they are committed
+# (e.g. chat turns for get_history) are tracked as "pending" per key;
+# read_consistent() combines a DB read with that pending set atomically
+# with respect to the writer's commits.
+# -------------------------------------------------------------
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """
+    handlers: {kind: fn(conn, *args)} applied inside the writer's transaction
+    max_size: queue bound; submit() blocks up to put_timeout when full
+    batch_size: maximum writes folded into one transaction
+    on_drop: fn(kind, args, key) called for each write given up on
+    """
+
+    def __init__(self, handlers: dict, max_size: int = 10000, batch_size: int = 500,
+                 put_timeout: float = 1.0, max_retries: int = 3, on_drop=None):
+        self.handlers = handlers
+        self.on_drop = on_drop
+        self.batch_size = batch_size
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=max_size)
+        self._pending = defaultdict(list)      # key -> [(seq, visible), ...]
+        self._pending_lock = threading.Lock()
+        self._commit_lock = threading.RLock()
+        self._seq = 0
+        self._thread = None
+        self.committed = 0
+        self.batches = 0
+        self.rejected = 0
+        self.failed = 0
+
+    # ---------------------------
+    # Lifecycle
+    # ---------------------------
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def flush(self, timeout: float = None) -> bool:
+        """Block until everything submitted so far is committed."""
+        if self._thread is None or not self._thread.is_alive():
+            self._drain_inline()
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def close(self, timeout: float = 30.0):
+        """Flush outstanding writes and stop the writer thread."""
+        if self._thread is not None and self._thread.is_alive():
+            self.flush(timeout)
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+        self._thread = None
+
+    # ---------------------------
+    # Producers
+    # ---------------------------
+    def submit(self, kind: str, args: tuple, key=None, visible=None) -> bool:
+        """
+        Enqueue a write. If key/visible are given, `visible` is reported by
+        pending(key) until the write commits. Returns False if the queue
+        stayed full for put_timeout; the caller should write synchronously.
+        """
+        with self._pending_lock:
+            self._seq += 1
+            seq = self._seq
+            if key is not None:
+                self._pending[key].append((seq, visible))
+        try:
+            self._queue.put((seq, kind, args, key), timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            self.rejected += 1
+            self._forget([(seq, key)])
+            return False
+
+    def pending(self, key) -> list:
+        with self._pending_lock:
+            return [visible for _, visible in self._pending.get(key, ())]
+
+    def read_consistent(self, key, read_fn):
+        """
+        Run read_fn() and snapshot pending(key) with no commit in between,
+        so every write is seen exactly once: either in the DB or as pending.
+        """
+        with self._pending_lock:
+            has_pending = bool(self._pending.get(key))
+        if not has_pending:
+            return read_fn(), []
+        with self._commit_lock:
+            return read_fn(), self.pending(key)
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "committed": self.committed,
+            "batches": self.batches,
+            "rejected": self.rejected,
+            "failed": self.failed,
+        }
+
+    # ---------------------------
+    # Writer
+    # ---------------------------
+    def _forget(self, items):
+        with self._pending_lock:
+            for seq, key in items:
+                if key is None:
+                    continue
+                entries = [e for e in self._pending.get(key, ()) if e[0] != seq]
+                if entries:
+                    self._pending[key] = entries
+                else:
+                    self._pending.pop(key, None)
+
+    def _commit(self, batch, attempts: int) -> bool:
+        for attempt in range(attempts):
+            try:
+                with self._commit_lock:
+                    with db.transaction() as conn:
+                        for _, kind, args, _ in batch:
+                            self.handlers[kind](conn, *args)
+                    self._forget([(seq, key) for seq, _, _, key in batch])
+                self.committed += len(batch)
+                self.batches += 1
+                return True
+            except Exception as e:
+                print(f"WriteBehindQueue: batch of {len(batch)} failed (attempt {attempt + 1}):", e)
+                if attempt == attempts - 1:
+                    traceback.print_exc()
+                else:
+                    time.sleep(0.05 * (attempt + 1))
+        return False
+
+    def _drop(self, item):
+        seq, kind, args, key = item
+        self.failed += 1
+        self._forget([(seq, key)])
+        if self.on_drop is not None:
+            try:
+                self.on_drop(kind, args, key)
+            except Exception:
+                traceback.print_exc()
+
+    def _apply(self, batch):
+        if self._commit(batch, self.max_retries + 1):
+            return
+        if len(batch) == 1:
+            self._drop(batch[0])
+            return
+        # Commit the writes one by one, so only those that fail are lost
+        for item in batch:
+            if not self._commit([item], 1):
+                self._drop(item)
+
+    def _take_batch(self, first):
+        batch = [first]
+        stop = False
+        while len(batch) < self.batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                stop = True
+                self._queue.task_done()
+                break
+            batch.append(item)
+        return batch, stop
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                self._queue.task_done()
+                return
+            batch, stop = self._take_batch(first)
+            try:
+                self._apply(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _drain_inline(self):
+        while True:
+            try:
+                first = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if first is _STOP:
+                self._queue.task_done()
+                continue
+            batch, _ = self._take_batch(first)
+            try:
+                self._apply(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
@@ -0,0 +1,116 @@
+# ===================================================================
+# Build-A-Buddy Executors
+# Dedicated, bounded thread pools for the blocking work behind the async
+# request handlers, so one kind of work cannot starve another:
+#
+#   db         SQLite reads and writes (few threads: SQLite has one writer)
+#   inference  mood, generate() and Responder replies (CPU-sized)
+#   engines    BuddyEngine construction, which may load a model
+#   streams    waiting for the next piece of a streamed reply (the
+#              streaming generate() itself runs on `inference`)
+#
+#   reply = await executors.inference.run(engine.get_reply, message)
+#
+# Calls carry the caller's context, so stage() timings recorded in a
+# pool thread still land in the request's timing breakdown. Everything
+# else (cache lookups, metrics, readiness) runs on the event loop and
+# stays fast however busy the pools are.
+# ===================================================================
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ml.batcher import MAX_BATCH_SIZE
+from ml.admission import MAX_CONCURRENT
+from metrics import REGISTRY
+
+DB_WORKERS = int(os.environ.get("BUDDY_DB_WORKERS", "4"))
+# At least a full batch, or concurrent chats could never fill one
+INFERENCE_WORKERS = int(os.environ.get("BUDDY_INFERENCE_WORKERS", "0")) or max(os.cpu_count() or 1, MAX_BATCH_SIZE)
+ENGINE_WORKERS = int(os.environ.get("BUDDY_ENGINE_WORKERS", "2"))
+# One per stream that can hold an LLM slot; these threads only wait
+STREAM_WORKERS = int(os.environ.get("BUDDY_STREAM_WORKERS", "0")) or MAX_CONCURRENT
+
+_DONE = object()
+
+
+class Executor:
+    """A named thread pool, created on first use and again after shutdown()."""
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = max(1, workers)
+        self.pending = 0            # calls submitted and not yet finished
+        self.completed = 0
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix=f"buddy-{self.name}")
+            self.pending += 1
+            return self._pool
+
+    def _finished(self, _=None):
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) in the pool and await its result."""
+        call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+        future = asyncio.get_running_loop().run_in_executor(self._executor(), call)
+        future.add_done_callback(self._finished)
+        return await future
+
+    def submit(self, fn, *args, **kwargs):
+        """Fire-and-forget from synchronous code; returns a concurrent Future."""
+        future = self._executor().submit(fn, *args, **kwargs)
+        future.add_done_callback(self._finished)
+        return future
+
+    async def iterate(self, iterator):
+        """Async iteration over a blocking iterator, one next() per pool call."""
+        while True:
+            item = await self.run(next, iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"workers": self.workers, "pending": self.pending, "completed": self.completed}
+
+
+# Shared process-wide instances
+db = Executor("db", DB_WORKERS)
+inference = Executor("inference", INFERENCE_WORKERS)
+engines = Executor("engines", ENGINE_WORKERS)
+streams = Executor("streams", STREAM_WORKERS)
+ALL = (db, inference, engines, streams)
+
+
+def shutdown(wait: bool = True):
+    for executor in ALL:
+        executor.shutdown(wait)
+
+
+def stats() -> dict:
+    return {executor.name: executor.stats() for executor in ALL}
+
+
+for _executor in ALL:
+    REGISTRY.gauge(f"buddy_{_executor.name}_executor_pending",
+                   f"Calls queued or running in the {_executor.name} executor.",
+                   functools.partial(lambda e: e.pending, _executor))
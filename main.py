@@ -2,10 +2,14 @@
 
 import sys
 import os
-from fastapi import FastAPI, HTTPException, Body
+import asyncio
+import json
+import weakref
+from contextlib import asynccontextmanager, ExitStack
+from fastapi import FastAPI, HTTPException, Body, Response
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
-import sqlite3
 from typing import List, Optional
 
 # ---------------------------
@@ -14,13 +18,45 @@ from typing import List, Optional
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(BASE_DIR)
 
-from database.db_init import DB_PATH
-from ml.llm import BuddyEngine
+from database import db
+from database.db_init import migrate_database
+from database.write_behind import WriteBehindQueue
+from database.history_cache import RecentTurnsCache
+from database import retention, transfer
+from database.identity import identities
+from ml.llm import BuddyEngine, get_replies_batch, HAS_TRANSFORMERS, MODEL_NAME
+from ml.context import CONTEXT_TURNS
+from ml.deadline import Deadline
+from ml.admission import admission
+from ml.model_registry import registry
+from ml.warmup import warmup, WARMUP_ENABLED
+from ml import inference_mode
+from ml.engine_cache import EngineCache
+from ml.memory_store import MemoryStore
+from metrics import REGISTRY, TimingMiddleware, stage, record_error
+import executors
 
 # ---------------------------
 # FastAPI app
 # ---------------------------
-app = FastAPI(title="Build-A-Buddy Backend")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    migrate_database()
+    if write_behind:
+        write_behind.start()
+    # Load and exercise the model off the request path; /ready flips once done
+    llm_available = HAS_TRANSFORMERS or registry.is_loaded(MODEL_NAME)
+    warmup.start(MODEL_NAME, enabled=WARMUP_ENABLED and llm_available)
+    if retention.RETENTION_ENABLED:
+        retention.scheduler.start()
+    yield
+    retention.scheduler.close()
+    # Flush queued writes before the worker exits
+    if write_behind:
+        write_behind.close()
+    executors.shutdown()
+
+app = FastAPI(title="Build-A-Buddy Backend", lifespan=lifespan)
 
 # ---------------------------
 # CORS Middleware (allow dev frontend)
@@ -31,12 +67,48 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
 
+# Outermost, so request latency includes CORS handling
+app.add_middleware(TimingMiddleware)
+
+# ---------------------------
+# Stateless (multi-worker) mode
+# ---------------------------
+# With several worker processes (see serve.py) any worker may serve any
+# buddy, so the database is the only source of truth: engines rehydrate
+# their mood from the buddies table on every request, and per-process
+# caches that could go stale across workers are turned off.
+STATELESS = os.environ.get("BUDDY_STATELESS", "0") == "1"
+
 # ---------------------------
 # BuddyEngine cache
 # ---------------------------
-buddies = {}
+ENGINE_CACHE_SIZE = int(os.environ.get("BUDDY_ENGINE_CACHE_SIZE", "256"))
+ENGINE_IDLE_TTL = float(os.environ.get("BUDDY_ENGINE_IDLE_TTL", "1800")) or None
+
+def checkpoint_buddy(buddy_id: str, engine):
+    """
+    Write an evicted engine's mood and personality back to the buddies
+    table. Evictions happen on the event loop, so the write is handed to
+    the DB executor.
+    """
+    executors.db.submit(
+        save_buddy_state,
+        buddy_id,
+        engine.personality_type,
+        engine.personality_vector,
+        engine.mood_engine.current_mood,
+    )
+
+# In stateless mode every turn is already persisted; checkpointing an
+# evicted engine could overwrite a newer mood written by another worker.
+buddies = EngineCache(
+    max_size=ENGINE_CACHE_SIZE,
+    ttl=ENGINE_IDLE_TTL,
+    on_evict=None if STATELESS else checkpoint_buddy,
+)
 
 # ---------------------------
 # Models
@@ -52,199 +124,825 @@ class InitBuddyRequest(BaseModel):
     buddy_id: str
     personality: str = "friendly"
 
+class BatchChatRequest(BaseModel):
+    items: List[ChatRequest]
+
+class RetentionPolicyRequest(BaseModel):
+    scope: str                # 'buddy' or 'user' (applies to the buddies the user talks to)
+    owner: str                # buddy_id or user id
+    keep_turns: int = 0       # 0 = no limit
+    keep_days: float = 0
+
 # ---------------------------
 # Database utilities
 # ---------------------------
 def get_connection():
-    """Safe SQLite connection factory."""
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """This thread's pooled SQLite connection (see database/db.py)."""
+    return db.get_connection()
 
 def ensure_user_in_db(username: str):
-    """Ensure a user exists in the users table."""
-    try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT id FROM users WHERE username=?", (username,))
-        row = cur.fetchone()
-        if not row:
-            cur.execute("INSERT INTO users (username) VALUES (?)", (username,))
-            conn.commit()
-            cur.execute("SELECT id FROM users WHERE username=?", (username,))
-            row = cur.fetchone()
-        return row["id"]
+    """User id for username, creating the user if needed (cached; see database/identity.py)."""
+    try:
+        return identities.resolve_user(username)
     except Exception as e:
         print(f"DB error in ensure_user_in_db: {e}")
+        record_error("ensure_user_in_db")
         return None
-    finally:
-        conn.close()
 
-def ensure_buddy_in_db(buddy_id: str, personality: str):
-    """Ensure a buddy exists in the buddies table."""
+def ensure_buddy_in_db(buddy_id: str, personality: str, with_mood: bool = STATELESS):
+    """
+    Ensure a buddy exists in the buddies table. Known buddies cost no
+    query unless with_mood (default: in stateless mode) asks for the
+    stored mood, which is then returned ("neutral" for a new buddy).
+    Returns True without with_mood, and None on error.
+    """
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT buddy_id FROM buddies WHERE buddy_id=?", (buddy_id,))
-        row = cur.fetchone()
-        if not row:
-            cur.execute(
-                """
-                INSERT INTO buddies (buddy_id, personality_type, kindness, excitement, humor, current_mood)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """,
-                (buddy_id, personality, 0.5, 0.5, 0.5, "neutral"),
-            )
-            conn.commit()
+        mood = identities.resolve_buddy(buddy_id, personality, with_mood)
+        return mood if with_mood else True
     except Exception as e:
         print(f"DB error in ensure_buddy_in_db: {e}")
-    finally:
-        conn.close()
+        record_error("ensure_buddy_in_db")
+        return None
+
+def _write_mood(conn, buddy_id: str, mood: str):
+    conn.execute("UPDATE buddies SET current_mood=? WHERE buddy_id=?", (mood, buddy_id))
 
 def update_mood_in_db(buddy_id: str, mood: str):
-    """Update the current mood of a buddy."""
+    """Update the current mood of a buddy (queued when write-behind is enabled)."""
+    if write_behind and write_behind.submit("mood", (buddy_id, mood)):
+        return
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("UPDATE buddies SET current_mood=? WHERE buddy_id=?", (mood, buddy_id))
-        conn.commit()
+        with db.transaction() as conn:
+            _write_mood(conn, buddy_id, mood)
     except Exception as e:
         print(f"DB error in update_mood_in_db: {e}")
-    finally:
-        conn.close()
+        record_error("update_mood_in_db")
 
-def save_conversation(user_id: int, buddy_id: str, user_message: str, buddy_reply: str):
-    """Persist a conversation to the database."""
+def save_buddy_state(buddy_id: str, personality_type: str, vector, mood: str):
+    """Persist a buddy's personality and mood (vector layout as in PersonalityVectorizer.update_vector)."""
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            INSERT INTO conversations (buddy_id, user_message, buddy_reply)
-            VALUES (?, ?, ?)
-            """,
-            (buddy_id, user_message, buddy_reply),
-        )
-        cur.execute(
-            """
-            INSERT INTO messages (user_id, sender, message, mood)
-            VALUES (?, 'user', ?, ?)
-            """,
-            (user_id, user_message, None)
-        )
-        cur.execute(
-            """
-            INSERT INTO messages (user_id, sender, message, mood)
-            VALUES (?, 'buddy', ?, ?)
-            """,
-            (user_id, buddy_reply, None)
-        )
-        conn.commit()
+        with db.transaction() as conn:
+            conn.execute(
+                """
+                UPDATE buddies
+                SET personality_type=?, kindness=?, excitement=?, humor=?, current_mood=?
+                WHERE buddy_id=?
+                """,
+                (personality_type, float(vector[0]), float(vector[1]), float(vector[2]), mood, buddy_id),
+            )
     except Exception as e:
-        print(f"DB error in save_conversation: {e}")
-    finally:
-        conn.close()
+        print(f"DB error in save_buddy_state: {e}")
+        record_error("save_buddy_state")
 
-def get_history(buddy_id: str, limit: int = 10) -> List[tuple]:
-    """Fetch recent conversation history for a buddy."""
-    try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
+def _write_turn(conn, user_id: int, buddy_id: str, user_message: str, buddy_reply: str, mood: str = None):
+    conn.execute(
+        """
+        INSERT INTO turns (user_id, buddy_id, user_message, buddy_reply, mood)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        (user_id, buddy_id, user_message, buddy_reply, mood),
+    )
+
+def save_conversation(user_id: int, buddy_id: str, user_message: str, buddy_reply: str, mood: str = None):
+    """Persist a conversation turn to the database (queued when write-behind is enabled)."""
+    with recent_turns.writing(buddy_id, (user_message, buddy_reply)):
+        if write_behind and write_behind.submit(
+            "turn",
+            (user_id, buddy_id, user_message, buddy_reply, mood),
+            key=buddy_id,
+            visible=(user_message, buddy_reply),
+        ):
+            return
+        try:
+            with db.transaction() as conn:
+                _write_turn(conn, user_id, buddy_id, user_message, buddy_reply, mood)
+        except Exception as e:
+            print(f"DB error in save_conversation: {e}")
+            record_error("save_conversation")
+
+# SQLite caps bound parameters per statement; chunk IN (...) lists
+SQL_CHUNK = 500
+
+def ensure_users_bulk(conn, usernames) -> dict:
+    """
+    Set-based version of ensure_user_in_db: returns {username: user_id}.
+    Cached users are not queried; the caller caches the rest once committed.
+    """
+    ids = {}
+    missing = []
+    for username in usernames:
+        user_id = identities.cached_user_id(username)
+        if user_id is None:
+            missing.append(username)
+        else:
+            ids[username] = user_id
+    usernames = missing
+    conn.executemany(
+        "INSERT INTO users (username) VALUES (?) ON CONFLICT(username) DO NOTHING",
+        [(u,) for u in usernames],
+    )
+    for start in range(0, len(usernames), SQL_CHUNK):
+        chunk = usernames[start:start + SQL_CHUNK]
+        rows = conn.execute(
+            f"SELECT id, username FROM users WHERE username IN ({','.join('?' * len(chunk))})",
+            chunk,
+        ).fetchall()
+        ids.update({r["username"]: r["id"] for r in rows})
+    return ids
+
+def ensure_buddies_bulk(conn, personalities: dict):
+    """Set-based version of ensure_buddy_in_db for {buddy_id: personality}; skips cached buddies."""
+    personalities = {b: p for b, p in personalities.items() if not identities.knows_buddy(b)}
+    conn.executemany(
+        """
+        INSERT INTO buddies (buddy_id, personality_type, kindness, excitement, humor, current_mood)
+        VALUES (?, ?, 0.5, 0.5, 0.5, 'neutral')
+        ON CONFLICT(buddy_id) DO NOTHING
+        """,
+        list(personalities.items()),
+    )
+
+def load_moods_bulk(conn, buddy_ids) -> dict:
+    """{buddy_id: current_mood} for many buddies, SQL_CHUNK ids per query."""
+    buddy_ids = list(buddy_ids)
+    moods = {}
+    for start in range(0, len(buddy_ids), SQL_CHUNK):
+        chunk = buddy_ids[start:start + SQL_CHUNK]
+        rows = conn.execute(
+            f"SELECT buddy_id, current_mood FROM buddies WHERE buddy_id IN ({','.join('?' * len(chunk))})",
+            chunk,
+        ).fetchall()
+        moods.update((r["buddy_id"], r["current_mood"]) for r in rows)
+    return moods
+
+def save_conversations_bulk(turns, moods: dict, memories=()):
+    """
+    Persist many (user_id, buddy_id, user_message, buddy_reply, mood) turns, the
+    final mood per buddy, and new memories in a single transaction (or via
+    the write-behind queue when enabled).
+    """
+    if write_behind:
+        for turn in turns:
+            save_conversation(*turn)
+        for buddy_id, mood in moods.items():
+            update_mood_in_db(buddy_id, mood)
+        if memory_store and memories:
+            memory_store.add_many(list(memories))
+        return
+
+    with ExitStack() as stack:
+        for _, buddy_id, user_message, buddy_reply, _ in turns:
+            stack.enter_context(recent_turns.writing(buddy_id, (user_message, buddy_reply)))
+        with db.transaction() as conn:
+            conn.executemany(
+                """
+                INSERT INTO turns (user_id, buddy_id, user_message, buddy_reply, mood)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                turns,
+            )
+            conn.executemany(
+                "UPDATE buddies SET current_mood=? WHERE buddy_id=?",
+                [(mood, buddy_id) for buddy_id, mood in moods.items()],
+            )
+            if memory_store and memories:
+                memory_store.add_many(list(memories))
+
+def _read_history_page(buddy_id: str, limit: int, before=None):
+    """
+    Newest-first page of (id, timestamp, user_message, buddy_reply) rows,
+    keyset-paginated on (timestamp, id) via idx_turns_buddy_time.
+    """
+    conn = get_connection()
+    if before is None:
+        return conn.execute(
             """
-            SELECT user_message, buddy_reply
-            FROM conversations
+            SELECT id, timestamp, user_message, buddy_reply
+            FROM turns
             WHERE buddy_id=?
-            ORDER BY timestamp DESC
+            ORDER BY timestamp DESC, id DESC
             LIMIT ?
             """,
             (buddy_id, limit),
-        )
-        rows = cur.fetchall()
-        return rows[::-1]  # oldest first
+        ).fetchall()
+    return conn.execute(
+        """
+        SELECT id, timestamp, user_message, buddy_reply
+        FROM turns
+        WHERE buddy_id=? AND (timestamp, id) < (?, ?)
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+        """,
+        (buddy_id, before[0], before[1], limit),
+    ).fetchall()
+
+def encode_cursor(timestamp, row_id: int) -> str:
+    return f"{timestamp}|{row_id}"
+
+def decode_cursor(cursor: str):
+    try:
+        timestamp, row_id = cursor.rsplit("|", 1)
+        return timestamp, int(row_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid history cursor.")
+
+def get_history_page(buddy_id: str, limit: int = 20, before: str = None):
+    """
+    One page of history, oldest first, plus the cursor for the next
+    (older) page or None when there is nothing older.
+    Turns still queued by write-behind appear on the first page, and
+    pages continue into archived turns once the hot rows run out.
+    """
+    cursor = decode_cursor(before) if before else None
+
+    def read():
+        return _read_history_page(buddy_id, limit + 1, cursor)
+
+    if write_behind and cursor is None:
+        rows, pending = write_behind.read_consistent(buddy_id, read)
+    else:
+        rows, pending = read(), []
+
+    pending = pending[max(0, len(pending) - limit):] if limit > 0 else []
+    room = limit - len(pending)
+    if len(rows) <= room:
+        # Hot table exhausted; continue into turns moved out by retention
+        boundary = (rows[-1]["timestamp"], rows[-1]["id"]) if rows else cursor
+        rows = list(rows) + retention.archived_turns(buddy_id, room + 1 - len(rows), boundary)
+    if room == 0:
+        # Page is all queued turns; the next page starts at the newest stored row
+        next_cursor = encode_cursor(rows[0]["timestamp"], rows[0]["id"] + 1) if rows else None
+        return pending, next_cursor
+
+    has_more = len(rows) > room
+    rows = rows[:room]
+    next_cursor = encode_cursor(rows[-1]["timestamp"], rows[-1]["id"]) if has_more else None
+    turns = [(r["user_message"], r["buddy_reply"]) for r in rows[::-1]] + pending
+    return turns, next_cursor
+
+def _load_history(buddy_id: str, limit: int) -> List[tuple]:
+    try:
+        turns, _ = get_history_page(buddy_id, limit)
+        return turns
     except Exception as e:
         print(f"DB error in get_history: {e}")
+        record_error("get_history")
         return []
+
+def get_history(buddy_id: str, limit: int = 10) -> List[tuple]:
+    """Recent conversation history for a buddy, oldest first (served from memory when cached)."""
+    return recent_turns.get(buddy_id, limit, lambda n: _load_history(buddy_id, n))
+
+def sync_context(buddy_id: str, engine):
+    """
+    Load the buddy's recent turns into an engine's prompt context. Once
+    per engine normally (it then records its own turns); on every turn
+    in stateless mode, where other workers add turns too.
+    """
+    if CONTEXT_TURNS and engine.llm_available() and (STATELESS or not engine.context.synced):
+        with stage("history"):
+            engine.context.sync(get_history(buddy_id, CONTEXT_TURNS))
+
+# ---------------------------
+# Long-term memory (vector recall over the memory table)
+# ---------------------------
+MEMORY_ENABLED = os.environ.get("BUDDY_MEMORY", "1") == "1"
+MEMORY_RECALL_K = int(os.environ.get("BUDDY_MEMORY_RECALL_K", "3"))
+MEMORY_MIN_WORDS = 4
+
+memory_store = MemoryStore(shared=STATELESS) if MEMORY_ENABLED else None
+
+def recall_memories(user_id: int, message: str) -> List[str]:
+    if not memory_store:
+        return []
+    with stage("memory_recall"):
+        return [content for content, _ in memory_store.recall(user_id, message, k=MEMORY_RECALL_K)]
+
+def is_memorable(message: str) -> bool:
+    return len(message.split()) >= MEMORY_MIN_WORDS
+
+def remember(user_id: int, message: str):
+    """Store the user's message as a memory if it carries enough content."""
+    if memory_store and is_memorable(message):
+        memory_store.add(user_id, message)
+
+# Capacity 0 disables the cache (stateless mode: other workers write too)
+recent_turns = RecentTurnsCache(
+    capacity=0 if STATELESS else int(os.environ.get("BUDDY_RECENT_TURNS", "20")),
+    max_buddies=int(os.environ.get("BUDDY_RECENT_TURNS_BUDDIES", "10000")),
+)
+
+# ---------------------------
+# Write-behind persistence (optional)
+# ---------------------------
+WRITE_BEHIND = os.environ.get("BUDDY_WRITE_BEHIND", "0") == "1"
+if WRITE_BEHIND and STATELESS:
+    # Queued writes are invisible to other workers until flushed
+    print("⚠️ BUDDY_WRITE_BEHIND is ignored in stateless mode")
+    WRITE_BEHIND = False
+
+def forget_dropped_write(kind: str, args: tuple, key):
+    """A queued write was given up on: stop serving a lost turn from the recent-turns cache."""
+    record_error(f"write_behind_{kind}")
+    if kind == "turn":
+        recent_turns.invalidate(args[1])
+
+write_behind = WriteBehindQueue(
+    handlers={"turn": _write_turn, "mood": _write_mood},
+    max_size=int(os.environ.get("BUDDY_WRITE_QUEUE_SIZE", "10000")),
+    batch_size=int(os.environ.get("BUDDY_WRITE_BATCH_SIZE", "500")),
+    on_drop=forget_dropped_write,
+) if WRITE_BEHIND else None
+
+# ---------------------------
+# Admission control for the LLM path
+# ---------------------------
+# What a request that cannot get an LLM slot receives, per route:
+# "responder" (a Responder reply) or "429" (Too Many Requests)
+SHED_POLICY = {"chat": "responder", "stream": "responder", "batch": "responder"}
+SHED_POLICY.update(
+    part.split("=", 1) for part in os.environ.get("BUDDY_SHED_POLICY", "").split(",") if "=" in part
+)
+
+async def acquire_llm(route: str, username: str, uses_llm: bool, deadline: Deadline) -> bool:
+    """
+    Ask the admission controller for an LLM slot. Returns True if the LLM
+    may be used (the caller must then call admission.release()), False if
+    the request should be answered by the Responder. Raises 429 instead
+    when the route's shed policy says so. Requests that would not use
+    the LLM anyway (`uses_llm` False) skip admission.
+    """
+    if not uses_llm:
+        return False
+    with stage("admission"):
+        ticket = await admission.try_acquire_async(username, deadline.remaining())
+    if not ticket.admitted and SHED_POLICY.get(route) == "429":
+        raise HTTPException(status_code=429, detail=f"Server busy ({ticket.outcome}); try again shortly.",
+                            headers={"Retry-After": "1"})
+    return ticket.admitted
+
+@asynccontextmanager
+async def llm_slot(route: str, username: str, uses_llm: bool, deadline: Deadline):
+    allowed = await acquire_llm(route, username, uses_llm, deadline)
+    try:
+        yield allowed
     finally:
-        conn.close()
+        if allowed:
+            admission.release()
+
+# ---------------------------
+# Metrics (values owned by other components, read at scrape time)
+# ---------------------------
+def max_rss_bytes() -> int:
+    import resource
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+REGISTRY.gauge("buddy_engine_cache_size", "BuddyEngines held in memory.", lambda: len(buddies))
+REGISTRY.gauge("buddy_engine_cache_hit_rate", "Engine cache hit rate.", lambda: buddies.stats()["hit_rate"])
+REGISTRY.gauge("buddy_identity_cache_hit_rate", "User/buddy identity cache hit rate.",
+               lambda: identities.stats()["hit_rate"])
+REGISTRY.counter_fn("buddy_db_lock_retries_total", "Transactions retried after SQLITE_BUSY.",
+                    lambda: db.pool.retries)
+REGISTRY.gauge("buddy_db_connections", "Pooled SQLite connections.", lambda: db.pool.stats()["connections"])
+REGISTRY.info("buddy_inference_mode", "CPU inference settings in effect (dtype, threads, compile).",
+              inference_mode.describe)
+REGISTRY.gauge("buddy_process_max_rss_bytes", "Peak resident memory of this worker.", max_rss_bytes)
+if write_behind:
+    REGISTRY.gauge("buddy_write_queue_depth", "Writes waiting in the write-behind queue.", write_behind.depth)
 
 # ---------------------------
 # API Endpoints
 # ---------------------------
+# Handlers are async and never block the event loop: SQLite work runs on
+# executors.db, generation on executors.inference and BuddyEngine
+# construction on executors.engines (see executors.py), so /health,
+# /ready and /chat-history answer promptly while long generations run.
 @app.get("/")
-def root():
+async def root():
     return {"status": "✅ Build-A-Buddy backend running"}
 
+def _ping_db():
+    get_connection().execute("SELECT 1")
+
 @app.get("/health")
-def health_check():
+async def health_check():
+    """Liveness: the process is up and can reach the database."""
     try:
-        conn = get_connection()
-        conn.execute("SELECT 1")
-        conn.close()
+        await executors.db.run(_ping_db)
         return {"ok": True, "status": "healthy"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/ready")
+async def readiness_check(response: Response):
+    """
+    Readiness: 503 until the model warm-up has finished. A failed or
+    skipped warm-up still counts as ready (replies come from the Responder).
+    """
+    ready = warmup.finished()
+    if not ready:
+        response.status_code = 503
+    return {"ready": ready, "warmup": warmup.status(), "models": registry.stats()}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus text exposition of request, stage and component metrics."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/engine-cache/stats")
+async def engine_cache_stats():
+    return buddies.stats()
+
+@app.get("/executors/stats")
+async def executor_stats():
+    return executors.stats()
+
+@app.get("/export")
+async def export_chat_data(buddy_id: Optional[str] = None, username: Optional[str] = None,
+                           include_archive: bool = True):
+    """
+    Stream chat data as NDJSON: one buddy and its turns, one user and
+    their turns, or (with neither) everything. Memory use is flat
+    regardless of size; load the output with `db_init.py import`.
+    """
+    if buddy_id is not None and username is not None:
+        raise HTTPException(status_code=400, detail="Pass buddy_id or username, not both.")
+    return StreamingResponse(
+        executors.db.iterate(transfer.export_ndjson(buddy_id, username, include_archive)),
+        media_type="application/x-ndjson",
+    )
+
+@app.get("/retention/stats")
+async def retention_stats():
+    return await executors.db.run(retention.scheduler.stats)
+
+@app.put("/retention/policy")
+async def set_retention_policy(req: RetentionPolicyRequest):
+    """Override the retention policy for one buddy or user."""
+    try:
+        await executors.db.run(retention.set_policy, req.scope, req.owner, req.keep_turns, req.keep_days)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"scope": req.scope, "owner": req.owner, "keep_turns": req.keep_turns, "keep_days": req.keep_days}
+
 @app.get("/chat-history")
-def chat_history(buddy_id: str, limit: int = 20):
-    history = get_history(buddy_id, limit)
+async def chat_history(response: Response, buddy_id: str, limit: int = 20, before: Optional[str] = None):
+    """
+    Page through a buddy's history, oldest first within the page.
+    Pass the X-Next-Cursor response header back as `before` to fetch
+    the next (older) page; the header is absent on the last page.
+    """
+    if limit < 0:
+        raise HTTPException(status_code=400, detail="limit must be non-negative.")
+    try:
+        history, next_cursor = await executors.db.run(get_history_page, buddy_id, limit, before)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"DB error in chat_history: {e}")
+        record_error("chat_history")
+        history, next_cursor = [], None
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return [{"user_message": msg, "buddy_reply": reply} for msg, reply in history]
 
-@app.post("/init")
-def init_buddy(req: InitBuddyRequest):
-    """Initialize or reset a buddy in DB and memory."""
-    user_id = ensure_user_in_db(req.username)
+def resolve_participants(username: str, buddy_id: str, personality: str, with_mood: bool = STATELESS):
+    """User id and (with_mood) the stored buddy mood, creating either row if needed."""
+    user_id = ensure_user_in_db(username)
     if user_id is None:
         raise HTTPException(status_code=500, detail="Failed to create or fetch user.")
-    
-    ensure_buddy_in_db(req.buddy_id, req.personality)
+    mood = ensure_buddy_in_db(buddy_id, personality, with_mood)
+    return user_id, mood if with_mood else None
 
+async def create_engine(buddy_id: str, personality: str) -> BuddyEngine:
     try:
-        buddies[req.buddy_id] = BuddyEngine(req.buddy_id, req.personality)
+        return await executors.engines.run(BuddyEngine, buddy_id, personality)
     except Exception as e:
+        record_error("engine_init")
         raise HTTPException(status_code=500, detail=f"BuddyEngine init failed: {e}")
 
+def replace_engine(buddy_id: str, engine):
+    """Cache an engine, closing the one it replaces (e.g. built by a concurrent request)."""
+    old_engine = buddies.put(buddy_id, engine)
+    if old_engine is not None and old_engine is not engine:
+        old_engine.close()
+
+@app.post("/init")
+async def init_buddy(req: InitBuddyRequest):
+    """Initialize or reset a buddy in DB and memory."""
+    await executors.db.run(resolve_participants, req.username, req.buddy_id, req.personality)
+
+    engine = await create_engine(req.buddy_id, req.personality)
+    # The reset applies to every worker, not just this one's engine
+    await executors.db.run(save_buddy_state, req.buddy_id, engine.personality_type,
+                           engine.personality_vector, engine.mood_engine.current_mood)
+
+    # Requests still using the old engine keep it until they finish (see BuddyEngine.close)
+    replace_engine(req.buddy_id, engine)
+
     return {"message": f"User '{req.username}' and buddy '{req.buddy_id}' initialized with personality '{req.personality}'."}
 
-@app.post("/chat")
-def chat(req: ChatRequest):
-    """Send a message to a buddy and return response."""
-    user_id = ensure_user_in_db(req.username)
-    if user_id is None:
-        raise HTTPException(status_code=500, detail="Failed to create or fetch user.")
-    
-    ensure_buddy_in_db(req.buddy_id, req.personality)
+def refresh_engine(buddy_id: str, engine, personality: str = None, stored_mood: str = None):
+    """
+    Bring an engine up to date for the next turn: a changed personality,
+    the stored mood and its prompt context. May read the database, so it
+    runs on the DB executor.
+    """
+    if personality is not None:
+        engine.update_personality(personality)
+    if stored_mood:
+        # The mood checkpointed when an earlier engine was evicted, or
+        # (stateless mode) moved by another worker since this one last ran
+        engine.restore_state(stored_mood)
+    sync_context(buddy_id, engine)
 
-    # Initialize or update buddy engine
-    if req.buddy_id not in buddies:
-        try:
-            buddies[req.buddy_id] = BuddyEngine(req.buddy_id, req.personality)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"BuddyEngine init failed: {e}")
-    else:
-        buddies[req.buddy_id].update_personality(req.personality)
+def prepare_turn(buddy_id: str, engine, personality: str, stored_mood: str, user_id: int, message: str):
+    refresh_engine(buddy_id, engine, personality, stored_mood)
+    return recall_memories(user_id, message)
+
+async def prepare_chat(req: ChatRequest):
+    """
+    Resolve the user and buddy rows and return (user_id, engine, memories)
+    for a chat request. The engine is leased: call engine.release() once
+    done with it.
+    """
+    # A cached engine holds the current mood; a new one starts from the
+    # stored mood, which stateless mode reads for every turn anyway
+    buddy_engine = buddies.lease(req.buddy_id)
+    try:
+        with stage("upsert"):
+            user_id, stored_mood = await executors.db.run(
+                resolve_participants, req.username, req.buddy_id, req.personality,
+                STATELESS or buddy_engine is None)
+
+        # Initialize or update buddy engine
+        personality = req.personality
+        if buddy_engine is None:
+            with stage("engine"):
+                buddy_engine = (await create_engine(req.buddy_id, req.personality)).retain()
+                replace_engine(req.buddy_id, buddy_engine)
+            personality = None      # fresh engine, already up to date
+
+        memories = await executors.db.run(
+            prepare_turn, req.buddy_id, buddy_engine, personality, stored_mood, user_id, req.message)
+    except BaseException:
+        if buddy_engine is not None:
+            buddy_engine.release()
+        raise
+    return user_id, buddy_engine, memories
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-    buddy_engine = buddies[req.buddy_id]
+def persist_turn(user_id: int, buddy_id: str, message: str, reply: str, mood: str):
+    with stage("persist"):
+        save_conversation(user_id, buddy_id, message, reply, mood)
+        update_mood_in_db(buddy_id, mood)
+        remember(user_id, message)
 
-    # Generate response safely
+def finish_chat(user_id: int, buddy_id: str, message: str, reply: str, mood: str) -> List[tuple]:
+    persist_turn(user_id, buddy_id, message, reply, mood)
+    with stage("history"):
+        return get_history(buddy_id, limit=5)
+
+@app.post("/chat")
+async def chat(req: ChatRequest):
+    """Send a message to a buddy and return response."""
+    user_id, buddy_engine, memories = await prepare_chat(req)
+
+    # Generate response safely; the reply budget includes any admission wait
+    deadline = Deadline.from_budget()
     try:
-        mood, reply = buddy_engine.get_reply(req.message)
-        if not reply:
-            reply = "Hmm... I didn't understand that. Can you rephrase?"
-        if not mood:
-            mood = "neutral"
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"BuddyEngine reply failed: {e}")
+        async with llm_slot("chat", req.username, buddy_engine.llm_available(), deadline) as allow_llm:
+            try:
+                mood, reply = await executors.inference.run(
+                    buddy_engine.get_reply, req.message, memories, deadline, allow_llm)
+                if not reply:
+                    reply = "Hmm... I didn't understand that. Can you rephrase?"
+                if not mood:
+                    mood = "neutral"
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"BuddyEngine reply failed: {e}")
+    finally:
+        buddy_engine.release()
 
     # Persist conversation
-    save_conversation(user_id, req.buddy_id, req.message, reply)
-    update_mood_in_db(req.buddy_id, mood)
-    history = get_history(req.buddy_id, limit=5)
+    history = await executors.db.run(finish_chat, user_id, req.buddy_id, req.message, reply, mood)
 
     return {
         "buddy_id": req.buddy_id,
         "username": req.username,
         "mood": mood,
         "reply": reply,
-        "history": history,
+        "history": [{"user_message": msg, "buddy_reply": buddy_reply} for msg, buddy_reply in history],
     }
+
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest):
+    """
+    Streaming variant of /chat using Server-Sent Events.
+    Emits one `token` event per text chunk, then a `done` event with the
+    full reply and mood once the turn has been persisted.
+    """
+    user_id, buddy_engine, memories = await prepare_chat(req)
+    deadline = Deadline.from_budget()
+    try:
+        allow_llm = await acquire_llm("stream", req.username, buddy_engine.llm_available(), deadline)
+    except BaseException:
+        buddy_engine.release()
+        raise
+    # The slot and the engine lease are held until the stream ends; release
+    # exactly once, also if the body is never iterated (client gone before
+    # the first chunk)
+    released = []
+    def release_slot():
+        if not released:
+            released.append(True)
+            buddy_engine.release()
+            if allow_llm:
+                admission.release()
+
+    try:
+        mood, chunks = await executors.inference.run(
+            buddy_engine.stream_reply, req.message, memories, deadline, allow_llm)
+    except BaseException:
+        release_slot()
+        raise
+
+    async def events():
+        parts = []
+        try:
+            # Each chunk waits on a generate() running on the inference executor;
+            # the waiting happens on the streams executor so it cannot crowd that out
+            async for chunk in executors.streams.iterate(chunks):
+                parts.append(chunk)
+                yield sse_event("token", {"text": chunk})
+        except Exception as e:
+            print(f"Streaming error for {req.buddy_id}: {e}")
+            record_error("chat_stream")
+            yield sse_event("error", {"detail": "BuddyEngine reply failed."})
+            return
+        finally:
+            release_slot()
+
+        reply = "".join(parts).strip() or "Hmm... I didn't understand that. Can you rephrase?"
+        await executors.db.run(persist_turn, user_id, req.buddy_id, req.message, reply, mood)
+        yield sse_event("done", {
+            "buddy_id": req.buddy_id,
+            "username": req.username,
+            "mood": mood,
+            "reply": reply,
+        })
+
+    body = events()
+    weakref.finalize(body, release_slot)
+    return StreamingResponse(
+        body,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+BATCH_CHAT_MAX_ITEMS = int(os.environ.get("BUDDY_BATCH_CHAT_MAX_ITEMS", "1000"))
+
+def resolve_batch(items, valid, mood_ids):
+    """
+    Set-based upserts for a batch: returns ({username: user_id},
+    {buddy_id: stored mood}) with the stored moods of `mood_ids`.
+    """
+    with stage("upsert"), db.transaction() as conn:
+        user_ids = ensure_users_bulk(conn, {items[i].username for i in valid})
+        ensure_buddies_bulk(conn, {items[i].buddy_id: items[i].personality for i in valid})
+        stored_moods = load_moods_bulk(conn, mood_ids) if mood_ids else {}
+    # Committed now, so safe to cache
+    identities.remember_users(user_ids)
+    identities.remember_buddies({items[i].buddy_id for i in valid})
+    return user_ids, stored_moods
+
+def prepare_batch(engines: dict, refresh: dict, stored_moods: dict, recalls):
+    """
+    refresh_engine for every engine of the batch (`refresh` maps buddy_id
+    to the personality to apply, None for fresh engines), then recall
+    memories for each (user_id, message) in `recalls`.
+    """
+    errors = {}
+    for buddy_id, personality in refresh.items():
+        try:
+            refresh_engine(buddy_id, engines[buddy_id], personality, stored_moods.get(buddy_id))
+        except Exception as e:
+            errors[buddy_id] = f"BuddyEngine init failed: {e}"
+    return errors, [recall_memories(user_id, message) for user_id, message in recalls]
+
+@app.post("/chat/batch")
+async def chat_batch(req: BatchChatRequest):
+    """
+    Process many chat messages at once.
+    Users and buddies are resolved with set-based upserts, moods are
+    classified in bulk, replies are generated through batched model calls
+    (or the Responder), and all turns are persisted in one transaction.
+    Returns one result per item, in order; failed items carry an `error`.
+    """
+    items = req.items
+    if len(items) > BATCH_CHAT_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_CHAT_MAX_ITEMS} items per batch.")
+
+    results = [None] * len(items)
+    valid = []
+    for i, item in enumerate(items):
+        if not item.username or not item.buddy_id or not item.message.strip():
+            results[i] = {"index": i, "error": "username, buddy_id and message are required."}
+        else:
+            valid.append(i)
+
+    # One engine per distinct buddy: cached ones are refreshed, missing
+    # ones are built concurrently on the engine executor and start from
+    # the stored mood. Each is leased until the replies are generated.
+    engines, refresh, missing = {}, {}, {}
+    try:
+        for i in valid:
+            item = items[i]
+            if item.buddy_id in engines or item.buddy_id in missing:
+                continue
+            engine = buddies.lease(item.buddy_id)
+            if engine is None:
+                missing[item.buddy_id] = item.personality
+            else:
+                engines[item.buddy_id] = engine
+                refresh[item.buddy_id] = item.personality
+
+        try:
+            user_ids, stored_moods = await executors.db.run(
+                resolve_batch, items, valid, set(engines) | set(missing) if STATELESS else set(missing))
+        except Exception as e:
+            print(f"DB error in chat_batch: {e}")
+            record_error("chat_batch")
+            raise HTTPException(status_code=500, detail="Failed to create or fetch users and buddies.")
+
+        built = await asyncio.gather(
+            *(executors.engines.run(BuddyEngine, buddy_id, personality) for buddy_id, personality in missing.items()),
+            return_exceptions=True,
+        )
+        errors = {}
+        for buddy_id, engine in zip(missing, built):
+            if isinstance(engine, Exception):
+                record_error("engine_init")
+                errors[buddy_id] = f"BuddyEngine init failed: {engine}"
+                continue
+            engines[buddy_id] = engine.retain()
+            replace_engine(buddy_id, engine)
+            refresh[buddy_id] = None
+
+        candidates = [i for i in valid if items[i].buddy_id not in errors]
+        refresh_errors, recalled = await executors.db.run(
+            prepare_batch, engines, refresh, stored_moods,
+            [(user_ids[items[i].username], items[i].message) for i in candidates],
+        )
+        errors.update(refresh_errors)
+        requests, owners = [], []
+        for i, memories in zip(candidates, recalled):
+            item = items[i]
+            if item.buddy_id not in errors:
+                requests.append((engines[item.buddy_id], item.message, memories))
+                owners.append((i, user_ids[item.username]))
+        for i in valid:
+            if items[i].buddy_id in errors:
+                results[i] = {"index": i, "error": errors[items[i].buddy_id]}
+
+        # One LLM slot for the whole batch; the batcher spreads it over batched calls
+        deadline = Deadline.from_budget()
+        uses_llm = any(engine.llm_available() for engine, _, _ in requests)
+        async with llm_slot("batch", "__batch__", uses_llm, deadline) as allow_llm:
+            replies = await executors.inference.run(get_replies_batch, requests, deadline, allow_llm)
+    finally:
+        for engine in engines.values():
+            engine.release()
+
+    turns, moods, memories = [], {}, []
+    for (i, user_id), (mood, reply) in zip(owners, replies):
+        item = items[i]
+        reply = reply or "Hmm... I didn't understand that. Can you rephrase?"
+        mood = mood or "neutral"
+        turns.append((user_id, item.buddy_id, item.message, reply, mood))
+        moods[item.buddy_id] = mood
+        if is_memorable(item.message):
+            memories.append((user_id, item.message))
+        results[i] = {
+            "index": i,
+            "buddy_id": item.buddy_id,
+            "username": item.username,
+            "mood": mood,
+            "reply": reply,
+        }
+
+    try:
+        with stage("persist"):
+            await executors.db.run(save_conversations_bulk, turns, moods, memories)
+    except Exception as e:
+        print(f"DB error in chat_batch: {e}")
+        record_error("chat_batch")
+        for i, _ in owners:
+            results[i] = {"index": i, "error": "Failed to save conversation."}
+
+    return {"results": results}
@@ -0,0 +1,307 @@
+# ===================================================================
+# Build-A-Buddy Metrics
+# Minimal in-process counters, gauges and histograms rendered in the
+# Prometheus text format, plus stage timers for the request pipeline.
+#
+#   with stage("llm"):
+#       ...
+#
+# records the block's duration in the buddy_stage_seconds histogram and,
+# when called inside a request, in that request's timing breakdown
+# (returned as a Server-Timing header when enabled). Observing is a
+# bisect and two additions under a lock, cheap enough to leave on.
+# ===================================================================
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+TIMING_HEADER = os.environ.get("BUDDY_TIMING_HEADER", "0") == "1"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, amount: float = 1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """A gauge read from a callback at scrape time (or set explicitly)."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn=None):
+        super().__init__(name, help)
+        self.fn = fn
+        self._value = 0
+
+    def set(self, value: float):
+        self._value = value
+
+    def render(self) -> list:
+        try:
+            value = self.fn() if self.fn else self._value
+        except Exception as e:
+            print(f"Gauge {self.name} callback failed:", e)
+            return []
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class Info(_Metric):
+    """Constant-1 gauge whose labels carry configuration, read at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn):
+        super().__init__(name, help)
+        self.fn = fn
+
+    def render(self) -> list:
+        try:
+            labels = self.fn()
+        except Exception as e:
+            print(f"Info {self.name} callback failed:", e)
+            return []
+        return [f"{self.name}{_format_labels(list(labels), list(labels.values()))} 1"]
+
+
+class CallbackCounter(Gauge):
+    """A monotonic total owned elsewhere (e.g. pool.retries), read at scrape time."""
+
+    kind = "counter"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}   # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        lines = []
+        inf = 'le="+Inf"'
+        for labels, series in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                le = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, inf)} {series[-1]}")
+            base = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{base} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{base} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labelnames=()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, fn=None) -> Gauge:
+        gauge = self.register(Gauge(name, help, fn))
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def counter_fn(self, name: str, help: str, fn) -> CallbackCounter:
+        counter = self.register(CallbackCounter(name, help, fn))
+        counter.fn = fn
+        return counter
+
+    def info(self, name: str, help: str, fn) -> Info:
+        return self.register(Info(name, help, fn))
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "buddy_request_seconds", "HTTP request latency by route and status class.", ("route", "status"))
+STAGE_SECONDS = REGISTRY.histogram(
+    "buddy_stage_seconds", "Time spent in each chat pipeline stage.", ("stage",))
+REPLIES = REGISTRY.counter(
+    "buddy_replies_total", "Replies by source (llm or fallback Responder).", ("source",))
+TOKENS = REGISTRY.counter(
+    "buddy_llm_tokens_total", "Tokens generated by the LLM.")
+GENERATION_SECONDS = REGISTRY.counter(
+    "buddy_llm_generation_seconds_total", "Wall time spent in model.generate.")
+TOKENS_PER_SECOND = REGISTRY.histogram(
+    "buddy_llm_tokens_per_second", "Per-call generation throughput.", buckets=RATE_BUCKETS)
+CONTEXT_TOKENS = REGISTRY.counter(
+    "buddy_context_tokens_total", "Prompt tokens by origin (tokenized now or cached from earlier turns).",
+    ("source",))
+DEADLINES = REGISTRY.counter(
+    "buddy_deadline_total", "Generations skipped (budget unreachable) or truncated by the reply deadline.",
+    ("outcome",))
+ERRORS = REGISTRY.counter(
+    "buddy_errors_total", "Errors caught and logged, by location.", ("where",))
+
+
+# ---------------------------
+# Stage timing
+# ---------------------------
+_timings = ContextVar("buddy_request_timings", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, name)
+        timings = _timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def fallback_ratio() -> float:
+    llm, fallback = REPLIES.value("llm"), REPLIES.value("fallback")
+    return fallback / (llm + fallback) if llm + fallback else 0.0
+
+
+REGISTRY.gauge("buddy_llm_fallback_ratio", "Share of replies served by the Responder fallback.", fallback_ratio)
+
+
+def record_error(where: str):
+    ERRORS.inc(1, where)
+
+
+def record_generation(tokens: int, seconds: float):
+    TOKENS.inc(tokens)
+    GENERATION_SECONDS.inc(seconds)
+    if seconds > 0 and tokens > 0:
+        TOKENS_PER_SECOND.observe(tokens / seconds)
+
+
+def server_timing(timings: dict, total: float) -> str:
+    parts = [f"{name};dur={elapsed * 1000:.2f}" for name, elapsed in timings.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+class TimingMiddleware:
+    """
+    Pure ASGI middleware (no per-request task or body buffering): times
+    every HTTP request into buddy_request_seconds and, with
+    BUDDY_TIMING_HEADER=1, adds a Server-Timing header with the stages
+    recorded so far when the response starts.
+    """
+
+    def __init__(self, app, timing_header: bool = TIMING_HEADER):
+        self.app = app
+        self.timing_header = timing_header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = {}
+        token = _timings.set(timings)
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if self.timing_header:
+                    header = server_timing(timings, time.perf_counter() - start)
+                    message = dict(message)
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", header.encode("latin-1"))
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _timings.reset(token)
+            route = scope.get("route")
+            # Unmatched paths share one label to keep cardinality bounded
+            path = getattr(route, "path", None) or "unmatched"
+            REQUEST_SECONDS.observe(time.perf_counter() - start, path, f"{status[0] // 100}xx")
@@ -0,0 +1,230 @@
+# ===================================================================
+# Build-A-Buddy Admission Control
+# Bounds how many requests may use the LLM at once. Requests beyond the
+# limit wait in per-user FIFO queues that are served round-robin, so one
+# chatty user cannot starve everyone else. Per-user token buckets cap
+# request rates. A request that cannot get a slot (queue full, rate
+# limited, or waited too long) is shed, and the route decides whether a
+# shed request gets a Responder reply or a 429.
+# ===================================================================
+
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from metrics import REGISTRY
+
+MAX_CONCURRENT = int(os.environ.get("BUDDY_LLM_MAX_CONCURRENT", "16"))
+MAX_QUEUE = int(os.environ.get("BUDDY_LLM_MAX_QUEUE", "64"))
+MAX_QUEUE_PER_USER = int(os.environ.get("BUDDY_LLM_MAX_QUEUE_PER_USER", "8"))
+QUEUE_TIMEOUT_MS = float(os.environ.get("BUDDY_LLM_QUEUE_TIMEOUT_MS", "2000"))
+RATE_PER_USER = float(os.environ.get("BUDDY_RATE_PER_USER", "0"))     # requests/s, 0 = unlimited
+RATE_BURST = float(os.environ.get("BUDDY_RATE_BURST", "10"))
+MAX_TRACKED_USERS = 100000
+
+ADMITTED = "admitted"
+QUEUE_FULL = "queue_full"
+RATE_LIMITED = "rate_limited"
+TIMED_OUT = "timed_out"
+
+ADMISSIONS = REGISTRY.counter(
+    "buddy_admission_total", "LLM admission decisions by outcome.", ("outcome",))
+WAIT_SECONDS = REGISTRY.histogram(
+    "buddy_admission_wait_seconds", "Time spent queued for an LLM slot (admitted requests).")
+
+
+class TokenBuckets:
+    """One token bucket per key, refilled lazily on access; least recently used keys are dropped."""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = MAX_TRACKED_USERS):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()   # key -> [tokens, last refill]
+        self._lock = threading.Lock()
+
+    def take(self, key: str, cost: float = 1.0) -> bool:
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] < cost:
+                return False
+            bucket[0] -= cost
+            return True
+
+
+class _Waiter:
+    """A queued request: woken via a threading.Event, or an asyncio future when `loop` is given."""
+    __slots__ = ("event", "future", "loop", "granted")
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+        self.granted = False
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class Ticket:
+    """Outcome of an admission attempt; `admitted` says whether the LLM may be used."""
+
+    __slots__ = ("outcome", "waited")
+
+    def __init__(self, outcome: str, waited: float = 0.0):
+        self.outcome = outcome
+        self.waited = waited
+
+    @property
+    def admitted(self) -> bool:
+        return self.outcome == ADMITTED
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT, max_queue: int = MAX_QUEUE,
+                 max_queue_per_user: int = MAX_QUEUE_PER_USER, queue_timeout_ms: float = QUEUE_TIMEOUT_MS,
+                 rate_per_user: float = RATE_PER_USER, rate_burst: float = RATE_BURST):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.queue_timeout = queue_timeout_ms / 1000.0
+        self.buckets = TokenBuckets(rate_per_user, rate_burst)
+        self.active = 0
+        self.queued = 0
+        self._queues = OrderedDict()    # user -> deque of _Waiter, in round-robin order
+        self._lock = threading.Lock()
+
+    # ---------------------------
+    # Acquire / release
+    # ---------------------------
+    def try_acquire(self, user: str, timeout: float = None) -> Ticket:
+        """
+        Wait for an LLM slot. Returns a Ticket; if it is admitted, the
+        caller must call release() when its generation is finished.
+        """
+        ticket, waiter, start = self._enter(user)
+        if ticket is not None:
+            return ticket
+        waiter.event.wait(self._wait_time(timeout))
+        return self._settle(user, waiter, start)
+
+    async def try_acquire_async(self, user: str, timeout: float = None) -> Ticket:
+        """try_acquire for async handlers: queues without holding a thread."""
+        ticket, waiter, start = self._enter(user, asyncio.get_running_loop())
+        if ticket is not None:
+            return ticket
+        try:
+            await asyncio.wait({waiter.future}, timeout=self._wait_time(timeout))
+        except asyncio.CancelledError:
+            # Client gone: leave the queue, or pass on a slot granted meanwhile
+            if self._settle(user, waiter, start).admitted:
+                self.release()
+            raise
+        return self._settle(user, waiter, start)
+
+    def _wait_time(self, timeout: float = None) -> float:
+        return max(0.0, self.queue_timeout if timeout is None else min(timeout, self.queue_timeout))
+
+    def _enter(self, user: str, loop=None):
+        """Admit right away, shed, or queue: returns (Ticket or None, waiter, start time)."""
+        if not self.buckets.take(user):
+            ADMISSIONS.inc(1, RATE_LIMITED)
+            return Ticket(RATE_LIMITED), None, None
+
+        start = time.monotonic()
+        with self._lock:
+            if self.active < self.max_concurrent and not self.queued:
+                self.active += 1
+                ADMISSIONS.inc(1, ADMITTED)
+                WAIT_SECONDS.observe(0.0)
+                return Ticket(ADMITTED), None, start
+            queue = self._queues.get(user)
+            if self.queued >= self.max_queue or (queue and len(queue) >= self.max_queue_per_user):
+                ADMISSIONS.inc(1, QUEUE_FULL)
+                return Ticket(QUEUE_FULL), None, start
+            waiter = _Waiter(loop)
+            if queue is None:
+                queue = self._queues[user] = deque()
+            queue.append(waiter)
+            self.queued += 1
+        return None, waiter, start
+
+    def _settle(self, user: str, waiter: _Waiter, start: float) -> Ticket:
+        """Outcome of a queued request once it was woken or gave up waiting."""
+        with self._lock:
+            if not waiter.granted:
+                # Gave up; leave the queue (the slot was never handed to us)
+                queue = self._queues.get(user)
+                if queue is not None and waiter in queue:
+                    queue.remove(waiter)
+                    self.queued -= 1
+                    if not queue:
+                        del self._queues[user]
+                ADMISSIONS.inc(1, TIMED_OUT)
+                return Ticket(TIMED_OUT, time.monotonic() - start)
+        waited = time.monotonic() - start
+        ADMISSIONS.inc(1, ADMITTED)
+        WAIT_SECONDS.observe(waited)
+        return Ticket(ADMITTED, waited)
+
+    def release(self):
+        """Free a slot, handing it straight to the next user in round-robin order."""
+        with self._lock:
+            if self._queues:
+                user, queue = self._queues.popitem(last=False)
+                waiter = queue.popleft()
+                self.queued -= 1
+                if queue:
+                    self._queues[user] = queue   # back of the rotation
+                waiter.granted = True            # slot passes over; active is unchanged
+                waiter.wake()
+            else:
+                self.active = max(0, self.active - 1)
+
+    @contextmanager
+    def admit(self, user: str, timeout: float = None):
+        """Context manager form: yields the Ticket and releases an admitted slot on exit."""
+        ticket = self.try_acquire(user, timeout)
+        try:
+            yield ticket
+        finally:
+            if ticket.admitted:
+                self.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "active": self.active,
+                "queued": self.queued,
+                "queued_users": len(self._queues),
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+            }
+
+
+# Shared process-wide instance
+admission = AdmissionController()
+REGISTRY.gauge("buddy_admission_active", "Requests currently holding an LLM slot.", lambda: admission.active)
+REGISTRY.gauge("buddy_admission_queue_depth", "Requests waiting for an LLM slot.", lambda: admission.queued)
@@ -0,0 +1,186 @@
+# ===================================================================
+# Build-A-Buddy Inference Batcher
+# Collects prompts from concurrent chats for a short window and runs
+# them through one batched model.generate call, then routes each
+# decoded reply back to the caller that submitted it.
+# ===================================================================
+
+import math
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+from .model_registry import registry
+from .deadline import DeadlineExceeded, decode_rate, stopping_criteria
+from metrics import record_error, record_generation
+
+MAX_BATCH_SIZE = int(os.environ.get("BUDDY_BATCH_MAX_SIZE", "8"))
+MAX_WAIT_MS = float(os.environ.get("BUDDY_BATCH_MAX_WAIT_MS", "10"))
+
+
+class _Request:
+    __slots__ = ("prompt", "kwargs", "future", "submitted", "deadline")
+
+    def __init__(self, prompt, kwargs, deadline=None):
+        self.prompt = prompt
+        self.kwargs = kwargs
+        self.future = Future()
+        self.submitted = time.monotonic()
+        self.deadline = deadline
+
+
+class InferenceBatcher:
+    """
+    Dynamic batcher for a single tokenizer/model pair.
+
+    The first waiting prompt opens a batch; the batch closes when it
+    holds max_batch_size prompts or max_wait_ms has passed, whichever
+    comes first, so a lone request waits at most max_wait_ms extra.
+    Prompts are grouped by their generation kwargs (and by whether they
+    are text or token ids) before batching.
+    A prompt whose deadline (ml/deadline.py) passed while it was queued
+    fails with DeadlineExceeded without being generated, and a batch
+    stops decoding when its earliest deadline nears.
+    """
+
+    def __init__(self, tokenizer, model, max_batch_size: int = MAX_BATCH_SIZE,
+                 max_wait_ms: float = MAX_WAIT_MS):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+        self.batches = 0
+        self.prompts = 0
+        self._running = 0
+
+        # Batched prompts are left-padded so every row ends at the same
+        # position and generation continues directly after the prompt.
+        self.tokenizer.padding_side = "left"
+        if getattr(self.tokenizer, "pad_token", None) is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self._thread.start()
+
+    def submit(self, prompt, deadline=None, **gen_kwargs) -> Future:
+        """
+        Queue a prompt, either text or a list of token ids (see
+        ml/context.py); the Future resolves to the decoded text generated
+        after it.
+        """
+        request = _Request(prompt, gen_kwargs, deadline)
+        self._queue.put(request)
+        return request.future
+
+    def generate(self, prompt, timeout: float = None, deadline=None, **gen_kwargs) -> str:
+        return self.submit(prompt, deadline, **gen_kwargs).result(timeout)
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def batches_ahead(self) -> int:
+        """Batches that would run before a prompt submitted now starts."""
+        return math.ceil(self._queue.qsize() / self.max_batch_size) + (1 if self._running else 0)
+
+    def is_busy(self) -> bool:
+        """True while prompts are waiting or a batch is being generated."""
+        return self._running > 0 or not self._queue.empty()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _stopping_criteria(self, requests) -> dict:
+        deadlines = [r.deadline for r in requests if r.deadline is not None and r.deadline.at is not None]
+        if not deadlines:
+            return {}
+        earliest = min(deadlines, key=lambda d: d.at)
+        return {"stopping_criteria": stopping_criteria(earliest.stopping_criterion())}
+
+    def _run_group(self, requests):
+        # Earlier groups of the same batch may have used up a deadline
+        live = []
+        for request in requests:
+            if request.deadline is not None and request.deadline.expired():
+                request.future.set_exception(DeadlineExceeded("deadline passed while queued"))
+            else:
+                live.append(request)
+        if not live:
+            return
+        requests = live
+        try:
+            prompts = [r.prompt for r in requests]
+            if isinstance(prompts[0], str):
+                inputs = self.tokenizer(prompts, return_tensors="pt", padding=True)
+            else:
+                inputs = self.tokenizer.pad({"input_ids": prompts}, return_tensors="pt")
+            started = time.perf_counter()
+            outputs = self.model.generate(
+                **inputs,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **self._stopping_criteria(requests),
+                **requests[0].kwargs,
+            )
+            # Rows that finished early are padded out; only count real tokens
+            generated = outputs[:, inputs["input_ids"].shape[-1]:]
+            elapsed = time.perf_counter() - started
+            record_generation(int((generated != self.tokenizer.pad_token_id).sum()), elapsed)
+            decode_rate.observe(generated.shape[-1], elapsed)
+            texts = self.tokenizer.batch_decode(generated, skip_special_tokens=True)
+            for request, text in zip(requests, texts):
+                request.future.set_result(text)
+            self.batches += 1
+            self.prompts += len(requests)
+        except Exception as e:
+            print("InferenceBatcher: batched generation failed:", e)
+            traceback.print_exc()
+            record_error("batcher")
+            for request in requests:
+                if not request.future.done():
+                    request.future.set_exception(e)
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            groups = {}
+            for request in batch:
+                if not request.future.set_running_or_notify_cancel():
+                    continue   # caller gave up while it was queued
+                key = (isinstance(request.prompt, str), tuple(sorted(request.kwargs.items())))
+                groups.setdefault(key, []).append(request)
+            self._running = len(batch)
+            try:
+                for requests in groups.values():
+                    self._run_group(requests)
+            finally:
+                self._running = 0
+
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def get_batcher(model_name: str) -> InferenceBatcher:
+    """Return the process-wide batcher for a registered model, creating it once."""
+    with _batchers_lock:
+        batcher = _batchers.get(model_name)
+        if batcher is None:
+            tokenizer, model = registry.load(model_name)
+            batcher = _batchers[model_name] = InferenceBatcher(tokenizer, model)
+        return batcher
+
+
+def batching_enabled() -> bool:
+    return MAX_BATCH_SIZE > 1
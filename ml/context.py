@@ -0,0 +1,151 @@
+# ===================================================================
+# Build-A-Buddy Conversation Context
+# Assembles the token ids of an LLM prompt: the stable prefix, as many
+# of the buddy's recent turns as fit the model's context window, and
+# the current message. Each turn is tokenized once and its ids kept in
+# memory, so a new message only costs tokenizing that message (and,
+# once replied to, the reply), however long the conversation is.
+# ===================================================================
+
+import os
+import threading
+from array import array
+from collections import deque
+
+from metrics import CONTEXT_TOKENS
+
+# phi-3-mini-4k's window; generate()'s max_new_tokens is reserved out of it
+CONTEXT_WINDOW = int(os.environ.get("BUDDY_CONTEXT_WINDOW", "4096"))
+# Turns kept per buddy (0 = prompts carry only the current message)
+CONTEXT_TURNS = int(os.environ.get("BUDDY_CONTEXT_TURNS", "20"))
+
+
+def turn_head(user_message: str) -> str:
+    return f"User: {user_message}\nBuddy:"
+
+
+def turn_tail(reply: str) -> str:
+    return f" {reply}\n"
+
+
+def encode(tokenizer, text: str) -> array:
+    return array("i", tokenizer.encode(text, add_special_tokens=False))
+
+
+class _Turn:
+    __slots__ = ("user_message", "reply", "head", "ids")
+
+    def __init__(self, user_message: str, reply: str, head: array = None):
+        self.user_message = user_message
+        self.reply = reply
+        self.head = head      # ids of turn_head(user_message), if already known
+        self.ids = None       # ids of the whole turn, filled on first use
+
+
+class Prompt:
+    """Token ids for one generate() call."""
+    __slots__ = ("prefix", "prefix_len", "input_ids", "head", "history_turns")
+
+    def __init__(self, prefix: str, prefix_len: int, input_ids: list, head: array, history_turns: int):
+        self.prefix = prefix
+        self.prefix_len = prefix_len    # input_ids[:prefix_len] is the tokenized prefix
+        self.input_ids = input_ids
+        self.head = head                # ids of the current message's turn_head
+        self.history_turns = history_turns
+
+
+class ConversationContext:
+    """
+    One buddy's recent turns with their cached token ids, oldest first.
+
+    Turns are added as plain text (append/sync) and tokenized lazily the
+    first time a prompt is built, so turns answered by the Responder
+    while the model is still loading are part of the context too.
+    Building a prompt forgets turns that would not fit the window even
+    beside an empty message; newer turns only push them further out.
+    """
+
+    def __init__(self, max_turns: int = CONTEXT_TURNS, window: int = CONTEXT_WINDOW):
+        self.window = window
+        self._turns = deque(maxlen=max(0, max_turns))
+        self._prefix = (None, None)     # (prefix text, its ids)
+        self._lock = threading.Lock()
+        self.synced = False
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+    def sync(self, turns):
+        """
+        Replace the remembered turns with `turns` ((user_message, reply)
+        pairs, oldest first), e.g. history loaded from the database.
+        Token ids of turns already held are reused.
+        """
+        with self._lock:
+            known = {(t.user_message, t.reply): t for t in self._turns}
+            keep = list(turns)[-self._turns.maxlen:] if self._turns.maxlen else []
+            self._turns = deque(
+                (known.get((message, reply)) or _Turn(message, reply) for message, reply in keep),
+                maxlen=self._turns.maxlen,
+            )
+            self.synced = True
+
+    def append(self, user_message: str, reply: str, prompt: Prompt = None):
+        """Record a finished turn; `prompt` lends the already tokenized message."""
+        with self._lock:
+            self._turns.append(_Turn(user_message, reply, prompt.head if prompt else None))
+
+    def clear(self):
+        with self._lock:
+            self._turns.clear()
+            self._prefix = (None, None)
+            self.synced = False
+
+    def _prefix_ids(self, tokenizer, prefix: str):
+        # With special tokens (BOS), exactly as the prefix KV cache tokenizes it
+        if self._prefix[0] != prefix:
+            self._prefix = (prefix, array("i", tokenizer.encode(prefix)))
+        return self._prefix[1]
+
+    def _turn_ids(self, tokenizer, turn: _Turn) -> array:
+        if turn.ids is None:
+            head = turn.head if turn.head is not None else encode(tokenizer, turn_head(turn.user_message))
+            turn.ids = head + encode(tokenizer, turn_tail(turn.reply))
+            turn.head = None
+            CONTEXT_TOKENS.inc(len(turn.ids), "tokenized")
+        return turn.ids
+
+    def build(self, tokenizer, prefix: str, preamble: str, user_message: str,
+              max_new_tokens: int) -> Prompt:
+        """
+        Prompt ids for prefix + recent turns + preamble + the current
+        message, keeping the newest turns that fit in the context window
+        after reserving max_new_tokens for the reply.
+        """
+        head = encode(tokenizer, turn_head(user_message))
+        suffix = encode(tokenizer, preamble) + head if preamble else head
+        with self._lock:
+            prefix_ids = self._prefix_ids(tokenizer, prefix)
+            room = self.window - max_new_tokens - len(prefix_ids)
+            budget = room - len(suffix)
+            history, used, keep, reused = [], 0, 0, 0
+            for turn in reversed(self._turns):
+                fresh = turn.ids is None
+                ids = self._turn_ids(tokenizer, turn)
+                used += len(ids)
+                if used > room:
+                    break       # too old to fit even beside an empty message
+                keep += 1
+                if used <= budget and len(history) == keep - 1:
+                    history.append(ids)
+                    reused += 0 if fresh else len(ids)
+            while len(self._turns) > keep:
+                self._turns.popleft()
+
+        CONTEXT_TOKENS.inc(len(suffix), "tokenized")
+        CONTEXT_TOKENS.inc(len(prefix_ids) + reused, "cached")
+        input_ids = prefix_ids.tolist()
+        for ids in reversed(history):
+            input_ids.extend(ids)
+        input_ids.extend(suffix)
+        return Prompt(prefix, len(prefix_ids), input_ids, head, len(history))
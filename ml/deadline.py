@@ -0,0 +1,111 @@
+# ===================================================================
+# Build-A-Buddy Generation Deadlines
+# Every reply gets a latency budget (BUDDY_REPLY_BUDGET_MS). Before
+# generating, the budget is turned into a max_new_tokens using the
+# measured decode rate (and any expected queueing); if not even a short
+# reply fits, the caller goes straight to the Responder. During
+# generation a stopping criterion ends decoding once the deadline nears,
+# so a slow model cannot hold a request past its budget.
+# ===================================================================
+
+import math
+import os
+import threading
+import time
+
+REPLY_BUDGET_MS = float(os.environ.get("BUDDY_REPLY_BUDGET_MS", "8000"))   # 0 = no budget
+MIN_NEW_TOKENS = int(os.environ.get("BUDDY_MIN_NEW_TOKENS", "8"))
+SAFETY_FACTOR = 0.8      # plan for 80% of the measured rate
+STOP_MARGIN_S = 0.05     # stop decoding this long before the deadline
+TOKEN_BUCKET = 16        # round token budgets so batched requests share kwargs
+
+
+class DeadlineExceeded(TimeoutError):
+    """The reply budget cannot be (or was not) met by the LLM."""
+
+
+class Deadline:
+    def __init__(self, at: float = None):
+        self.at = at            # time.monotonic() value, or None for no deadline
+        self.hit = False        # set once the stopping criterion has fired
+
+    @classmethod
+    def from_budget(cls, budget_ms: float = REPLY_BUDGET_MS) -> "Deadline":
+        return cls(time.monotonic() + budget_ms / 1000.0 if budget_ms > 0 else None)
+
+    def remaining(self) -> float:
+        return math.inf if self.at is None else self.at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def stopping_criterion(self):
+        """A generate() stopping criterion that fires STOP_MARGIN_S before the deadline."""
+        def criterion(*args, **kwargs) -> bool:
+            if self.remaining() <= STOP_MARGIN_S:
+                self.hit = True
+                return True
+            return False
+        return criterion
+
+
+def stopping_criteria(*criteria):
+    """Wrap plain callables for generate(); a plain list for non-transformers backends."""
+    try:
+        from transformers import StoppingCriteriaList
+    except ImportError:
+        return list(criteria)
+    return StoppingCriteriaList(list(criteria))
+
+
+class DecodeRate:
+    """Exponentially weighted decode speed, in generation steps per second."""
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self._rate = None
+        self._lock = threading.Lock()
+
+    def observe(self, steps: int, seconds: float):
+        if steps <= 0 or seconds <= 0:
+            return
+        rate = steps / seconds
+        with self._lock:
+            self._rate = rate if self._rate is None else self._rate + self.alpha * (rate - self._rate)
+
+    def steps_per_second(self):
+        return self._rate
+
+
+# Shared process-wide instance (one model per worker)
+decode_rate = DecodeRate()
+
+
+def plan_tokens(deadline: Deadline, max_new_tokens: int, wait_s: float = 0.0) -> int:
+    """
+    max_new_tokens that fit in the time left after an expected wait of
+    wait_s. Returns 0 when not even MIN_NEW_TOKENS fit. Until a decode
+    rate has been measured, only the stopping criterion bounds the call.
+    """
+    if deadline is None or deadline.at is None:
+        return max_new_tokens
+    remaining = deadline.remaining() - wait_s
+    if remaining <= STOP_MARGIN_S:
+        return 0
+    rate = decode_rate.steps_per_second()
+    if rate is None:
+        return max_new_tokens
+    tokens = min(max_new_tokens, int(remaining * rate * SAFETY_FACTOR))
+    if tokens < MIN_NEW_TOKENS:
+        return 0
+    if tokens >= TOKEN_BUCKET:
+        tokens -= tokens % TOKEN_BUCKET
+    return tokens
+
+
+def estimated_wait(batches_ahead: int, max_new_tokens: int) -> float:
+    """Seconds until a queued prompt starts generating, if each batch runs to max_new_tokens."""
+    rate = decode_rate.steps_per_second()
+    if not rate or batches_ahead <= 0:
+        return 0.0
+    return batches_ahead * max_new_tokens / rate
@@ -0,0 +1,187 @@
+# ===================================================================
+# Build-A-Buddy Engine Cache
+# Bounded LRU + idle-TTL cache of BuddyEngine instances.
+# Evicted engines are handed to a callback (to checkpoint their state)
+# and then closed so they release their share of the model. Requests
+# take a lease (lease() / engine.release()), so an engine evicted while
+# it is still generating is only closed once the last lease is released.
+# ===================================================================
+
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+
+class EngineCache:
+    """
+    Dict-like cache keyed by buddy_id.
+
+    max_size: maximum number of live engines (0 or less = unbounded)
+    ttl: seconds an engine may sit idle before it is evicted (None = never)
+    on_evict: callable(buddy_id, engine) run for every evicted engine
+    """
+
+    def __init__(self, max_size: int = 256, ttl: float = None, on_evict=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._engines = OrderedDict()   # buddy_id -> engine, oldest first
+        self._last_used = {}            # buddy_id -> monotonic timestamp
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    # ---------------------------
+    # Dict-style access
+    # ---------------------------
+    def __contains__(self, buddy_id) -> bool:
+        with self._lock:
+            expired = self._expire()
+            present = buddy_id in self._engines
+        self._evict_all(expired)
+        return present
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._engines)
+
+    def __getitem__(self, buddy_id):
+        engine = self.get(buddy_id)
+        if engine is None:
+            raise KeyError(buddy_id)
+        return engine
+
+    def __setitem__(self, buddy_id, engine):
+        self.put(buddy_id, engine)
+
+    def get(self, buddy_id, default=None):
+        """Return the cached engine (marking it recently used) or default."""
+        with self._lock:
+            expired = self._expire()
+            engine = self._engines.get(buddy_id)
+            if engine is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._touch(buddy_id)
+        self._evict_all(expired)
+        return default if engine is None else engine
+
+    def lease(self, buddy_id):
+        """
+        get() that also leases the engine (engine.retain()) while the
+        cache still holds it; the caller must call engine.release().
+        """
+        with self._lock:
+            expired = self._expire()
+            engine = self._engines.get(buddy_id)
+            if engine is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._touch(buddy_id)
+                engine.retain()
+        self._evict_all(expired)
+        return engine
+
+    def put(self, buddy_id, engine):
+        """
+        Insert or replace an engine, evicting the LRU ones if over size.
+        Returns the engine it replaced (not closed: that is up to the caller).
+        """
+        evicted = []
+        with self._lock:
+            replaced = self._engines.get(buddy_id)
+            self._engines[buddy_id] = engine
+            self._touch(buddy_id)
+            evicted.extend(self._expire())
+            while self.max_size > 0 and len(self._engines) > self.max_size:
+                old_id, old_engine = self._engines.popitem(last=False)
+                self._last_used.pop(old_id, None)
+                self.evictions += 1
+                evicted.append((old_id, old_engine))
+        self._evict_all(evicted)
+        return replaced
+
+    def pop(self, buddy_id, default=None):
+        """Remove an engine without running the eviction callback."""
+        with self._lock:
+            self._last_used.pop(buddy_id, None)
+            return self._engines.pop(buddy_id, default)
+
+    def items(self):
+        with self._lock:
+            return list(self._engines.items())
+
+    # ---------------------------
+    # Eviction
+    # ---------------------------
+    def _touch(self, buddy_id):
+        self._engines.move_to_end(buddy_id)
+        self._last_used[buddy_id] = time.monotonic()
+
+    def _expire(self):
+        """
+        Unlink engines idle for longer than ttl (oldest are at the front).
+        Returns them so the caller can run callbacks after releasing the lock.
+        """
+        expired = []
+        if self.ttl is not None:
+            cutoff = time.monotonic() - self.ttl
+            while self._engines:
+                buddy_id = next(iter(self._engines))
+                if self._last_used.get(buddy_id, 0) > cutoff:
+                    break
+                expired.append((buddy_id, self._engines.pop(buddy_id)))
+                self._last_used.pop(buddy_id, None)
+                self.expirations += 1
+        return expired
+
+    def _evict_all(self, evicted):
+        # Callbacks run outside the lock: they may touch the database.
+        for buddy_id, engine in evicted:
+            self._evict(buddy_id, engine)
+
+    def _evict(self, buddy_id, engine):
+        try:
+            if self.on_evict:
+                self.on_evict(buddy_id, engine)
+        except Exception as e:
+            print(f"EngineCache: eviction callback failed for {buddy_id}:", e)
+            traceback.print_exc()
+        finally:
+            close = getattr(engine, "close", None)
+            if close:
+                close()
+
+    def sweep(self):
+        """Evict idle engines now (e.g. from a periodic task)."""
+        with self._lock:
+            expired = self._expire()
+        self._evict_all(expired)
+        return len(expired)
+
+    def clear(self):
+        """Evict everything, running the callback for each engine."""
+        with self._lock:
+            engines = list(self._engines.items())
+            self._engines.clear()
+            self._last_used.clear()
+        self._evict_all(engines)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._engines),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
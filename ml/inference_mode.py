@@ -0,0 +1,154 @@
+# ===================================================================
+# Build-A-Buddy Inference Mode
+# CPU execution settings applied when the model registry loads weights:
+#   BUDDY_INFERENCE_DTYPE        fp32 (default) | bf16 | int8 | auto
+#   BUDDY_TORCH_THREADS          intra-op threads (0 = torch default)
+#   BUDDY_TORCH_INTEROP_THREADS  inter-op threads (0 = torch default)
+#   BUDDY_TORCH_COMPILE          1 = torch.compile the forward pass
+#   BUDDY_INFERENCE_MODE         1 (default) = run generate() under
+#                                torch.inference_mode instead of no_grad
+# int8 is dynamic quantization of every nn.Linear (weights stored as
+# int8, activations quantized on the fly), which roughly quarters the
+# weight memory. bf16 halves it and is only used when the CPU has native
+# bf16 support; otherwise the model stays in fp32. auto keeps the
+# checkpoint's own dtype, so safetensors weights can stay memory-mapped
+# and be shared through the page cache by every worker (see serve.py).
+# ===================================================================
+
+import functools
+import os
+import threading
+
+DTYPES = ("fp32", "bf16", "int8", "auto")
+
+# None lets transformers fall back to .bin checkpoints when a model has no safetensors
+SAFETENSORS = {"1": True, "0": False}.get(os.environ.get("BUDDY_SAFETENSORS", ""), None)
+
+
+class InferenceConfig:
+    def __init__(self, dtype: str = "fp32", intra_op_threads: int = 0, inter_op_threads: int = 0,
+                 compile: bool = False, inference_mode: bool = True):
+        if dtype not in DTYPES:
+            print(f"Unknown inference dtype {dtype!r}; using fp32")
+            dtype = "fp32"
+        self.dtype = dtype
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.compile = compile
+        self.inference_mode = inference_mode
+
+    @classmethod
+    def from_env(cls) -> "InferenceConfig":
+        return cls(
+            dtype=os.environ.get("BUDDY_INFERENCE_DTYPE", "fp32").lower(),
+            intra_op_threads=int(os.environ.get("BUDDY_TORCH_THREADS", "0")),
+            inter_op_threads=int(os.environ.get("BUDDY_TORCH_INTEROP_THREADS", "0")),
+            compile=os.environ.get("BUDDY_TORCH_COMPILE", "0") == "1",
+            inference_mode=os.environ.get("BUDDY_INFERENCE_MODE", "1") == "1",
+        )
+
+    def describe(self) -> dict:
+        return {
+            "dtype": self.dtype,
+            "intra_op_threads": self.intra_op_threads,
+            "inter_op_threads": self.inter_op_threads,
+            "compile": self.compile,
+            "inference_mode": self.inference_mode,
+        }
+
+
+config = InferenceConfig.from_env()
+
+# What was actually applied (dtype can fall back, thread counts default)
+applied = {}
+_threads_lock = threading.Lock()
+_threads_configured = False
+
+
+def bf16_supported() -> bool:
+    import torch
+
+    for probe in ("_is_amx_tile_supported", "_is_avx512_bf16_supported"):
+        fn = getattr(torch.cpu, probe, None)
+        if fn is not None and fn():
+            return True
+    return False
+
+
+def configure_threads(cfg: InferenceConfig = config):
+    """Apply thread counts once per process, before the first forward pass."""
+    global _threads_configured
+    import torch
+
+    with _threads_lock:
+        if _threads_configured:
+            return
+        _threads_configured = True
+        if cfg.intra_op_threads > 0:
+            torch.set_num_threads(cfg.intra_op_threads)
+        if cfg.inter_op_threads > 0:
+            try:
+                torch.set_num_interop_threads(cfg.inter_op_threads)
+            except RuntimeError as e:
+                # Only allowed before any inter-op parallel work has started
+                print("Could not set inter-op threads:", e)
+        applied["intra_op_threads"] = torch.get_num_threads()
+        applied["inter_op_threads"] = torch.get_num_interop_threads()
+
+
+def load_kwargs(cfg: InferenceConfig = config) -> dict:
+    """
+    Extra from_pretrained() arguments for the configured dtype. Weights
+    are streamed from memory-mapped safetensors (low_cpu_mem_usage), so
+    a checkpoint loaded in its own dtype is not copied into private memory.
+    """
+    import torch
+
+    mmap = {"low_cpu_mem_usage": True, "use_safetensors": SAFETENSORS}
+    if cfg.dtype == "auto":
+        return dict(mmap, torch_dtype="auto")
+    if cfg.dtype == "bf16":
+        if bf16_supported():
+            return dict(mmap, torch_dtype=torch.bfloat16)
+        print("bf16 requested but this CPU has no native bf16 support; loading fp32")
+    return dict(mmap, torch_dtype=torch.float32)
+
+
+def optimize(model, cfg: InferenceConfig = config):
+    """Quantize / compile a loaded model according to the config; returns the model."""
+    import torch
+
+    if cfg.dtype == "int8":
+        try:
+            from torch.ao.quantization import quantize_dynamic
+        except ImportError:
+            from torch.quantization import quantize_dynamic
+        model = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    dtype = next(model.parameters()).dtype
+    names = {torch.bfloat16: "bf16", torch.float16: "fp16", torch.float32: "fp32"}
+    applied["dtype"] = "int8" if cfg.dtype == "int8" else names.get(dtype, str(dtype))
+
+    if cfg.compile:
+        try:
+            model.forward = torch.compile(model.forward, dynamic=True)
+        except Exception as e:
+            print("torch.compile unavailable; running eagerly:", e)
+            cfg.compile = False
+    applied["compile"] = cfg.compile
+
+    if cfg.inference_mode:
+        generate = model.generate
+
+        @functools.wraps(generate)
+        def generate_in_inference_mode(*args, **kwargs):
+            with torch.inference_mode():
+                return generate(*args, **kwargs)
+
+        model.generate = generate_in_inference_mode
+    applied["inference_mode"] = cfg.inference_mode
+    return model
+
+
+def describe() -> dict:
+    """Configured settings, overridden by what was actually applied at load."""
+    return dict(config.describe(), **applied)
@@ -0,0 +1,143 @@
+# ===================================================================
+# Build-A-Buddy Prefix KV Cache
+# Keeps the prefilled attention state (past_key_values) for stable
+# prompt prefixes, e.g. the system/personality preamble, so later turns
+# only prefill the new tokens. Entries are keyed by (model, prefix text),
+# which lets every buddy with the same personality share one entry, and
+# are evicted LRU-first once the total cache size exceeds a byte budget.
+# ===================================================================
+
+import copy
+import os
+import threading
+from collections import OrderedDict
+
+PREFIX_CACHE_MB = float(os.environ.get("BUDDY_PREFIX_CACHE_MB", "512"))
+
+
+def _nbytes(obj) -> int:
+    """Approximate memory held by a (possibly nested) past_key_values object."""
+    if hasattr(obj, "element_size") and hasattr(obj, "nelement"):
+        return obj.element_size() * obj.nelement()
+    if isinstance(obj, (list, tuple)):
+        return sum(_nbytes(o) for o in obj)
+    # transformers Cache objects: key_cache/value_cache lists (older
+    # releases) or a list of per-layer objects holding keys/values tensors
+    attrs = ("key_cache", "value_cache", "layers", "keys", "values")
+    return sum(_nbytes(getattr(obj, a)) for a in attrs
+               if hasattr(obj, a) and not callable(getattr(obj, a)))
+
+
+class PrefixEntry:
+    __slots__ = ("input_ids", "past_key_values", "nbytes")
+
+    def __init__(self, input_ids, past_key_values):
+        self.input_ids = input_ids
+        self.past_key_values = past_key_values
+        self.nbytes = _nbytes(past_key_values) + _nbytes(input_ids)
+
+    def fresh_past(self):
+        """generate() extends the cache in place, so every call needs a copy."""
+        return copy.deepcopy(self.past_key_values)
+
+
+class PrefixCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()    # (model_name, prefix) -> PrefixEntry
+        self._users = {}                 # key -> number of engines bound to it
+        self._building = {}              # key -> Lock held while prefilling
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _prefill(self, model, tokenizer, prefix: str) -> PrefixEntry:
+        import torch
+
+        input_ids = tokenizer(prefix, return_tensors="pt").input_ids
+        with torch.inference_mode():
+            outputs = model(input_ids=input_ids, use_cache=True)
+        return PrefixEntry(input_ids, outputs.past_key_values)
+
+    def get(self, model_name: str, model, tokenizer, prefix: str) -> PrefixEntry:
+        """Return the entry for a prefix, prefilling it on first use."""
+        key = (model_name, prefix)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            building = self._building.setdefault(key, threading.Lock())
+
+        with building:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is None:
+                entry = self._prefill(model, tokenizer, prefix)
+                with self._lock:
+                    self._building.pop(key, None)
+                    if entry.nbytes <= self.max_bytes:
+                        self._entries[key] = entry
+                        self.bytes += entry.nbytes
+                        self._shrink()
+        return entry
+
+    def _shrink(self):
+        while self.bytes > self.max_bytes and self._entries:
+            _, old = self._entries.popitem(last=False)
+            self.bytes -= old.nbytes
+            self.evictions += 1
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.nbytes
+
+    def bind(self, model_name: str, prefix: str):
+        """Record that an engine uses this prefix; returns the key to release later."""
+        key = (model_name, prefix)
+        with self._lock:
+            self._users[key] = self._users.get(key, 0) + 1
+        return key
+
+    def release(self, key):
+        """
+        Drop an engine's binding. A prefix no engine is bound to any more
+        (e.g. after a personality change) is invalidated immediately.
+        """
+        if key is None:
+            return
+        with self._lock:
+            users = self._users.get(key, 0) - 1
+            if users > 0:
+                self._users[key] = users
+                return
+            self._users.pop(key, None)
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Shared process-wide instance
+prefix_cache = PrefixCache(int(PREFIX_CACHE_MB * 1024 * 1024))
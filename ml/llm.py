@@ -7,28 +7,59 @@
 from .vectorizer import PersonalityVectorizer
 from .mood_engine import MoodEngine
 from .responder import Responder
+from .model_registry import registry, ModelLoadError
+from .batcher import get_batcher, batching_enabled
+from .kv_cache import prefix_cache
+from .context import ConversationContext, Prompt
+from .warmup import warmup
+from .deadline import Deadline, DeadlineExceeded, plan_tokens, estimated_wait, decode_rate, stopping_criteria
+from metrics import stage, record_error, record_generation, REPLIES, DEADLINES
+import executors
+import importlib.util
+from concurrent.futures import TimeoutError as FutureTimeout
+import os
+import threading
+import time
 import traceback
+import numpy as np
 
+MODEL_NAME = os.environ.get("BUDDY_MODEL_NAME", "microsoft/phi-3-mini-4k-instruct")
+GENERATION_KWARGS = {"max_new_tokens": 100, "temperature": 0.8, "do_sample": True}
+
+# Only check that the packages are installed; importing torch and
+# transformers costs seconds, so that happens on first real use
+# (model load, prefix prefill, streaming) instead of at startup.
 HAS_TRANSFORMERS = False
 try:
-    from transformers import AutoTokenizer, AutoModelForCausalLM
-    import torch
-    HAS_TRANSFORMERS = True
-except ImportError:
-    HAS_TRANSFORMERS = False
+    HAS_TRANSFORMERS = (importlib.util.find_spec("transformers") is not None
+                        and importlib.util.find_spec("torch") is not None)
 except Exception as e:
     print("Unexpected error checking transformers availability:", e)
     HAS_TRANSFORMERS = False
 
+# Generations currently running through the unbatched path (see _generate)
+_inflight = 0
+_inflight_lock = threading.Lock()
+
+# Serializes the one-time model acquire of engines that attach late
+_acquire_lock = threading.Lock()
+
 class BuddyEngine:
     def __init__(self, buddy_id: str, personality_type: str = "friendly"):
-        global HAS_TRANSFORMERS  # <<< declare first
         self.buddy_id = buddy_id
+        self.personality_type = personality_type
         self.vectorizer = PersonalityVectorizer()
         self.mood_engine = MoodEngine()
         self.model = None
         self.tokenizer = None
         self.model_name = None
+        self._prefix_key = None
+        # Requests using this engine; close() waits for the last of them
+        self._leases = 0
+        self._close_pending = False
+        self._lease_lock = threading.Lock()
+        # Recent turns, tokenized once, that prompts are assembled from
+        self.context = ConversationContext()
 
         try:
             self.personality_vector = self.vectorizer.get_vector(buddy_id, personality_type)
@@ -36,73 +67,449 @@ class BuddyEngine:
             print(f"Error initializing personality vector for {buddy_id}: {e}")
             self.personality_vector = self.vectorizer.default_vectors.get("friendly")
 
-        if HAS_TRANSFORMERS:
+        # Weights are shared process-wide through the model registry.
+        # A model registered up front (e.g. the benchmark's fake backend)
+        # is used as-is. While a background warm-up is loading the model,
+        # the engine does not wait: it replies with the Responder and
+        # attaches to the model once it is loaded (see _llm_ready).
+        if HAS_TRANSFORMERS or registry.is_loaded(MODEL_NAME):
+            self.model_name = MODEL_NAME
+            if not warmup.in_background() or registry.is_loaded(MODEL_NAME):
+                self._acquire()
+
+    def _acquire(self):
+        global HAS_TRANSFORMERS
+        with _acquire_lock:
+            if self.model is not None or self.model_name is None:
+                return
             try:
-                self.model_name = "microsoft/phi-3-mini-4k-instruct"
-                self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-                self.model = AutoModelForCausalLM.from_pretrained(self.model_name)
-                self.model.to("cpu")
-            except Exception as e:
+                self.tokenizer, self.model = registry.acquire(self.model_name)
+            except ModelLoadError as e:
                 print("Warning: Transformers model could not be loaded:", e)
                 self.model = None
                 self.tokenizer = None
+                self.model_name = None
                 HAS_TRANSFORMERS = False  # safe now
 
-    def get_reply(self, user_message: str):
+    def _llm_ready(self) -> bool:
+        if self.model is None and self.model_name is not None and registry.is_loaded(self.model_name):
+            self._acquire()
+        return self.model is not None and self.tokenizer is not None
+
+    def llm_available(self) -> bool:
+        """True if replies from this engine would use the LLM."""
+        return self._llm_ready()
+
+    def _prompt_prefix(self) -> str:
+        """Stable part of the prompt; its KV state is reused across turns."""
+        return (
+            f"You are an AI buddy with personality vector {self.personality_vector.tolist()}.\n"
+            f"Reply conversationally and helpfully.\n"
+        )
+
+    def _prompt_preamble(self, mood: str, memories=None) -> str:
+        recalled = ""
+        if memories:
+            recalled = "Things you remember about the user:\n" + "".join(f"- {m}\n" for m in memories)
+        return f"Your current mood is {mood}.\n{recalled}"
+
+    def _build_prompt(self, user_message: str, mood: str, memories=None) -> Prompt:
+        """Prompt ids: prefix, the recent turns that fit, mood/memories, the message."""
+        return self.context.build(
+            self.tokenizer, self._prompt_prefix(), self._prompt_preamble(mood, memories),
+            user_message, GENERATION_KWARGS["max_new_tokens"],
+        )
+
+    def _model_inputs(self, prompt: Prompt) -> dict:
+        """
+        generate() inputs for a prompt. With the prefix cache enabled, the
+        prefix's past_key_values are reused, so only the tokens after the
+        prefix (history and current message) are prefilled.
+        """
+        if not prefix_cache.enabled():
+            return dict(self.tokenizer.pad({"input_ids": [prompt.input_ids]}, return_tensors="pt"))
+        import torch
+
+        if self._prefix_key != (self.model_name, prompt.prefix):
+            prefix_cache.release(self._prefix_key)
+            self._prefix_key = prefix_cache.bind(self.model_name, prompt.prefix)
+        entry = prefix_cache.get(self.model_name, self.model, self.tokenizer, prompt.prefix)
+        tail = torch.tensor([prompt.input_ids[prompt.prefix_len:]], dtype=entry.input_ids.dtype)
+        input_ids = torch.cat([entry.input_ids, tail], dim=-1)
+        return {
+            "input_ids": input_ids,
+            "attention_mask": torch.ones_like(input_ids),
+            "past_key_values": entry.fresh_past(),
+        }
+
+    def _fallback_reply(self, user_message: str, mood: str) -> str:
+        try:
+            responder = Responder(self.personality_vector, mood)
+            reply = responder.generate_response(user_message)
+            if not reply:
+                reply = "Hmm, I didn't understand that. Can you rephrase?"
+            return reply
+        except Exception as e:
+            print("Responder fallback failed:", e)
+            traceback.print_exc()
+            return "Oops! Something went wrong while generating a response."
+
+    def get_reply(self, user_message: str, memories=None, deadline: Deadline = None,
+                  allow_llm: bool = True):
+        """
+        Returns (mood, reply). `memories` is an optional list of recalled
+        snippets (see ml/memory_store.py) to include in the LLM prompt,
+        which also carries the buddy's recent turns (self.context, see
+        ml/context.py); the new turn is added to them. Generation is
+        bounded by `deadline` (default: BUDDY_REPLY_BUDGET_MS from now);
+        when the LLM cannot answer in time, the Responder does.
+        allow_llm=False skips the LLM entirely (e.g. for shed requests).
+        """
         try:
-            mood = self.mood_engine.update_mood(user_message)
+            deadline = deadline or Deadline.from_budget()
+            with stage("mood"):
+                mood = self.mood_engine.update_mood(user_message)
             reply = None
+            prompt = None
 
-            if HAS_TRANSFORMERS and self.model and self.tokenizer:
+            if allow_llm and self._llm_ready():
                 try:
-                    prompt = (
-                        f"You are a {mood} AI buddy with personality vector {self.personality_vector.tolist()}.\n"
-                        f"Reply conversationally and helpfully.\n"
-                        f"User: {user_message}\nBuddy:"
-                    )
-                    inputs = self.tokenizer(prompt, return_tensors="pt")
-                    outputs = self.model.generate(
-                        **inputs,
-                        max_new_tokens=100,
-                        temperature=0.8,
-                        do_sample=True,
-                        pad_token_id=self.tokenizer.eos_token_id
-                    )
-                    response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-                    reply = response.split("Buddy:")[-1].strip()
+                    with stage("context"):
+                        prompt = self._build_prompt(user_message, mood, memories)
+                    with stage("llm"):
+                        reply = _reply_text(self._generate(prompt, deadline))
+                except DeadlineExceeded:
+                    DEADLINES.inc(1, "skipped")
+                    reply = None
                 except Exception as e:
                     print("LLM generation failed:", e)
                     traceback.print_exc()
+                    record_error("llm_generate")
                     reply = None
 
-            if not reply:
-                try:
-                    responder = Responder(self.personality_vector, mood)
-                    reply = responder.generate_response(user_message)
-                    if not reply:
-                        reply = "Hmm, I didn't understand that. Can you rephrase?"
-                except Exception as e:
-                    print("Responder fallback failed:", e)
-                    traceback.print_exc()
-                    reply = "Oops! Something went wrong while generating a response."
+            if reply:
+                REPLIES.inc(1, "llm")
+            else:
+                with stage("fallback"):
+                    reply = self._fallback_reply(user_message, mood)
+                REPLIES.inc(1, "fallback")
 
+            self.context.append(user_message, reply, prompt)
             return mood or "neutral", reply
 
         except Exception as e:
             print("BuddyEngine.get_reply error:", e)
             traceback.print_exc()
+            record_error("get_reply")
             return "confused", "Oops! Something went wrong while thinking..."
 
+    def stream_reply(self, user_message: str, memories=None, deadline: Deadline = None,
+                     allow_llm: bool = True):
+        """
+        Streaming variant of get_reply.
+        Returns (mood, chunks) where chunks yields pieces of the reply text
+        as the model produces them. Falls back to a single Responder chunk
+        when the LLM is unavailable, cannot start within the deadline, or
+        fails before producing any text.
+        """
+        deadline = deadline or Deadline.from_budget()
+        try:
+            with stage("mood"):
+                mood = self.mood_engine.update_mood(user_message) or "neutral"
+        except Exception as e:
+            print("BuddyEngine.stream_reply error:", e)
+            traceback.print_exc()
+            record_error("stream_reply")
+            return "confused", iter(["Oops! Something went wrong while thinking..."])
+
+        def chunks():
+            produced = []
+            prompt = None
+            if allow_llm and self._llm_ready():
+                try:
+                    with stage("context"):
+                        prompt = self._build_prompt(user_message, mood, memories)
+                    with stage("llm"):
+                        for text in self._stream_generate(prompt, deadline):
+                            produced.append(text)
+                            yield text
+                except DeadlineExceeded:
+                    DEADLINES.inc(1, "skipped")
+                except Exception as e:
+                    print("LLM streaming failed:", e)
+                    traceback.print_exc()
+                    record_error("llm_stream")
+            if produced:
+                REPLIES.inc(1, "llm")
+            else:
+                REPLIES.inc(1, "fallback")
+                produced.append(self._fallback_reply(user_message, mood))
+                yield produced[0]
+            self.context.append(user_message, "".join(produced).strip(), prompt)
+
+        return mood, chunks()
+
+    def _stream_generate(self, prompt: Prompt, deadline: Deadline = None):
+        """
+        Yield decoded text incrementally from a generate() running on the
+        bounded inference executor (executors.py). Stops at the first
+        hallucinated "User:" turn (or when the deadline nears) and tells
+        the generation to stop as well, or not to start if still queued.
+        """
+        from transformers import TextIteratorStreamer, StoppingCriteriaList
+
+        deadline = deadline or Deadline()
+        max_new_tokens = plan_tokens(deadline, GENERATION_KWARGS["max_new_tokens"])
+        if not max_new_tokens:
+            raise DeadlineExceeded("no time left to stream a reply")
+        cancelled = threading.Event()
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        inputs = self._model_inputs(prompt)
+        errors = []
+
+        def run():
+            if cancelled.is_set():
+                streamer.end()
+                return
+            try:
+                self.model.generate(
+                    **inputs,
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([
+                        lambda *args, **kwargs: cancelled.is_set(),
+                        deadline.stopping_criterion(),
+                    ]),
+                    pad_token_id=self.tokenizer.eos_token_id,
+                    **dict(GENERATION_KWARGS, max_new_tokens=max_new_tokens)
+                )
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+
+        generation = executors.inference.submit(run)
+        text = ""
+        emitted = 0
+        try:
+            for piece in streamer:
+                text += piece
+                cut = text.find("User:")
+                visible = (text[:cut] if cut >= 0 else text).lstrip()
+                # Hold back a short tail that might be the start of "User:"
+                safe = visible if cut >= 0 else visible[:max(0, len(visible) - 5)]
+                if len(safe) > emitted:
+                    yield safe[emitted:]
+                    emitted = len(safe)
+                if cut >= 0:
+                    break
+            else:
+                visible = text.lstrip()
+                if len(visible) > emitted:
+                    yield visible[emitted:]
+        finally:
+            cancelled.set()
+            generation.cancel()
+            if deadline.hit:
+                DEADLINES.inc(1, "truncated")
+        if errors and not emitted:
+            raise errors[0]
+
+    def _generate(self, prompt: Prompt, deadline: Deadline = None) -> str:
+        """
+        Run the model on one prompt and return the generated text. An
+        uncontended request takes the direct path (reusing the cached
+        prefix state); while other generations are in flight, prompts go
+        through the shared batcher instead.
+        Raises DeadlineExceeded up front if the deadline leaves no room for
+        a useful reply once expected queueing is accounted for.
+        """
+        global _inflight
+        deadline = deadline or Deadline()
+        max_new_tokens = GENERATION_KWARGS["max_new_tokens"]
+        if batching_enabled():
+            batcher = get_batcher(self.model_name)
+            with _inflight_lock:
+                contended = _inflight > 0 or batcher.is_busy()
+                if not contended:
+                    _inflight += 1
+            if contended:
+                wait = estimated_wait(batcher.batches_ahead(), max_new_tokens)
+                budget = plan_tokens(deadline, max_new_tokens, wait)
+                if not budget:
+                    raise DeadlineExceeded(f"~{wait:.1f}s of queued generation ahead")
+                future = batcher.submit(
+                    prompt.input_ids, deadline, **dict(GENERATION_KWARGS, max_new_tokens=budget))
+                return _await_batched(future, deadline)
+        else:
+            with _inflight_lock:
+                _inflight += 1
+        try:
+            budget = plan_tokens(deadline, max_new_tokens)
+            if not budget:
+                raise DeadlineExceeded("no time left to generate a reply")
+            inputs = self._model_inputs(prompt)
+            extra = {}
+            if deadline.at:
+                extra["stopping_criteria"] = stopping_criteria(deadline.stopping_criterion())
+            started = time.perf_counter()
+            outputs = self.model.generate(
+                **inputs,
+                pad_token_id=self.tokenizer.eos_token_id,
+                **extra,
+                **dict(GENERATION_KWARGS, max_new_tokens=budget)
+            )
+            elapsed = time.perf_counter() - started
+            prompt_len = inputs["input_ids"].shape[-1]
+            steps = outputs.shape[-1] - prompt_len
+            record_generation(steps, elapsed)
+            decode_rate.observe(steps, elapsed)
+            if deadline.hit:
+                DEADLINES.inc(1, "truncated")
+            return self.tokenizer.decode(outputs[0][prompt_len:], skip_special_tokens=True)
+        finally:
+            with _inflight_lock:
+                _inflight -= 1
+
     def update_personality(self, new_personality_type: str):
         try:
-            self.personality_vector = self.vectorizer.get_vector(self.buddy_id, new_personality_type)
+            new_vector = self.vectorizer.get_vector(self.buddy_id, new_personality_type)
+            if self._prefix_key is not None and not np.array_equal(new_vector, self.personality_vector):
+                # The cached prefix embeds the old vector; drop it
+                prefix_cache.release(self._prefix_key)
+                self._prefix_key = None
+            self.personality_vector = new_vector
+            self.personality_type = new_personality_type
         except Exception as e:
             print(f"Failed to update personality vector for {self.buddy_id}:", e)
             traceback.print_exc()
 
+    def restore_state(self, mood: str):
+        """Adopt a mood persisted elsewhere (stateless mode: the buddies table)."""
+        self.mood_engine.current_mood = mood
+
     def refresh_mood(self):
         try:
             self.mood_engine.current_mood = "neutral"
         except Exception as e:
             print(f"Failed to refresh mood for {self.buddy_id}:", e)
             traceback.print_exc()
+
+    def retain(self):
+        """Lease the engine for a request; close() is deferred until every lease is released."""
+        with self._lease_lock:
+            self._leases += 1
+        return self
+
+    def release(self):
+        with self._lease_lock:
+            self._leases -= 1
+            close = self._leases <= 0 and self._close_pending
+        if close:
+            self._close()
+
+    def close(self):
+        """
+        Release this engine's reference on the shared model, as soon as
+        no request holds a lease on it (an evicted engine may still be
+        generating a reply).
+        """
+        with self._lease_lock:
+            if self._leases > 0:
+                self._close_pending = True
+                return
+        self._close()
+
+    def _close(self):
+        prefix_cache.release(self._prefix_key)
+        self._prefix_key = None
+        if self.model_name and self.model is not None:
+            registry.release(self.model_name)
+        self.model = None
+        self.tokenizer = None
+        self.model_name = None
+
+
+def _reply_text(generated: str) -> str:
+    """The reply in generated text, cut before any made-up next "User:" turn."""
+    return generated.split("User:")[0].split("Buddy:")[-1].strip()
+
+
+# Extra wait for a batched result past its deadline before giving up on it;
+# the batch's own stopping criterion normally ends it in time.
+BATCH_RESULT_GRACE_S = 0.5
+
+
+def _await_batched(future, deadline: Deadline) -> str:
+    timeout = None if deadline.at is None else max(0.0, deadline.remaining()) + BATCH_RESULT_GRACE_S
+    try:
+        return future.result(timeout)
+    except FutureTimeout:
+        future.cancel()   # only succeeds while still queued
+        raise DeadlineExceeded("batched generation did not finish in time")
+
+
+def get_replies_batch(requests, deadline: Deadline = None, allow_llm: bool = True):
+    """
+    Bulk variant of BuddyEngine.get_reply.
+    `requests` is a list of (engine, user_message, memories) tuples; returns
+    a list of (mood, reply) in the same order. Moods are classified in one
+    vectorized pass, every LLM prompt is submitted to the batcher up front
+    so they share batched generate() calls, and anything the LLM does not
+    answer (including prompts that would not finish before the shared
+    deadline) falls back to the Responder.
+    """
+    if not requests:
+        return []
+    deadline = deadline or Deadline.from_budget()
+    max_new_tokens = GENERATION_KWARGS["max_new_tokens"]
+    results = [None] * len(requests)
+    with stage("mood"):
+        classified = MoodEngine.classify_batch([message for _, message, _ in requests])
+
+    futures, prompts = {}, {}
+    for i, ((engine, message, memories), (mood, _)) in enumerate(zip(requests, classified)):
+        try:
+            mood = engine.mood_engine.apply_mood(mood) or "neutral"
+        except Exception as e:
+            print("get_replies_batch mood error:", e)
+            mood = "neutral"
+        results[i] = (mood, None)
+        if allow_llm and engine._llm_ready():
+            try:
+                prompt = prompts[i] = engine._build_prompt(message, mood, memories)
+                if batching_enabled():
+                    batcher = get_batcher(engine.model_name)
+                    wait = estimated_wait(batcher.batches_ahead(), max_new_tokens)
+                    budget = plan_tokens(deadline, max_new_tokens, wait)
+                    if not budget:
+                        raise DeadlineExceeded(f"~{wait:.1f}s of queued generation ahead")
+                    futures[i] = batcher.submit(
+                        prompt.input_ids, deadline, **dict(GENERATION_KWARGS, max_new_tokens=budget)
+                    )
+                else:
+                    results[i] = (mood, _reply_text(engine._generate(prompt, deadline)))
+            except DeadlineExceeded:
+                DEADLINES.inc(1, "skipped")
+            except Exception as e:
+                print("LLM generation failed:", e)
+                traceback.print_exc()
+                record_error("llm_generate")
+
+    with stage("llm"):
+        for i, future in futures.items():
+            try:
+                results[i] = (results[i][0], _reply_text(_await_batched(future, deadline)))
+            except DeadlineExceeded:
+                DEADLINES.inc(1, "skipped")
+            except Exception as e:
+                print("LLM generation failed:", e)
+                record_error("llm_generate")
+
+    for i, (engine, message, _) in enumerate(requests):
+        mood, reply = results[i]
+        if reply:
+            REPLIES.inc(1, "llm")
+        else:
+            results[i] = (mood, engine._fallback_reply(message, mood))
+            REPLIES.inc(1, "fallback")
+        engine.context.append(message, results[i][1], prompts.get(i))
+    return results
@@ -0,0 +1,229 @@
+# ===================================================================
+# Build-A-Buddy Memory Store
+# Vector memory backed by the `memory` table.
+# Snippets are embedded with TextEmbedder and stored as compact
+# float16/float32 blobs. For recall, each user's embeddings live in one
+# contiguous float32 matrix, loaded lazily on first access and grown
+# incrementally on insert, so a top-k query is a single matrix-vector
+# product instead of a SQL scan.
+# ===================================================================
+
+import os
+import threading
+import traceback
+from collections import OrderedDict
+
+import numpy as np
+
+from database import db
+from .vectorizer import TextEmbedder
+
+EMBEDDING_DIM = int(os.environ.get("BUDDY_MEMORY_DIM", "256"))
+STORAGE_DTYPE = np.dtype(os.environ.get("BUDDY_MEMORY_DTYPE", "float16"))
+MAX_LOADED_USERS = int(os.environ.get("BUDDY_MEMORY_MAX_USERS", "1000"))
+
+
+def serialize(vec: np.ndarray) -> bytes:
+    return np.asarray(vec, dtype=STORAGE_DTYPE).tobytes()
+
+
+def deserialize(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype=STORAGE_DTYPE).astype(np.float32)
+
+
+class _UserIndex:
+    """Contiguous embedding matrix plus row ids for one user."""
+
+    def __init__(self, dim: int, ids=None, matrix=None):
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()   # one catch-up at a time (shared mode)
+        n = 0 if ids is None else len(ids)
+        capacity = max(64, n)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.matrix = np.zeros((capacity, dim), dtype=np.float32)
+        if n:
+            self.ids[:n] = ids
+            self.matrix[:n] = matrix
+        self.count = n
+
+    def last_id(self) -> int:
+        with self.lock:
+            return int(self.ids[self.count - 1]) if self.count else 0
+
+    def append(self, row_id: int, vec: np.ndarray):
+        with self.lock:
+            if self.count == len(self.ids):
+                # Amortized O(1) growth: double the backing arrays
+                capacity = len(self.ids) * 2
+                self.ids = np.resize(self.ids, capacity)
+                grown = np.zeros((capacity, self.matrix.shape[1]), dtype=np.float32)
+                grown[:self.count] = self.matrix[:self.count]
+                self.matrix = grown
+            self.ids[self.count] = row_id
+            self.matrix[self.count] = vec
+            self.count += 1
+
+    def top_k(self, query: np.ndarray, k: int):
+        with self.lock:
+            n = self.count
+            if n == 0:
+                return [], []
+            scores = self.matrix[:n] @ query
+            ids = self.ids[:n]
+        k = min(k, n)
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return ids[best].tolist(), scores[best].tolist()
+
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + self.ids.nbytes
+
+
+class MemoryStore:
+    """
+    add(user_id, content) embeds and stores a snippet.
+    recall(user_id, query, k) returns up to k (content, score) pairs,
+    best first, whose cosine similarity is at least min_score.
+
+    With shared=True (several processes writing the same table), loaded
+    matrices are not appended to on insert; instead each recall first
+    pulls in rows newer than the last one loaded, so memories written by
+    other workers are seen too.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, max_users: int = MAX_LOADED_USERS,
+                 shared: bool = False):
+        self.embedder = TextEmbedder(dim)
+        self.dim = dim
+        self.max_users = max_users
+        self.shared = shared
+        self._indexes = OrderedDict()   # user_id -> _UserIndex (LRU)
+        self._lock = threading.Lock()
+        self._loading = {}              # user_id -> Lock held while loading
+
+    # ---------------------------
+    # Loading
+    # ---------------------------
+    def _rows_after(self, user_id: int, after_id: int = 0):
+        return db.get_connection().execute(
+            "SELECT id, embedding FROM memory WHERE user_id=? AND id > ? AND embedding IS NOT NULL ORDER BY id",
+            (user_id, after_id),
+        ).fetchall()
+
+    def _catch_up(self, user_id: int, index: _UserIndex):
+        row_bytes = self.dim * STORAGE_DTYPE.itemsize
+        with index.sync_lock:
+            for r in self._rows_after(user_id, index.last_id()):
+                if len(r["embedding"]) == row_bytes:
+                    index.append(r["id"], deserialize(r["embedding"]))
+
+    def _load(self, user_id: int) -> _UserIndex:
+        rows = self._rows_after(user_id)
+        row_bytes = self.dim * STORAGE_DTYPE.itemsize
+        rows = [r for r in rows if len(r["embedding"]) == row_bytes]
+        if not rows:
+            return _UserIndex(self.dim)
+        ids = np.fromiter((r["id"] for r in rows), dtype=np.int64, count=len(rows))
+        matrix = np.frombuffer(b"".join(r["embedding"] for r in rows), dtype=STORAGE_DTYPE)
+        return _UserIndex(self.dim, ids, matrix.reshape(len(rows), self.dim).astype(np.float32))
+
+    def _index(self, user_id: int, create: bool = True):
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+                return index
+            if not create:
+                return None
+            loading = self._loading.setdefault(user_id, threading.Lock())
+
+        # One loader per user; others wait for it instead of re-reading
+        with loading:
+            with self._lock:
+                index = self._indexes.get(user_id)
+            if index is None:
+                index = self._load(user_id)
+                with self._lock:
+                    self._indexes[user_id] = index
+                    self._loading.pop(user_id, None)
+                    while len(self._indexes) > self.max_users:
+                        self._indexes.popitem(last=False)
+        return index
+
+    # ---------------------------
+    # Public API
+    # ---------------------------
+    def add(self, user_id: int, content: str):
+        """Embed and store a snippet; returns the new memory id (or None)."""
+        return self.add_many([(user_id, content)])[0]
+
+    def add_many(self, items):
+        """
+        Embed and store many (user_id, content) snippets in one transaction
+        (joining the caller's transaction if one is open). Returns the new
+        memory ids in order, or Nones if the insert failed.
+        """
+        try:
+            vecs = self.embedder.embed_batch([content for _, content in items])
+            blobs = [serialize(v) for v in vecs]
+            row_ids = []
+            with db.transaction() as conn:
+                for (user_id, content), blob in zip(items, blobs):
+                    cur = conn.execute(
+                        "INSERT INTO memory (user_id, embedding, content) VALUES (?, ?, ?)",
+                        (user_id, blob, content),
+                    )
+                    row_ids.append(cur.lastrowid)
+            # Loaded users get the rows appended in place; others pick them
+            # up from the table when they are first loaded. Shared stores
+            # pick them up in recall (see _catch_up).
+            for (user_id, _), blob, row_id in ([] if self.shared else zip(items, blobs, row_ids)):
+                index = self._index(user_id, create=False)
+                if index is not None:
+                    index.append(row_id, deserialize(blob))
+            return row_ids
+        except Exception as e:
+            print("MemoryStore.add_many error:", e)
+            traceback.print_exc()
+            return [None] * len(items)
+
+    def recall(self, user_id: int, query: str, k: int = 3, min_score: float = 0.2):
+        try:
+            q = self.embedder.embed(query)
+            if not q.any():
+                return []
+            index = self._index(user_id)
+            if self.shared:
+                self._catch_up(user_id, index)
+            ids, scores = index.top_k(q, k)
+            hits = [(i, s) for i, s in zip(ids, scores) if s >= min_score]
+            if not hits:
+                return []
+            placeholders = ",".join("?" * len(hits))
+            rows = db.get_connection().execute(
+                f"SELECT id, content FROM memory WHERE id IN ({placeholders})",
+                [i for i, _ in hits],
+            ).fetchall()
+            contents = {r["id"]: r["content"] for r in rows}
+            return [(contents[i], s) for i, s in hits if i in contents]
+        except Exception as e:
+            print(f"MemoryStore.recall error for user {user_id}:", e)
+            traceback.print_exc()
+            return []
+
+    def forget(self, user_id: int = None):
+        """Drop loaded matrices (all users, or one) so they reload from the table."""
+        with self._lock:
+            if user_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(user_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            indexes = list(self._indexes.values())
+        return {
+            "loaded_users": len(indexes),
+            "memories": sum(i.count for i in indexes),
+            "bytes": sum(i.nbytes() for i in indexes),
+        }
@@ -0,0 +1,161 @@
+# ===================================================================
+# Build-A-Buddy Model Registry
+# Process-wide cache of tokenizer/model pairs shared by every BuddyEngine.
+# Each model is loaded at most once per process, lazily and thread-safely,
+# and reference counted so it can be unloaded when no engine uses it.
+# ===================================================================
+
+import threading
+import traceback
+
+from . import inference_mode
+
+
+class ModelLoadError(RuntimeError):
+    """Raised when a model could not be loaded (and will not be retried)."""
+
+
+class _Entry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokenizer = None
+        self.model = None
+        self.refcount = 0
+        self.pinned = False
+        self.error = None
+
+
+def _default_loader(model_name: str):
+    """
+    Load a Hugging Face tokenizer/model pair onto the CPU, in the dtype,
+    threading and execution mode chosen in ml/inference_mode.py.
+    """
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+
+    inference_mode.configure_threads()
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModelForCausalLM.from_pretrained(model_name, **inference_mode.load_kwargs())
+    model.to("cpu")
+    model.eval()
+    model = inference_mode.optimize(model)
+    print(f"🧮 Loaded {model_name} with inference mode {inference_mode.describe()}")
+    return tokenizer, model
+
+
+class ModelRegistry:
+    """
+    Shares one set of weights per model name across all engines.
+
+    acquire() loads on first use and bumps the reference count;
+    release() drops it again. Models are kept loaded at refcount zero
+    unless unload() is called (or auto_unload is enabled), so buddies
+    that come and go do not thrash the weights in and out of memory.
+    """
+
+    def __init__(self, loader=None, auto_unload: bool = False):
+        self._loader = loader or _default_loader
+        self._auto_unload = auto_unload
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, model_name: str) -> _Entry:
+        with self._lock:
+            entry = self._entries.get(model_name)
+            if entry is None:
+                entry = self._entries[model_name] = _Entry()
+            return entry
+
+    def load(self, model_name: str):
+        """
+        Load a model (if needed) without taking a reference.
+        Returns (tokenizer, model). Concurrent callers block on the same
+        per-model lock, so the weights are only ever read from disk once.
+        A failed load is remembered and re-raised as ModelLoadError.
+        """
+        entry = self._entry(model_name)
+        with entry.lock:
+            if entry.model is not None:
+                return entry.tokenizer, entry.model
+            if entry.error is not None:
+                raise ModelLoadError(f"{model_name} failed to load: {entry.error}")
+            try:
+                entry.tokenizer, entry.model = self._loader(model_name)
+            except Exception as e:
+                print(f"ModelRegistry: could not load {model_name}:", e)
+                traceback.print_exc()
+                entry.error = e
+                raise ModelLoadError(f"{model_name} failed to load: {e}") from e
+            return entry.tokenizer, entry.model
+
+    def acquire(self, model_name: str):
+        """Load (if needed) and take a reference. Returns (tokenizer, model)."""
+        tokenizer, model = self.load(model_name)
+        entry = self._entry(model_name)
+        with entry.lock:
+            entry.refcount += 1
+        return tokenizer, model
+
+    def release(self, model_name: str):
+        """Drop a reference taken by acquire()."""
+        with self._lock:
+            entry = self._entries.get(model_name)
+        if entry is None:
+            return
+        with entry.lock:
+            entry.refcount = max(0, entry.refcount - 1)
+            if self._auto_unload and entry.refcount == 0 and not entry.pinned:
+                entry.tokenizer = None
+                entry.model = None
+
+    def register(self, model_name: str, tokenizer, model, pinned: bool = True):
+        """Install an already-built tokenizer/model pair under a name."""
+        entry = self._entry(model_name)
+        with entry.lock:
+            entry.tokenizer = tokenizer
+            entry.model = model
+            entry.error = None
+            entry.pinned = pinned
+
+    def unload(self, model_name: str, force: bool = False) -> bool:
+        """
+        Free a model's weights. Refuses while references are held
+        unless force=True. Returns True if the model was unloaded.
+        """
+        with self._lock:
+            entry = self._entries.get(model_name)
+        if entry is None:
+            return False
+        with entry.lock:
+            if entry.refcount > 0 and not force:
+                return False
+            entry.tokenizer = None
+            entry.model = None
+            entry.error = None
+            entry.pinned = False
+            return True
+
+    def is_loaded(self, model_name: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(model_name)
+        return entry is not None and entry.model is not None
+
+    def refcount(self, model_name: str) -> int:
+        with self._lock:
+            entry = self._entries.get(model_name)
+        return entry.refcount if entry else 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            items = list(self._entries.items())
+        return {
+            name: {
+                "loaded": entry.model is not None,
+                "refcount": entry.refcount,
+                "failed": entry.error is not None,
+            }
+            for name, entry in items
+        }
+
+
+# Shared process-wide instance
+registry = ModelRegistry()
@@ -4,42 +4,167 @@
 # ===================================================================
 
 import random
-from typing import Literal
+import re
+import traceback
+from typing import Literal, List, Tuple
+
+import numpy as np
+
+# Trigger lexicons, in priority order (earlier moods win ties)
+MOOD_LEXICONS = {
+    "happy": ["love", "great", "thanks", "awesome", "yay", "good"],
+    "annoyed": ["hate", "bad", "angry", "upset", "frustrated"],
+    "sad": ["tired", "sad", "lonely", "down", "depressed"],
+}
+MOODS = list(MOOD_LEXICONS)
+MOOD_INDEX = {mood: i for i, mood in enumerate(MOODS)}
+
+
+def _compile(lexicons: dict) -> re.Pattern:
+    """
+    One case-insensitive regex for every lexicon, with a named group per
+    mood and word boundaries, so "good" no longer matches "goodbye" and
+    "down" no longer matches "download".
+    """
+    groups = []
+    for mood, words in lexicons.items():
+        alternation = "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+        groups.append(f"(?P<{mood}>{alternation})")
+    return re.compile(r"\b(?:" + "|".join(groups) + r")\b", re.IGNORECASE)
+
 
 class MoodEngine:
     """
     Simple mood engine to classify the AI buddy's mood from user messages.
     """
 
+    pattern = _compile(MOOD_LEXICONS)
+
     def __init__(self):
         self.current_mood: Literal["neutral", "happy", "sad", "annoyed"] = "neutral"
 
+    @classmethod
+    def classify(cls, message: str) -> Tuple[str, float]:
+        """
+        Return (mood, confidence) for a single message without touching state.
+        Confidence is the winning mood's share of all trigger hits; messages
+        with no triggers are ("neutral", 0.0).
+        """
+        counts = [0] * len(MOODS)
+        for match in cls.pattern.finditer(message):
+            counts[MOOD_INDEX[match.lastgroup]] += 1
+        total = sum(counts)
+        if total == 0:
+            return "neutral", 0.0
+        best = counts.index(max(counts))   # first (priority) mood wins ties
+        return MOODS[best], counts[best] / total
+
+    @classmethod
+    def classify_batch(cls, messages: List[str]) -> List[Tuple[str, float]]:
+        """
+        Classify many messages in one regex pass over their concatenation.
+        Match positions are mapped back to messages with a vectorized
+        searchsorted, and per-message counts are accumulated with bincount.
+        """
+        if not messages:
+            return []
+        texts = [m or "" for m in messages]
+        # "\n" separators are non-word characters, so \b never spans messages
+        joined = "\n".join(texts)
+        starts = np.cumsum([0] + [len(t) + 1 for t in texts[:-1]])
+
+        positions, moods = [], []
+        for match in cls.pattern.finditer(joined):
+            positions.append(match.start())
+            moods.append(MOOD_INDEX[match.lastgroup])
+
+        counts = np.zeros((len(texts), len(MOODS)))
+        if positions:
+            owners = np.searchsorted(starts, positions, side="right") - 1
+            flat = owners * len(MOODS) + np.asarray(moods)
+            counts = np.bincount(flat, minlength=counts.size).reshape(counts.shape).astype(float)
+
+        totals = counts.sum(axis=1)
+        best = counts.argmax(axis=1)
+        confidence = np.divide(counts[np.arange(len(texts)), best], totals,
+                               out=np.zeros(len(texts)), where=totals > 0)
+        return [
+            (MOODS[b], float(c)) if t > 0 else ("neutral", 0.0)
+            for b, c, t in zip(best, confidence, totals)
+        ]
+
     def update_mood(self, message: str) -> str:
         """
         Updates and returns the buddy's mood based on the message content.
         Uses keyword matching and randomness for variability.
         """
         try:
-            msg = message.lower()
+            mood, _ = self.classify(message)
+            return self.apply_mood(mood)
 
-            # Positive mood triggers
-            if any(word in msg for word in ["love", "great", "thanks", "awesome", "yay", "good"]):
-                self.current_mood = "happy"
+        except Exception as e:
+            print("MoodEngine.update_mood error:", e)
+            return "neutral"
+
+    def apply_mood(self, mood: str) -> str:
+        """Move to a classified mood (e.g. from classify_batch) and return the new mood."""
+        if mood != "neutral":
+            self.current_mood = mood
 
-            # Negative mood triggers
-            elif any(word in msg for word in ["hate", "bad", "angry", "upset", "frustrated"]):
-                self.current_mood = "annoyed"
+        # Default or subtle randomness
+        else:
+            self.current_mood = random.choice([self.current_mood, "neutral"])
 
-            # Sad triggers
-            elif any(word in msg for word in ["tired", "sad", "lonely", "down", "depressed"]):
-                self.current_mood = "sad"
+        return self.current_mood
 
-            # Default or subtle randomness
-            else:
-                self.current_mood = random.choice([self.current_mood, "neutral"])
 
-            return self.current_mood
+def backfill_moods(after_id: int = 0, batch_size: int = 5000) -> int:
+    """
+    Classify stored user messages (turn id > after_id) and record the results
+    in the `moods` table, one transaction per batch. Progress is printed with
+    the last turn id, which can be passed back as after_id to resume.
+    Returns the number of rows added.
+    """
+    from database import db
 
+    conn = db.get_connection()
+    last_id = after_id
+    added = 0
+    while True:
+        rows = conn.execute(
+            """
+            SELECT id, user_id, user_message AS message, timestamp FROM turns
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+            """,
+            (last_id, batch_size),
+        ).fetchall()
+        if not rows:
+            return added
+        results = MoodEngine.classify_batch([r["message"] for r in rows])
+        try:
+            with db.transaction() as tx:
+                tx.executemany(
+                    "INSERT INTO moods (user_id, mood, confidence, detected_at) VALUES (?, ?, ?, ?)",
+                    [
+                        (r["user_id"], mood, confidence, r["timestamp"])
+                        for r, (mood, confidence) in zip(rows, results)
+                    ],
+                )
         except Exception as e:
-            print("MoodEngine.update_mood error:", e)
-            return "neutral"
+            print("backfill_moods error:", e)
+            traceback.print_exc()
+            return added
+        added += len(rows)
+        last_id = rows[-1]["id"]
+        print(f"🧠 Backfilled {added} moods (last turn id {last_id})...")
+
+
+if __name__ == "__main__":
+    import os
+    import sys
+
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    start = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+    print(f"✅ Done: {backfill_moods(start)} moods recorded.")
@@ -1,82 +1,168 @@
 # ===================================================================
 # Build-A-Buddy Personality Vectorizer
 # Handles personality vector retrieval and updates with safe DB fallback
+# Also embeds text snippets for the memory table (see ml/memory_store.py)
 # ===================================================================
 
 import numpy as np
-import sqlite3
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
 from typing import Any
-from database.db_init import DB_PATH
+from database import db
 import traceback
 
+def _frozen(values) -> np.ndarray:
+    vec = np.array(values, dtype=float)
+    vec.setflags(write=False)
+    return vec
+
+# Shared, read-only default vectors: engines reference these directly
+# instead of each holding its own copy.
+DEFAULT_VECTORS = {
+    "friendly": _frozen([0.9, 0.8, 0.4, 0.7, 0.6]),
+    "sarcastic": _frozen([0.2, 0.9, 0.5, 0.3, 0.4]),
+    "romantic": _frozen([0.7, 0.6, 0.5, 0.9, 0.7]),
+    "motivational": _frozen([0.8, 0.3, 0.9, 0.6, 0.5]),
+}
+NEUTRAL_VECTOR = _frozen([0.5] * 5)
+CACHE_SIZE = int(os.environ.get("BUDDY_PERSONALITY_CACHE_SIZE", "50000"))
+
 class PersonalityVectorizer:
     """
     Manages personality vectors for buddies.
     Tries to load from SQLite database, otherwise falls back to defaults.
     Vector layout: [friendliness, humor, excitement, empathy, curiosity]
+
+    Vectors are cached process-wide (shared by every vectorizer instance)
+    keyed by (buddy_id, personality_type). Reads are served from memory;
+    SQLite is only touched on a cache miss or a real change in update_vector.
+    Cached vectors are read-only; callers must not modify them in place.
     """
 
+    _cache = OrderedDict()      # (buddy_id, personality_type) -> vector
+    _overrides = {}             # buddy_id -> vector set via update_vector
+    _lock = threading.Lock()
+
     def __init__(self):
-        self.default_vectors = {
-            "friendly": np.array([0.9, 0.8, 0.4, 0.7, 0.6]),
-            "sarcastic": np.array([0.2, 0.9, 0.5, 0.3, 0.4]),
-            "romantic": np.array([0.7, 0.6, 0.5, 0.9, 0.7]),
-            "motivational": np.array([0.8, 0.3, 0.9, 0.6, 0.5]),
-        }
+        self.default_vectors = DEFAULT_VECTORS
+
+    @classmethod
+    def _remember(cls, key, vec):
+        with cls._lock:
+            cls._cache[key] = vec
+            cls._cache.move_to_end(key)
+            while len(cls._cache) > CACHE_SIZE:
+                cls._cache.popitem(last=False)
 
     def get_vector(self, buddy_id: str, personality_type: str = "friendly") -> np.ndarray:
         """
-        Retrieve personality vector for a buddy from DB.
+        Retrieve personality vector for a buddy.
         Falls back to defaults and inserts into DB if missing.
         """
+        key = (buddy_id, personality_type)
+        with self._lock:
+            override = self._overrides.get(buddy_id)
+            if override is not None:
+                return override
+            vec = self._cache.get(key)
+            if vec is not None:
+                self._cache.move_to_end(key)
+                return vec
+
+        vec = self.default_vectors.get(personality_type, NEUTRAL_VECTOR)
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cur = conn.cursor()
-            cur.execute(
-                "SELECT kindness, excitement, humor, current_mood, 0 FROM buddies WHERE buddy_id=?",
-                (buddy_id,)
-            )
-            row = cur.fetchone()
-            conn.close()
-
-            if row:
-                return np.array(row[:5], dtype=float)
-            else:
-                vec = self.default_vectors.get(personality_type, np.array([0.5]*5))
+            row = db.get_connection().execute(
+                "SELECT 1 FROM buddies WHERE buddy_id=?", (buddy_id,)
+            ).fetchone()
+            if not row:
                 try:
-                    conn = sqlite3.connect(DB_PATH)
-                    cur = conn.cursor()
-                    cur.execute(
-                        "INSERT INTO buddies "
-                        "(buddy_id, personality_type, kindness, excitement, humor, current_mood) "
-                        "VALUES (?, ?, ?, ?, ?, ?)",
-                        (buddy_id, personality_type, float(vec[0]), float(vec[1]), float(vec[2]), "neutral")
-                    )
-                    conn.commit()
-                    conn.close()
+                    with db.transaction() as conn:
+                        conn.execute(
+                            "INSERT OR IGNORE INTO buddies "
+                            "(buddy_id, personality_type, kindness, excitement, humor, current_mood) "
+                            "VALUES (?, ?, ?, ?, ?, ?)",
+                            (buddy_id, personality_type, float(vec[0]), float(vec[1]), float(vec[2]), "neutral")
+                        )
                 except Exception as e:
                     print(f"Failed to initialize buddy {buddy_id} in DB:", e)
                     traceback.print_exc()
-                return vec
-
+                    return vec
         except Exception as e:
             print(f"Error fetching personality vector for {buddy_id}:", e)
             traceback.print_exc()
-            return self.default_vectors.get(personality_type, np.array([0.5]*5))
+            return vec
+
+        self._remember(key, vec)
+        return vec
 
     def update_vector(self, buddy_id: str, new_vector: Any):
         """
-        Update the buddy's personality vector in the database.
+        Update the buddy's personality vector (cache and database).
+        No-op if the vector is unchanged.
         """
+        vec = _frozen(new_vector)
+        with self._lock:
+            current = self._overrides.get(buddy_id)
+            if current is not None and np.array_equal(current, vec):
+                return
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cur = conn.cursor()
-            cur.execute(
-                "UPDATE buddies SET kindness=?, excitement=?, humor=? WHERE buddy_id=?",
-                (float(new_vector[0]), float(new_vector[1]), float(new_vector[2]), buddy_id)
-            )
-            conn.commit()
-            conn.close()
+            with db.transaction() as conn:
+                conn.execute(
+                    "UPDATE buddies SET kindness=?, excitement=?, humor=? WHERE buddy_id=?",
+                    (float(vec[0]), float(vec[1]), float(vec[2]), buddy_id)
+                )
         except Exception as e:
             print(f"Error updating personality vector for {buddy_id}:", e)
             traceback.print_exc()
+            return
+        with self._lock:
+            self._overrides[buddy_id] = vec
+
+    @classmethod
+    def invalidate(cls, buddy_id: str = None):
+        """Forget cached vectors for one buddy (or all)."""
+        with cls._lock:
+            if buddy_id is None:
+                cls._cache.clear()
+                cls._overrides.clear()
+                return
+            cls._overrides.pop(buddy_id, None)
+            for key in [k for k in cls._cache if k[0] == buddy_id]:
+                del cls._cache[key]
+
+
+class TextEmbedder:
+    """
+    Lightweight text embedder for the memory table.
+    Uses signed feature hashing of word unigrams and bigrams into a fixed
+    number of dimensions, L2-normalized, so cosine similarity is a dot
+    product. Hashes are stable across processes (crc32), which matters
+    because embeddings are persisted.
+    """
+
+    _word_re = re.compile(r"[a-z0-9']+")
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _features(self, text: str):
+        words = self._word_re.findall(text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for feature in self._features(text):
+            h = zlib.crc32(feature.encode("utf-8"))
+            vec[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec /= norm
+        return vec
+
+    def embed_batch(self, texts) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self.embed(t) for t in texts])
@@ -0,0 +1,80 @@
+# ===================================================================
+# Build-A-Buddy Model Warm-up
+# Loads the LLM in a background thread at startup and runs one tiny
+# generation so the first real request does not pay for weight loading,
+# lazy kernel initialization or allocator growth. Until warm-up finishes,
+# engines answer with the Responder and /ready reports "not ready".
+# ===================================================================
+
+import os
+import threading
+import time
+import traceback
+
+from .model_registry import registry
+
+WARMUP_ENABLED = os.environ.get("BUDDY_WARMUP", "1") == "1"
+WARMUP_PROMPT = "Hello"
+
+IDLE, LOADING, READY, FAILED, SKIPPED = "idle", "loading", "ready", "failed", "skipped"
+
+
+class Warmup:
+    def __init__(self):
+        self.state = IDLE
+        self.error = None
+        self.seconds = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def in_background(self) -> bool:
+        """True once a background warm-up has been started for this process."""
+        return self._thread is not None
+
+    def start(self, model_name: str, enabled: bool = True):
+        """Start warming `model_name` in a daemon thread (once per process)."""
+        with self._lock:
+            if self._thread is not None or self.state != IDLE:
+                return
+            if not enabled:
+                self.state = SKIPPED
+                return
+            self.state = LOADING
+            self._thread = threading.Thread(
+                target=self._run, args=(model_name,), name="model-warmup", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self, model_name: str):
+        started = time.perf_counter()
+        try:
+            tokenizer, model = registry.load(model_name)
+            inputs = tokenizer(WARMUP_PROMPT, return_tensors="pt")
+            model.generate(**inputs, max_new_tokens=1, do_sample=False,
+                           pad_token_id=tokenizer.eos_token_id)
+            self.state = READY
+        except Exception as e:
+            print(f"Model warm-up for {model_name} failed; serving Responder replies:", e)
+            traceback.print_exc()
+            self.error = str(e)
+            self.state = FAILED
+        finally:
+            self.seconds = round(time.perf_counter() - started, 3)
+            if self.state == READY:
+                print(f"🔥 {model_name} warmed up in {self.seconds}s")
+
+    def finished(self) -> bool:
+        return self.state in (READY, FAILED, SKIPPED)
+
+    def wait(self, timeout: float = None) -> bool:
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        return self.finished()
+
+    def status(self) -> dict:
+        return {"state": self.state, "seconds": self.seconds, "error": self.error}
+
+
+# Shared process-wide instance
+warmup = Warmup()
@@ -0,0 +1,70 @@
+# backend/serve.py
+
+import argparse
+import os
+import sys
+
+# ---------------------------
+# Build-A-Buddy multi-worker launcher
+# ---------------------------
+# Runs main:app under uvicorn with one process per worker, configured so
+# the workers can share load:
+#   * BUDDY_STATELESS=1: buddy mood is read from / written to the
+#     buddies table on every turn, so any worker can serve any buddy
+#   * BUDDY_INFERENCE_DTYPE=auto, on CPUs with native bf16 (AVX512-BF16
+#     or AMX): weights stay in the checkpoint dtype (bf16 for phi-3),
+#     memory-mapped from safetensors, so every worker maps the same
+#     page-cache copy instead of holding a private one. Elsewhere bf16
+#     would be emulated and much slower, so workers load fp32 and each
+#     holds its own copy of the weights: mind the memory per worker.
+#   * BUDDY_TORCH_THREADS = cores / workers, so workers don't oversubscribe
+# Explicit environment settings always win over these defaults.
+#
+#   python serve.py --workers 4 --port 8000
+# ---------------------------
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(BASE_DIR)
+
+
+def shared_weights_dtype() -> str:
+    """auto (mmap-shared checkpoint weights) where bf16 runs natively, else fp32."""
+    try:
+        from ml.inference_mode import bf16_supported
+        return "auto" if bf16_supported() else "fp32"
+    except ImportError:
+        return "fp32"
+
+
+def main(argv=None):
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Run Build-A-Buddy with several worker processes")
+    parser.add_argument("--workers", type=int, default=cores)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--threads-per-worker", type=int, default=0,
+                        help="torch intra-op threads per worker (default: cores / workers)")
+    args = parser.parse_args(argv)
+
+    workers = max(1, args.workers)
+    if workers > 1:
+        os.environ.setdefault("BUDDY_STATELESS", "1")
+        if "BUDDY_INFERENCE_DTYPE" not in os.environ:
+            os.environ["BUDDY_INFERENCE_DTYPE"] = shared_weights_dtype()
+    threads = args.threads_per_worker or max(1, cores // workers)
+    os.environ.setdefault("BUDDY_TORCH_THREADS", str(threads))
+
+    # Migrate once here rather than racing from every worker's startup
+    from database.db_init import migrate_database
+    migrate_database()
+
+    import uvicorn
+    print(f"🚀 Starting {workers} worker(s) on {args.host}:{args.port} "
+          f"({os.environ['BUDDY_TORCH_THREADS']} torch threads each, "
+          f"dtype={os.environ.get('BUDDY_INFERENCE_DTYPE', 'fp32')}, "
+          f"stateless={os.environ.get('BUDDY_STATELESS', '0')})")
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=workers, app_dir=BASE_DIR)
+
+
+if __name__ == "__main__":
+    main()